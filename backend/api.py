@@ -1,32 +1,85 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile
+import time
+_IMPORT_STARTED = time.time()
+
+from fastapi import FastAPI, HTTPException, File, UploadFile, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional, Tuple, Any
-import trimesh
-from io import BytesIO
-import numpy as np
 import base64
 import os
+import json
+import asyncio
+import threading
 
+# .env first: core modules read their settings from the environment at import time
+from core.db import load_env
+load_env()
 
+from core.db import authenticate_user, save_user, save_history, get_history, get_history_entry, get_db_connection
+from core.stl_io import STLFormatError, STLTooLargeError, check_stl_size
+from core.admission import AdmissionController, AdmissionRejected, JobCost
+from core.profiling import should_profile, maybe_profiled, load_profile, is_admin, PROFILE_ADMIN_TOKEN
+from core.catalogue import VehicleCatalogue, CUSTOM_VEHICLE
 
-from core.engine import (
-    load_trunk,
-    bags_data,
-    export_scene_to_stl,
-    calculate_space_utilization,
-    optimized_packing
-)
+app = FastAPI()
 
-from core.db import authenticate_user, save_user, save_history, get_history, get_db_connection
+# Vehicles selectable by car_model (built-in trunks plus VEHICLE_DIR)
+catalogue = VehicleCatalogue()
 
-app = FastAPI()
+# The packing engine (trimesh/numpy/scipy) is imported lazily: by the warm-up
+# thread right after startup, or by the first request that needs it.
+def get_service():
+    from core import service
+    return service
+
+# Startup and readiness timings reported by /ready
+readiness = {
+    "ready": False,
+    "startup_seconds": None,
+    "engine_import_seconds": None,
+    "warmup_seconds": None,
+    "db_probe_seconds": None,
+    "db_available": None,
+    "warmup_error": None,
+    "vehicles_ready": None,
+}
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") != "0"
+
+def probe_db():
+    started = time.time()
+    readiness["db_available"] = get_db_connection() is not None
+    readiness["db_probe_seconds"] = round(time.time() - started, 3)
+
+def warm_up():
+    started = time.time()
+    try:
+        service = get_service()
+        readiness["engine_import_seconds"] = round(time.time() - started, 3)
+        # Preprocess every catalogue trunk in this thread so the first request
+        # for any vehicle hits the cache. The worker pool is only started by
+        # the first /optimize/batch or /compare, so idle workers never fork it
+        readiness["vehicles_ready"] = catalogue.ingest(load=service.get_trunk)
+    except Exception as e:
+        logger.error(f"WARMUP: failed: {e}")
+        readiness["warmup_error"] = str(e)
+    readiness["warmup_seconds"] = round(time.time() - started, 3)
+    readiness["ready"] = True
+    logger.info(f"WARMUP: finished in {readiness['warmup_seconds']}s")
 
 @app.on_event("startup")
 async def startup_event():
     print("LOG: Server starting up...")
-    # Check DB connection to trigger logs
-    get_db_connection()
+    # DB probe (up to the 2 s server-selection timeout) and trunk warm-up run
+    # off the critical path so the server starts accepting requests at once.
+    threading.Thread(target=probe_db, daemon=True).start()
+    if WARMUP_ON_STARTUP:
+        threading.Thread(target=warm_up, daemon=True).start()
+    else:
+        readiness["ready"] = True
+    readiness["startup_seconds"] = round(time.time() - _IMPORT_STARTED, 3)
 
 # CORS configuration
 app.add_middleware(
@@ -37,6 +90,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Responses carry meshes as base64; compress them for clients that accept gzip
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
 from fastapi import Request
 
 import logging
@@ -55,10 +111,28 @@ async def log_requests(request: Request, call_next):
         logger.error(f"LOG: Request FAILED: {str(e)}")
         raise e
 
+# Packing jobs are priced and admitted against a shared CPU/memory budget;
+# excess load is queued briefly and then shed with 429 + Retry-After.
+admission = AdmissionController()
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    logger.warning(f"ADMISSION: rejected {request.url.path} ({exc.status}): {exc.detail}")
+    headers = {"Retry-After": str(exc.retry_after)} if exc.retry_after else None
+    return JSONResponse(status_code=exc.status, content={"detail": exc.detail}, headers=headers)
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(admission.metrics())
+
 @app.get("/")
 def root():
     return {"status": "ok", "message": "Trunk Packing API is running"}
 
+@app.get("/ready")
+def ready():
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
+
 # Models
 class LoginRequest(BaseModel):
     username: str
@@ -71,15 +145,27 @@ class RegisterRequest(BaseModel):
     name: Optional[str] = None
 
 class BagItem(BaseModel):
-    type: str # "Soft Rolling Bag", "Custom", etc.
+    type: str # "Soft Rolling Bag", "Custom", "Mesh", etc.
     size: Optional[str] = None # "SMALL", "MEDIUM", etc.
     dimensions: Optional[List[float]] = None # [L, B, T] in cm for Custom
+    mesh_stl: Optional[str] = None # Base64 encoded STL for "Mesh" (irregular items; `size` names the item)
 
 class OptimizationRequest(BaseModel):
-    car_model: str # "Renault Kiger" or "Custom"
+    car_model: str # A /cars name (e.g. "Renault Kiger") or "Custom"
     bags: List[BagItem]
     custom_trunk_file: Optional[str] = None # Base64 encoded STL if custom
     username: Optional[str] = None
+    engine: Optional[str] = "grid" # "grid", "heightmap", "oriented" or "voxel" (required for Mesh bags)
+    mesh_format: Optional[str] = "stl" # Trunk mesh encoding: "stl" (base64 STL) or "qmesh1" (compact indexed)
+    # Incremental re-optimization: when previous_result_id is set, `bags` is
+    # ignored and the previous loadout is edited by the diff below instead.
+    previous_result_id: Optional[str] = None # "result_id" of an earlier /optimize response
+    bags_added: Optional[List[BagItem]] = None
+    bags_removed: Optional[List[int]] = None # Bag ids (placed_bags[].id = position in the previous bag list)
+    full_reoptimize: bool = False # Re-pack the edited loadout from scratch
+    # Grid engine: start from the nearest stored layout on the same trunk. Off
+    # by default: the result then depends on what other requests stored.
+    warm_start: bool = False
 
 # Auth Endpoints
 @app.post("/auth/login")
@@ -103,147 +189,499 @@ async def register(req: RegisterRequest):
 # Data Endpoints
 @app.get("/cars")
 def get_cars():
-    return [
-        {
-            "name": "Renault Kiger",
-            "description": "Compact SUV with versatile trunk space",
-            "volume": "405L",
-            "dimensions": "L: 1.2m × W: 0.9m × H: 0.7m",
-            "image": "kiger.png" # Placeholder
-        },
-        {
-            "name": "Custom Vehicle",
-            "description": "Upload your own vehicle's STL model",
-            "volume": "Variable",
-            "dimensions": "Custom",
-            "image": "custom.png"
-        }
-    ]
+    return catalogue.cars()
 
 @app.get("/bags")
 def get_bags():
-    return bags_data
+    return get_service().bags_data
 
-# Optimization Endpoint
-@app.post("/optimize")
-async def optimize(req: OptimizationRequest):
-    # 1. Load Trunk
-    logger.info(f"DEBUG: STEP 1 - Loading Trunk: {req.car_model}")
-    trunk = None
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    if req.car_model == "Renault Kiger":
-        try:
-            model_path = os.path.join(BASE_DIR, "Surface model (1).stl")
-            with open(model_path, "rb") as f:
-                trunk = load_trunk(f.read())
-        except FileNotFoundError:
-             logger.error("Default car model file not found on server")
-             raise HTTPException(status_code=500, detail="Default car model file not found on server")
-    elif req.car_model == "Custom" and req.custom_trunk_file:
-         # Decode base64
-         try:
-             file_bytes = base64.b64decode(req.custom_trunk_file.split(",")[1] if "," in req.custom_trunk_file else req.custom_trunk_file)
-             trunk = load_trunk(file_bytes)
-         except Exception:
-             logger.error("Invalid custom trunk file")
-             raise HTTPException(status_code=400, detail="Invalid custom trunk file")
-    
-    if not trunk:
+class BatchOptimizationRequest(BaseModel):
+    scenarios: List[OptimizationRequest]
+    stream: bool = False # Emit NDJSON lines as each scenario finishes
+
+def decode_stl_upload(data: str, what: str) -> bytes:
+    encoded = data.split(",")[1] if "," in data else data
+    # Reject oversize uploads from the encoded length, before decoding anything
+    try:
+        check_stl_size(len(encoded) * 3 // 4)
+    except STLTooLargeError as e:
+        logger.error(f"{what.capitalize()} rejected: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        return base64.b64decode(encoded)
+    except Exception:
+        logger.error(f"Invalid {what}")
+        raise HTTPException(status_code=400, detail=f"Invalid {what}")
+
+def resolve_trunk_bytes(req: OptimizationRequest) -> bytes:
+    if req.car_model == CUSTOM_VEHICLE and req.custom_trunk_file:
+        return decode_stl_upload(req.custom_trunk_file, "custom trunk file")
+    if req.car_model == CUSTOM_VEHICLE:
         logger.error("Trunk could not be loaded")
         raise HTTPException(status_code=400, detail="Trunk could not be loaded")
+    entry = catalogue.resolve(req.car_model)
+    if entry is not None:
+        try:
+            return catalogue.read_bytes(req.car_model)
+        except OSError:
+            logger.error(f"Trunk file for {entry['name']} not found on server")
+            raise HTTPException(status_code=500, detail=f"Trunk file for {entry['name']} not found on server")
+    logger.error(f"Trunk could not be loaded for car model '{req.car_model}'")
+    raise HTTPException(status_code=400, detail=f"Unknown car model '{req.car_model}'; see /cars")
+
+def load_request_trunk(file_bytes: bytes):
+    try:
+        return get_service().get_trunk(file_bytes)
+    except STLTooLargeError as e:
+        logger.error(f"Custom trunk file rejected: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except STLFormatError as e:
+        logger.error(f"Invalid custom trunk file: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid custom trunk file: {e}")
+    except Exception as e:
+        logger.error(f"Invalid custom trunk file: {e}")
+        raise HTTPException(status_code=400, detail="Invalid custom trunk file")
 
-    # 2. Prepare Bags Info
-    logger.info(f"DEBUG: STEP 2 - Preparing Bags (Count: {len(req.bags)})")
+def parse_bag_items(items: List[BagItem]):
     bags_info = []
-    for bag in req.bags:
+    for bag in items:
         if bag.type == "Custom":
             if not bag.dimensions or len(bag.dimensions) != 3:
                 continue
             bags_info.append(("Custom", bag.dimensions[0], bag.dimensions[1], bag.dimensions[2]))
+        elif bag.type == "Mesh":
+            if not bag.mesh_stl:
+                continue
+            bags_info.append(("Mesh", bag.size or "Item", decode_stl_upload(bag.mesh_stl, "mesh bag file")))
         else:
             if not bag.size: continue
             bags_info.append((bag.type, bag.size))
-    
-    # SAFEGUARD: Limit number of bags to prevent Timeout/OOM on Free Tier
-    if len(bags_info) > 6:
-        logger.warning(f"DEBUG: Limiting bags from {len(bags_info)} to 6 for stability")
-        bags_info = bags_info[:6]
-            
-    # 3. Run Optimization
-    logger.info(f"DEBUG: STEP 3 - Starting Optimization with {len(bags_info)} bags")
-    try:
-        # We don't have the Streamlit progress bar here, so we pass None
-        results = optimized_packing(trunk, bags_info, progress_callback=None)
-        logger.info("DEBUG: STEP 3.5 - Optimization Finished")
-    except Exception as e:
-        logger.error(f"DEBUG: Optimization CRASHED: {e}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Optimization failed: {str(e)}")
-
-    # 4. Format Results for Frontend
-    # The frontend needs meshes to render. Sending full mesh data (vertices/faces) as JSON is heavy.
-    # A better approach for Three.js is to send position/rotation/scale or a simplified geometry.
-    # HOWEVER, our packing logic modifies the mesh vertices directly (apply_translation).
-    # So we must send the final vertices.
-    
-    placed_items = []
-    for info in results["placed_bags_info"]:
-        mesh = info["bag_mesh"]
-        # Convert mesh to basic data
-        # To keep payload small, we could export to STL string, or send vertices/indices.
-        # Sending STL string for each bag is robust.
-        
-        stl_io = BytesIO()
-        mesh.export(stl_io, file_type='stl')
-        stl_base64 = base64.b64encode(stl_io.getvalue()).decode('utf-8')
-        
-        placed_items.append({
-            "id": info.get("original_idx"),
-            "type": info["btype"],
-            "size": info["size"],
-            "mesh_stl": stl_base64, # Frontend will load this
-            "color": "#ff0000" # Frontend should assign colors
-        })
-        
-    stats = calculate_space_utilization(trunk, results["placed_bags_info"])
-    
-    # Also send Trunk mesh if it was custom, or just the name if standard
-    trunk_stl = None
-    if req.car_model == "Custom" or True: # Always send trunk for viz consistency?
-        # Maybe just send it once? For now send it.
-        t_io = BytesIO()
-        trunk.export(t_io, file_type='stl')
-        trunk_stl = base64.b64encode(t_io.getvalue()).decode('utf-8')
-    
-    # Generate Full Packed Scene STL for Export
-    packed_stl = None
-    if results["placed_bags_info"]:
-        scene_mesh = export_scene_to_stl(trunk, results["placed_bags_info"])
-        s_io = BytesIO()
-        scene_mesh.export(s_io, file_type="stl")
-        packed_stl = base64.b64encode(s_io.getvalue()).decode('utf-8')
-
-    response_payload = {
-        "success": True,
-        "placed_bags": placed_items,
-        "unplaced_bags": results["unplaced_bags_info"],
-        "stats": stats,
-        "trunk_mesh": trunk_stl, # Optional, frontend might already have Kiger mesh
-        "packed_stl": packed_stl,
-        "processing_time": results.get("processing_time", 0.0)
-    }
-
-    # 5. Save History
+    return bags_info
+
+def prepare_bags_info(req: OptimizationRequest):
+    # Oversized requests are refused by admission control (413) rather than truncated
+    return parse_bag_items(req.bags)
+
+def apply_bag_diff(previous_bags_info, req: OptimizationRequest):
+    """Edited bag list plus {previous id: new id} for the bags that were kept."""
+    removed = set(req.bags_removed or [])
+    unknown = sorted(i for i in removed if not 0 <= i < len(previous_bags_info))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown bag id(s) in bags_removed: {unknown}")
+    bags_info, index_map = [], {}
+    for i, bag_info in enumerate(previous_bags_info):
+        if i not in removed:
+            index_map[i] = len(bags_info)
+            bags_info.append(bag_info)
+    bags_info = bags_info + parse_bag_items(req.bags_added or [])
+    return bags_info, index_map
+
+def resolve_engine(req: OptimizationRequest):
+    engine_name = req.engine or "grid"
+    engines = get_service().PACKING_ENGINES
+    if engine_name not in engines:
+        raise HTTPException(status_code=400, detail=f"Unknown engine '{engine_name}'. Available: {', '.join(engines)}")
+    return engine_name
+
+def check_mesh_bags(engine_name, bags_info, incremental=False):
+    """400 unless the engine that will run can pack the mesh bags in `bags_info`."""
+    engines = get_service().MESH_ENGINES
+    if any(bag_info[0] == "Mesh" for bag_info in bags_info) and (incremental or engine_name not in engines):
+        detail = f"Mesh bags need engine {' or '.join(repr(e) for e in engines)}"
+        raise HTTPException(status_code=400, detail=detail + (" with full_reoptimize" if incremental else ""))
+
+def resolve_mesh_format(req: OptimizationRequest):
+    mesh_format = req.mesh_format or "stl"
+    formats = get_service().MESH_FORMATS
+    if mesh_format not in formats:
+        raise HTTPException(status_code=400, detail=f"Unknown mesh_format '{mesh_format}'. Available: {', '.join(formats)}")
+    return mesh_format
+
+# Optimization Endpoint
+@app.post("/optimize")
+async def optimize(req: OptimizationRequest, x_profile: Optional[str] = Header(None)):
+    service = get_service()
+    engine_name = resolve_engine(req)
+    mesh_format = resolve_mesh_format(req)
+
+    previous = None
+    if req.previous_result_id:
+        previous = service.get_result(req.previous_result_id)
+        if previous is None:
+            raise HTTPException(status_code=404, detail="Previous result not found or expired; send the full loadout")
+
+    # 1. Prepare Bags Info
+    if previous:
+        logger.info(f"DEBUG: STEP 1 - Applying bag diff (+{len(req.bags_added or [])} / -{len(req.bags_removed or [])})")
+        bags_info, index_map = apply_bag_diff(previous["bags_info"], req)
+        file_bytes = None
+        cost = await run_in_threadpool(service.estimate_job_cost, bags_info, trunk=previous["trunk"])
+    else:
+        logger.info(f"DEBUG: STEP 1 - Preparing Bags (Count: {len(req.bags)})")
+        bags_info = prepare_bags_info(req)
+        file_bytes = resolve_trunk_bytes(req)
+        # Pricing parses and hashes the STL, so keep it off the event loop
+        cost = await run_in_threadpool(service.estimate_job_cost, bags_info, trunk_bytes=file_bytes)
+    incremental = previous is not None and not req.full_reoptimize
+    if incremental:
+        # The edit continues the previous layout, so it keeps that layout's engine
+        if "engine" in req.model_fields_set and engine_name != previous["engine"]:
+            raise HTTPException(status_code=400, detail=f"Previous result was packed with engine '{previous['engine']}'; "
+                                                        f"send that engine or full_reoptimize to switch")
+        engine_name = previous["engine"]
+        if engine_name not in service.INCREMENTAL_ENGINES:
+            raise HTTPException(status_code=400, detail=f"Incremental edits need a layout from engine "
+                                                        f"{' or '.join(repr(e) for e in service.INCREMENTAL_ENGINES)}; "
+                                                        f"send full_reoptimize")
+    check_mesh_bags(engine_name, bags_info, incremental)
+    # Warm starts seed the grid engine only (other engines add their own stages)
+    warm_start = req.warm_start and not incremental and engine_name == "grid"
+    warm = None
+
+    logger.info(f"DEBUG: STEP 2 - Waiting for admission ({cost})")
+    async with admission.admit(cost):
+        # 3. Load Trunk
+        logger.info(f"DEBUG: STEP 3 - Loading Trunk: {req.car_model}")
+        trunk = previous["trunk"] if previous else await run_in_threadpool(load_request_trunk, file_bytes)
+
+        # 4. Run Optimization
+        logger.info(f"DEBUG: STEP 4 - Starting Optimization with {len(bags_info)} bags (engine={engine_name}, incremental={incremental})")
+        # Profiles record the job shape and trunk hash only, never the request payload
+        profile = should_profile(x_profile)
+        label = f"/optimize engine={engine_name} incremental={incremental} bags={len(bags_info)} trunk={trunk.metadata.get('trunk_key', '')[:12]}"
+        try:
+            # We don't have the Streamlit progress bar here, so we pass None
+            if incremental:
+                results, profile_id = await run_in_threadpool(maybe_profiled, profile, label, service.incremental_packing, trunk,
+                                                              previous["results"]["placed_bags_info"], bags_info, index_map, progress_callback=None)
+            elif warm_start:
+                (results, warm), profile_id = await run_in_threadpool(maybe_profiled, profile, label, service.warm_start_packing,
+                                                                      trunk, bags_info, progress_callback=None)
+            else:
+                results, profile_id = await run_in_threadpool(maybe_profiled, profile, label, service.PACKING_ENGINES[engine_name],
+                                                              trunk, bags_info, progress_callback=None)
+            logger.info("DEBUG: STEP 4.5 - Optimization Finished")
+        except Exception as e:
+            logger.error(f"DEBUG: Optimization CRASHED: {e}")
+            import traceback
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=f"Optimization failed: {str(e)}")
+
+        # 5. Format Results for Frontend
+        # Our packing logic modifies the mesh vertices directly (apply_translation),
+        # so every bag (and the trunk, for viz consistency) is sent as a base64 STL.
+        response_payload = await run_in_threadpool(service.serialize_packing_results, trunk, results, mesh_format)
+    response_payload["engine"] = engine_name
+    response_payload["incremental"] = incremental
+    response_payload["warm_start"] = warm  # seed_result_id, distance and seeds kept; None when packed cold
+    response_payload["result_id"] = service.store_result(trunk, bags_info, results, engine_name)
+    if profile_id:
+        response_payload["profile_id"] = profile_id
+
+    # 6. Save History (a blocking MongoDB write, plus mesh-bag artifacts)
     if req.username:
-        save_history(req.username, req.car_model, stats)
+        await run_in_threadpool(record_history, service, req.username, req.car_model, response_payload["stats"],
+                                engine_name, bags_info, trunk.metadata.get("trunk_key"), service.compact_layout(results))
     
     return response_payload
 
+def record_history(service, username, car_model, stats, engine_name, bags_info, trunk_key, layout):
+    """Save a history entry; blocking, so handlers call it via run_in_threadpool."""
+    save_history(username, car_model, stats,
+                 details=service.history_details(car_model, engine_name, bags_info, trunk_key, layout))
+
+def pooled_job_cost(costs, loads, workers):
+    """One JobCost for jobs run on the worker pool plus the trunk loads they need.
+
+    The pool bounds how much runs at once, so the group is admitted as a
+    single job whose cost is capped at the full budget.
+    """
+    parallel = min(len(costs), workers)
+    return JobCost(min(sum(c.cpu_seconds for c in costs + loads), admission.cpu_budget),
+                   min(max(c.memory_mb for c in costs) * parallel + sum(c.memory_mb for c in loads), admission.memory_budget_mb))
+
+def price_pooled_jobs(service, jobs, trunks):
+    """pooled_job_cost for (trunk key, bags_info) jobs over trunks {key: STL bytes}.
+
+    Estimating parses and hashes every trunk, so call it via run_in_threadpool.
+    """
+    costs = [service.estimate_job_cost(bags_info, trunk_bytes=trunks[key], include_load=False) for key, bags_info in jobs]
+    loads = [service.estimate_job_cost([], trunk_bytes=file_bytes) for file_bytes in trunks.values()]
+    return pooled_job_cost(costs, loads, service.BATCH_WORKERS)
+
+# Batch Optimization Endpoint
+@app.post("/optimize/batch")
+async def optimize_batch(req: BatchOptimizationRequest):
+    service = get_service()
+    if not req.scenarios:
+        raise HTTPException(status_code=400, detail="No scenarios provided")
+    if len(req.scenarios) > service.MAX_BATCH_SCENARIOS:
+        raise HTTPException(status_code=400, detail=f"At most {service.MAX_BATCH_SCENARIOS} scenarios per batch")
+
+    # Validate everything up front and group by trunk, so each distinct trunk
+    # is decoded and preprocessed once no matter how many scenarios share it.
+    groups = {}
+    jobs = []
+    for idx, scenario in enumerate(req.scenarios):
+        # Scenarios are packed from scratch on pool workers, which share
+        # neither stored results nor warm-start layouts
+        ignored = [name for name, value in (("previous_result_id", scenario.previous_result_id),
+                                            ("bags_added", scenario.bags_added), ("bags_removed", scenario.bags_removed),
+                                            ("full_reoptimize", scenario.full_reoptimize),
+                                            ("warm_start", scenario.warm_start)) if value]
+        if ignored:
+            raise HTTPException(status_code=422, detail=f"Scenario {idx}: {', '.join(ignored)} not supported in batches")
+        engine_name = resolve_engine(scenario)
+        mesh_format = resolve_mesh_format(scenario)
+        file_bytes = resolve_trunk_bytes(scenario)
+        key = await run_in_threadpool(service.trunk_key, file_bytes)
+        groups.setdefault(key, file_bytes)
+        bags_info = prepare_bags_info(scenario)
+        check_mesh_bags(engine_name, bags_info)
+        jobs.append((idx, key, bags_info, engine_name, mesh_format))
+    logger.info(f"BATCH: {len(jobs)} scenarios over {len(groups)} trunk(s)")
+
+    cost = await run_in_threadpool(price_pooled_jobs, service, [(key, bags_info) for _, key, bags_info, _, _ in jobs], groups)
+
+    async def submit(raise_errors):
+        """Load every trunk, then start the scenarios: {idx: (future, error)}.
+
+        A trunk that fails to load raises its HTTPException, or with
+        `raise_errors` false becomes the error of each of its scenarios.
+        """
+        failed = {}
+        for key, file_bytes in groups.items():
+            try:
+                await run_in_threadpool(load_request_trunk, file_bytes)
+            except HTTPException as e:
+                if raise_errors:
+                    raise
+                failed[key] = e.detail
+        loop = asyncio.get_running_loop()
+        executor = service.get_executor()
+        # Loading wrote each trunk to the artifact store, where workers map it
+        # by key; the STL is only sent along when the store is disabled
+        payloads = {key: None if service.trunk_is_stored(key) else file_bytes for key, file_bytes in groups.items()}
+        # Submit group by group so consecutive scenarios on a worker hit its trunk cache
+        submitted = {}
+        for idx, key, bags_info, engine_name, mesh_format in sorted(jobs, key=lambda j: j[1]):
+            if key in failed:
+                submitted[idx] = (None, failed[key])
+            else:
+                submitted[idx] = (loop.run_in_executor(executor, service.run_scenario, key, bags_info,
+                                                       engine_name, mesh_format, payloads[key]), None)
+        return submitted
+
+    job_by_idx = {idx: (key, bags_info, engine_name) for idx, key, bags_info, engine_name, _ in jobs}
+
+    async def run_one(idx, future, error):
+        scenario = req.scenarios[idx]
+        if error is not None:
+            return idx, {"success": False, "error": error}
+        try:
+            payload, layout = await future
+        except Exception as e:
+            logger.error(f"BATCH: scenario {idx} failed: {e}")
+            return idx, {"success": False, "error": f"Optimization failed: {str(e)}"}
+        if scenario.username:
+            key, bags_info, engine_name = job_by_idx[idx]
+            await run_in_threadpool(record_history, service, scenario.username, scenario.car_model, payload["stats"],
+                                    engine_name, bags_info, key, layout)
+        return idx, payload
+
+    if req.stream:
+        # The admission slot is taken inside the generator, so a client that
+        # leaves before the stream starts never holds one; a trunk that fails
+        # to load turns into error lines for its scenarios
+        async def stream_results():
+            async with admission.admit(cost):
+                submitted = await submit(raise_errors=False)
+                for next_done in asyncio.as_completed([run_one(idx, *job) for idx, job in submitted.items()]):
+                    idx, payload = await next_done
+                    yield json.dumps({"index": idx, "result": payload}) + "\n"
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+    async with admission.admit(cost):
+        submitted = await submit(raise_errors=True)
+        results = dict(await asyncio.gather(*(run_one(idx, *job) for idx, job in submitted.items())))
+    return {"success": True, "results": [results[idx] for idx in range(len(req.scenarios))]}
+
+# Capacity Endpoint ("how many of bag X fit in trunk Y?")
+class CapacityRequest(BaseModel):
+    car_model: str # A /cars name (e.g. "Renault Kiger") or "Custom"
+    bags: List[BagItem] # Bag types to evaluate one at a time; a catalogue type without size means every size
+    custom_trunk_file: Optional[str] = None # Base64 encoded STL if custom
+    mesh_format: Optional[str] = "stl"
+    max_count: Optional[int] = None # Stop counting at this many bags (default and ceiling: server limit)
+
+def expand_capacity_items(items: List[BagItem], catalogue):
+    expanded = []
+    for bag in items:
+        if bag.type != "Custom" and bag.type not in catalogue:
+            raise HTTPException(status_code=400, detail=f"Unknown bag type '{bag.type}'")
+        if bag.type != "Custom" and not bag.size:
+            expanded += [BagItem(type=bag.type, size=size) for size in catalogue[bag.type]]
+        elif bag.type != "Custom" and bag.size not in catalogue[bag.type]:
+            raise HTTPException(status_code=400, detail=f"Unknown size '{bag.size}' for {bag.type}")
+        else:
+            expanded.append(bag)
+    return parse_bag_items(expanded)
+
+@app.post("/capacity")
+async def capacity(req: CapacityRequest):
+    service = get_service()
+    mesh_format = resolve_mesh_format(req)
+    bags_info = expand_capacity_items(req.bags, service.bags_data)
+    if not bags_info:
+        raise HTTPException(status_code=400, detail="No valid bags provided")
+    max_count = min(req.max_count or service.CAPACITY_MAX_COUNT, service.CAPACITY_MAX_COUNT)
+    if max_count < 1:
+        raise HTTPException(status_code=400, detail="max_count must be at least 1")
+    file_bytes = resolve_trunk_bytes(req)
+    cost = await run_in_threadpool(service.estimate_capacity_cost, bags_info, trunk_bytes=file_bytes)
+
+    async with admission.admit(cost):
+        trunk = await run_in_threadpool(load_request_trunk, file_bytes)
+        try:
+            payload, all_results = await run_in_threadpool(service.run_capacity, trunk, bags_info, mesh_format, max_count)
+        except Exception as e:
+            logger.error(f"CAPACITY: failed: {e}")
+            raise HTTPException(status_code=500, detail=f"Capacity search failed: {str(e)}")
+    # Each layout is stored like an /optimize result (free space, incremental edits)
+    for entry, bag_info, results in zip(payload["capacities"], bags_info, all_results):
+        entry["result_id"] = service.store_result(trunk, [bag_info] * len(results["placed_bags_info"]), results)
+    return payload
+
+# Cross-Vehicle Comparison Endpoint
+class CompareRequest(BaseModel):
+    bags: List[BagItem]
+    car_models: Optional[List[str]] = None # /cars names; default: every catalogue vehicle
+    engine: Optional[str] = "grid"
+
+@app.post("/compare")
+async def compare(req: CompareRequest):
+    """Pack one bag list into several cars at once and rank them.
+
+    Cars placing more bags rank first; among equals, the tighter fit (higher
+    volume_utilization) wins. Each row carries a result_id: fetch its full
+    layout from /results/{result_id}.
+    """
+    service = get_service()
+    engine_name = resolve_engine(req)
+    bags_info = prepare_bags_info(req)
+    if not bags_info:
+        raise HTTPException(status_code=400, detail="No valid bags provided")
+    check_mesh_bags(engine_name, bags_info)
+    names = req.car_models or [entry["name"] for entry in catalogue.entries() if entry["status"] != "error"]
+    cars = {}
+    for name in names:
+        entry = catalogue.resolve(name)
+        if entry is None:
+            raise HTTPException(status_code=400, detail=f"Unknown car model '{name}'; see /cars")
+        cars.setdefault(entry["name"], None)
+    if len(cars) > service.MAX_BATCH_SCENARIOS:
+        raise HTTPException(status_code=400, detail=f"At most {service.MAX_BATCH_SCENARIOS} car models per comparison")
+    for name in cars:
+        try:
+            cars[name] = catalogue.read_bytes(name)
+        except OSError:
+            raise HTTPException(status_code=500, detail=f"Trunk file for {name} not found on server")
+    logger.info(f"COMPARE: {len(bags_info)} bags over {len(cars)} car(s)")
+
+    cost = await run_in_threadpool(price_pooled_jobs, service, [(name, bags_info) for name in cars], cars)
+    async with admission.admit(cost):
+        # Catalogue trunks are cached here after warm-up; pool workers map them from the artifact store
+        trunks = {name: await run_in_threadpool(load_request_trunk, file_bytes) for name, file_bytes in cars.items()}
+        loop = asyncio.get_running_loop()
+        executor = service.get_executor()
+        summaries = await asyncio.gather(*(loop.run_in_executor(executor, service.compare_scenario, file_bytes, bags_info, engine_name)
+                                           for file_bytes in cars.values()), return_exceptions=True)
+
+    ranking, failed = [], []
+    for name, summary in zip(cars, summaries):
+        if isinstance(summary, Exception):
+            logger.error(f"COMPARE: {name} failed: {summary}")
+            failed.append({"car_model": name, "success": False, "error": f"Optimization failed: {str(summary)}"})
+            continue
+        ranking.append({
+            "car_model": name,
+            "success": True,
+            "placed_count": summary["placed_count"],
+            "unplaced_count": summary["unplaced_count"],
+            "volume_utilization": summary["volume_utilization"],
+            "processing_time": summary["processing_time"],
+            "result_id": service.store_result(trunks[name], bags_info, service.restore_layout(
+                summary["layout"], summary["processing_time"], summary["search"]), engine_name),
+        })
+    ranking.sort(key=lambda row: (-row["placed_count"], -row["volume_utilization"]))
+    for rank, row in enumerate(ranking, start=1):
+        row["rank"] = rank
+    return {"success": True, "total_bags": len(bags_info), "engine": engine_name, "ranking": ranking + failed}
+
+# Full payload of a stored result (e.g. a /compare row), built on request
+@app.get("/results/{result_id}")
+async def get_stored_result(result_id: str, mesh_format: str = "stl"):
+    service = get_service()
+    record = service.get_result(result_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired")
+    if mesh_format not in service.MESH_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown mesh_format '{mesh_format}'. Available: {', '.join(service.MESH_FORMATS)}")
+    payload = await run_in_threadpool(service.serialize_packing_results, record["trunk"], record["results"], mesh_format)
+    payload["result_id"] = result_id
+    return payload
+
+# Free space left by a stored /optimize result ("what else fits?"); the same
+# analysis is included in every /optimize response as `free_space`
+@app.get("/results/{result_id}/free-space")
+async def get_free_space(result_id: str, max_boxes: int = 5):
+    service = get_service()
+    record = service.get_result(result_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired")
+    if not 1 <= max_boxes <= 20:
+        raise HTTPException(status_code=400, detail="max_boxes must be between 1 and 20")
+    free_space = await run_in_threadpool(service.free_space_analysis, record["trunk"],
+                                         record["results"]["placed_bags_info"], max_boxes)
+    return {"success": True, "result_id": result_id, "free_space": free_space}
+
+# Profiles captured for opted-in requests: folded stacks by default (open with
+# flamegraph.pl, speedscope or inferno), ?format=json for the allocation summary
+@app.get("/debug/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = "folded", x_profile: Optional[str] = Header(None)):
+    # No token configured means nobody is an admin, not that everybody is
+    if not PROFILE_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Profiles are disabled (PROFILE_ADMIN_TOKEN is not set)")
+    if not is_admin(x_profile):
+        raise HTTPException(status_code=403, detail="Profiles require the admin X-Profile header")
+    if format not in ("folded", "json"):
+        raise HTTPException(status_code=400, detail="format must be 'folded' or 'json'")
+    profile = load_profile(profile_id, format)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "json":
+        return profile
+    return PlainTextResponse(profile)
+
 @app.get("/history/{username}")
 def get_user_history(username: str):
     return get_history(username)
 
+# A past result rebuilt from its stored layout, without running an engine
+@app.get("/history/{username}/{entry_id}")
+async def get_user_history_entry(username: str, entry_id: str, mesh_format: str = "stl"):
+    service = get_service()
+    if mesh_format not in service.MESH_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown mesh_format '{mesh_format}'. Available: {', '.join(service.MESH_FORMATS)}")
+    entry = await run_in_threadpool(get_history_entry, username, entry_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="History entry not found")
+    if not entry.get("layout") or not entry.get("trunk_key"):
+        raise HTTPException(status_code=409, detail="This history entry predates stored layouts; re-run it with /optimize")
+    payload = await run_in_threadpool(service.replay_history_entry, entry, mesh_format)
+    payload["inputs"] = entry.get("inputs")
+    return payload
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
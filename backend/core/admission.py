@@ -0,0 +1,186 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# ADMISSION CONTROL
+# --------------------------------------------------------------------------
+# Every packing job is priced before it runs (estimated CPU-seconds and peak
+# memory). Jobs run while the in-flight total stays within the budgets; the
+# rest wait in a bounded FIFO queue, and anything beyond the queue (or waiting
+# longer than ADMISSION_QUEUE_TIMEOUT) is turned away at once so the admitted
+# work keeps its latency.
+
+# The engine holds the GIL for much of a job, so admitted work drains at
+# roughly one CPU-second per second: the CPU budget bounds admitted latency.
+ADMISSION_CPU_BUDGET = float(os.getenv("ADMISSION_CPU_BUDGET", "30"))
+ADMISSION_MEMORY_BUDGET_MB = float(os.getenv("ADMISSION_MEMORY_BUDGET_MB", "400"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "8"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+
+# Cost model, calibrated on the Kiger trunk at the 3 cm cloud step: catalogue
+# boxes scan precomputed feasibility maps, custom boxes run containment queries.
+# The per-position CPU rates only hold at that step; callers that know the
+# search planner's prediction (core.engine.plan_search) pass it instead.
+BASE_CPU_SECONDS = 0.05
+CATALOGUE_SECONDS_PER_POSITION = 6e-7  # per rotation per lattice position
+CUSTOM_SECONDS_PER_POSITION = 5e-6
+PAIR_SECONDS = 0.005  # compaction / gravity passes, per pair of bags
+TRUNK_LOAD_SECONDS = 12.0  # preprocessing an uncached trunk (LODs, maps at every step, voxels)
+TRUNK_LOAD_SECONDS_PER_MB = 2.0
+BASE_MEMORY_MB = 40.0
+# Catalogue maps are memory-mapped from the artifact store; custom boxes build
+# theirs in the worker (peak of 40 MB for 10 custom bags at 1.5 cm)
+MEMORY_MB_PER_POSITION = 5e-6  # per custom bag rotation
+TRUNK_LOAD_MEMORY_PER_MB = 30.0
+
+class AdmissionRejected(Exception):
+    """The job was not admitted; `status` is 413 (never fits) or 429 (busy)."""
+    def __init__(self, status, detail, retry_after=None):
+        super().__init__(detail)
+        self.status, self.detail, self.retry_after = status, detail, retry_after
+
+class JobCost:
+    def __init__(self, cpu_seconds, memory_mb):
+        self.cpu_seconds, self.memory_mb = float(cpu_seconds), float(memory_mb)
+
+    def __repr__(self):
+        return f"JobCost(cpu={self.cpu_seconds:.2f}s, mem={self.memory_mb:.0f}MB)"
+
+def estimate_cost(rotation_counts, custom_flags, trunk_extents, step, trunk_bytes=0, predicted_seconds=None):
+    """Predicted cost of packing bags (rotations per bag, custom or not) into a trunk.
+
+    `trunk_bytes` is the STL size when the trunk still has to be preprocessed;
+    `predicted_seconds`, when given, is the packing run time at `step`.
+    """
+    positions = math.prod(max(float(e) / step, 1.0) for e in trunk_extents)
+    if predicted_seconds is None:
+        cpu = BASE_CPU_SECONDS + PAIR_SECONDS * len(rotation_counts) ** 2
+        for rotations, custom in zip(rotation_counts, custom_flags):
+            rate = CUSTOM_SECONDS_PER_POSITION if custom else CATALOGUE_SECONDS_PER_POSITION
+            cpu += rotations * positions * rate
+    else:
+        cpu = BASE_CPU_SECONDS + predicted_seconds
+    memory = BASE_MEMORY_MB
+    for rotations, custom in zip(rotation_counts, custom_flags):
+        if custom:
+            memory += rotations * positions * MEMORY_MB_PER_POSITION
+    if trunk_bytes:
+        cpu += TRUNK_LOAD_SECONDS + TRUNK_LOAD_SECONDS_PER_MB * trunk_bytes / 1e6
+        memory += TRUNK_LOAD_MEMORY_PER_MB * trunk_bytes / 1e6
+    return JobCost(cpu, memory)
+
+class AdmissionController:
+    def __init__(self, cpu_budget=ADMISSION_CPU_BUDGET, memory_budget_mb=ADMISSION_MEMORY_BUDGET_MB,
+                 max_queue=ADMISSION_MAX_QUEUE, queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.cpu_budget, self.memory_budget_mb = cpu_budget, memory_budget_mb
+        self.max_queue, self.queue_timeout = max_queue, queue_timeout
+        self.cpu_in_use, self.memory_in_use = 0.0, 0.0
+        self.in_flight = 0
+        self._waiting = deque()  # (cost, future)
+        self.admitted_total = 0
+        self.rejected_total = {"too_large": 0, "queue_full": 0, "queue_timeout": 0}
+        self.queue_wait_seconds_total = 0.0
+
+    def _fits(self, cost):
+        return (self.cpu_in_use + cost.cpu_seconds <= self.cpu_budget
+                and self.memory_in_use + cost.memory_mb <= self.memory_budget_mb)
+
+    def _take(self, cost):
+        self.cpu_in_use += cost.cpu_seconds
+        self.memory_in_use += cost.memory_mb
+        self.in_flight += 1
+        self.admitted_total += 1
+
+    def _release(self, cost):
+        self.cpu_in_use = max(0.0, self.cpu_in_use - cost.cpu_seconds)
+        self.memory_in_use = max(0.0, self.memory_in_use - cost.memory_mb)
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        # Admit queued jobs in order while the head fits
+        while self._waiting and self._fits(self._waiting[0][0]):
+            cost, future = self._waiting.popleft()
+            if not future.done():
+                self._take(cost)
+                future.set_result(True)
+
+    def retry_after(self):
+        """Seconds until the current backlog should have drained, at least 1."""
+        backlog = self.cpu_in_use + sum(cost.cpu_seconds for cost, _ in self._waiting)
+        return max(1, math.ceil(backlog))
+
+    @asynccontextmanager
+    async def admit(self, cost):
+        if cost.cpu_seconds > self.cpu_budget or cost.memory_mb > self.memory_budget_mb:
+            self.rejected_total["too_large"] += 1
+            raise AdmissionRejected(413, f"Request is too large to run on this server (estimated {cost.cpu_seconds:.0f} CPU-s, "
+                                         f"{cost.memory_mb:.0f} MB); reduce the number of bags")
+        if not self._waiting and self._fits(cost):
+            self._take(cost)
+        else:
+            if len(self._waiting) >= self.max_queue:
+                self.rejected_total["queue_full"] += 1
+                raise AdmissionRejected(429, "Server is busy; retry later", self.retry_after())
+            future = asyncio.get_running_loop().create_future()
+            entry = (cost, future)
+            self._waiting.append(entry)
+            started = time.time()
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+            except asyncio.TimeoutError:
+                if future.done():
+                    pass  # admitted just as the wait expired
+                else:
+                    self._waiting.remove(entry)
+                    future.cancel()
+                    self._wake()
+                    self.rejected_total["queue_timeout"] += 1
+                    raise AdmissionRejected(429, "Server is busy; retry later", self.retry_after())
+            except asyncio.CancelledError:
+                # Client went away while queued
+                if entry in self._waiting:
+                    self._waiting.remove(entry)
+                    self._wake()
+                elif future.done() and not future.cancelled():
+                    self._release(cost)
+                raise
+            finally:
+                self.queue_wait_seconds_total += time.time() - started
+        try:
+            yield
+        finally:
+            self._release(cost)
+
+    def metrics(self):
+        """Prometheus text exposition of the controller state."""
+        lines = [
+            "# TYPE admission_queue_depth gauge",
+            f"admission_queue_depth {len(self._waiting)}",
+            "# TYPE admission_in_flight gauge",
+            f"admission_in_flight {self.in_flight}",
+            "# TYPE admission_cpu_seconds_in_use gauge",
+            f"admission_cpu_seconds_in_use {self.cpu_in_use:.3f}",
+            "# TYPE admission_cpu_seconds_budget gauge",
+            f"admission_cpu_seconds_budget {self.cpu_budget:.3f}",
+            "# TYPE admission_memory_mb_in_use gauge",
+            f"admission_memory_mb_in_use {self.memory_in_use:.1f}",
+            "# TYPE admission_memory_mb_budget gauge",
+            f"admission_memory_mb_budget {self.memory_budget_mb:.1f}",
+            "# TYPE admission_admitted_total counter",
+            f"admission_admitted_total {self.admitted_total}",
+            "# TYPE admission_rejected_total counter",
+        ]
+        lines += [f'admission_rejected_total{{reason="{reason}"}} {count}' for reason, count in self.rejected_total.items()]
+        lines += [
+            "# TYPE admission_queue_wait_seconds_total counter",
+            f"admission_queue_wait_seconds_total {self.queue_wait_seconds_total:.3f}",
+        ]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import shutil
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# SHARED TRUNK ARTIFACT STORE
+# --------------------------------------------------------------------------
+# Preprocessed trunk data is written once per trunk as plain .npy arrays plus
+# a JSON manifest, then memory-mapped read-only. Every uvicorn worker on the
+# host maps the same files, so the page cache holds a single physical copy
+# and a freshly forked worker serves a known trunk without preprocessing it.
+#
+# The store lives next to the app, so it also survives restarts. Digests are
+# computed once, when an entry is written; a marker file records the size and
+# mtime of every array as verified, so mapping an entry only stats its files.
+# An entry whose files no longer match the marker (or that has none, e.g.
+# copied in from elsewhere) is checked against its digests once, on first
+# load, and re-marked. The least recently used entries are evicted once the
+# store exceeds
+# TRUNK_ARTIFACT_MAX_BYTES. Callers put their format version into the key.
+# Set TRUNK_ARTIFACT_DIR to an empty string to keep artifacts in memory only.
+
+ARTIFACT_DIR = os.getenv("TRUNK_ARTIFACT_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "trunk_artifacts"))
+MAX_ARTIFACT_BYTES = int(os.getenv("TRUNK_ARTIFACT_MAX_BYTES", str(1024 * 1024 * 1024)))
+MANIFEST_NAME = "manifest.json"
+VERIFIED_NAME = "verified.json"
+STALE_STAGING_SECONDS = 3600
+
+def artifact_path(key):
+    return os.path.join(ARTIFACT_DIR, key)
+
+def _file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _file_stamps(path, names):
+    """{name: [size, mtime_ns]} of the .npy files of an entry."""
+    stamps = {}
+    for name in names:
+        stat = os.stat(os.path.join(path, f"{name}.npy"))
+        stamps[name] = [stat.st_size, stat.st_mtime_ns]
+    return stamps
+
+def _mark_verified(path, names):
+    marker = os.path.join(path, VERIFIED_NAME)
+    temporary = f"{marker}.{os.getpid()}.{uuid.uuid4().hex}"
+    with open(temporary, "w") as f:
+        json.dump(_file_stamps(path, names), f)
+    os.replace(temporary, marker)
+
+def _is_marked_verified(path, names):
+    try:
+        with open(os.path.join(path, VERIFIED_NAME)) as f:
+            return json.load(f) == _file_stamps(path, names)
+    except (OSError, ValueError):
+        return False
+
+def _entry_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+def discard_artifacts(key):
+    """Remove a stored entry (renamed away first so readers never see it half-deleted)."""
+    trash = os.path.join(ARTIFACT_DIR, f".{key}.discard.{uuid.uuid4().hex}")
+    try:
+        os.rename(artifact_path(key), trash)
+    except OSError:
+        return
+    shutil.rmtree(trash, ignore_errors=True)
+
+def evict_artifacts(keep=None, max_bytes=MAX_ARTIFACT_BYTES):
+    """Drop least recently used entries until the store fits in `max_bytes`."""
+    if not ARTIFACT_DIR or not os.path.isdir(ARTIFACT_DIR):
+        return
+    entries, now = [], time.time()
+    for entry in os.scandir(ARTIFACT_DIR):
+        if not entry.is_dir():
+            continue
+        if entry.name.startswith("."):
+            # Staging directory left behind by a crashed writer
+            if now - entry.stat().st_mtime > STALE_STAGING_SECONDS:
+                shutil.rmtree(entry.path, ignore_errors=True)
+            continue
+        try:
+            last_used = os.stat(os.path.join(entry.path, MANIFEST_NAME)).st_mtime
+        except OSError:
+            last_used = 0.0
+        entries.append((last_used, entry.name, _entry_size(entry.path)))
+    total = sum(size for _, _, size in entries)
+    for _, key, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        logger.info(f"ARTIFACTS: evicting trunk {key[:12]} ({size / 1e6:.1f} MB)")
+        discard_artifacts(key)
+        total -= size
+
+def save_artifacts(key, arrays, manifest):
+    """Write `arrays` ({name: ndarray}) and `manifest` for `key`; returns False if not stored.
+
+    Files go to a private temporary directory that is renamed into place, so
+    readers never see a partial entry; if another worker stored the same key
+    first, its copy wins.
+    """
+    if not ARTIFACT_DIR:
+        return False
+    final = artifact_path(key)
+    if os.path.isdir(final):
+        return True
+    staging = os.path.join(ARTIFACT_DIR, f".{key}.{os.getpid()}.{uuid.uuid4().hex}")
+    try:
+        os.makedirs(staging)
+        digests = {}
+        for name, array in arrays.items():
+            path = os.path.join(staging, f"{name}.npy")
+            np.save(path, np.ascontiguousarray(array), allow_pickle=False)
+            digests[name] = _file_digest(path)
+        with open(os.path.join(staging, MANIFEST_NAME), "w") as f:
+            json.dump(dict(manifest, arrays=digests), f)
+        _mark_verified(staging, digests)
+        os.rename(staging, final)
+        evict_artifacts(keep=key)
+        return True
+    except OSError as e:
+        if not os.path.isdir(final):
+            logger.warning(f"ARTIFACTS: could not store trunk {key[:12]}: {e}")
+        return os.path.isdir(final)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def load_artifacts(key):
+    """(manifest, {name: read-only memmap}) for `key`, or None if it is not stored or is corrupt."""
+    if not ARTIFACT_DIR:
+        return None
+    path = artifact_path(key)
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.isdir(path):
+        return None
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        digests = manifest["arrays"]
+        if not _is_marked_verified(path, digests):
+            for name, digest in digests.items():
+                if _file_digest(os.path.join(path, f"{name}.npy")) != digest:
+                    raise ValueError(f"{name}.npy does not match its digest")
+            _mark_verified(path, digests)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r', allow_pickle=False)
+                  for name in digests}
+    except (OSError, ValueError, KeyError, AttributeError) as e:
+        logger.warning(f"ARTIFACTS: discarding unreadable entry for trunk {key[:12]}: {e}")
+        discard_artifacts(key)
+        return None
+    try:
+        os.utime(manifest_path)  # recency for eviction
+    except OSError:
+        pass
+    return manifest, arrays
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import functools
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# VEHICLE CATALOGUE
+# --------------------------------------------------------------------------
+# Vehicles are the built-in Kiger trunk plus every *.stl in VEHICLE_DIR; an
+# optional sidecar <stem>.json sets "name", "description" and "image" (the
+# name defaults to the file stem). Names resolve through a dict index, case-
+# and whitespace-insensitively. Ingestion preprocesses every trunk (in the
+# calling thread, or across a worker pool when given one): each trunk's
+# artifacts go to the shared store (see core.artifacts) and its measured
+# volume and dimensions are kept, which /cars then serves. This module stays free of the engine import so /cars
+# answers before warm-up has finished.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VEHICLE_DIR = os.getenv("VEHICLE_DIR", os.path.join(BACKEND_DIR, "vehicles"))
+CUSTOM_VEHICLE = "Custom"
+
+BUILTIN_VEHICLES = [
+    {
+        "name": "Renault Kiger",
+        "file": os.path.join(BACKEND_DIR, "Surface model (1).stl"),
+        "description": "Compact SUV with versatile trunk space",
+        "image": "kiger.png",
+    },
+]
+
+def normalize_name(name):
+    return " ".join(str(name).split()).casefold()
+
+def discover_vehicles(vehicle_dir=VEHICLE_DIR):
+    """Vehicle entries (name, file, description, image) for every STL in `vehicle_dir`."""
+    entries = []
+    if not vehicle_dir or not os.path.isdir(vehicle_dir):
+        return entries
+    for filename in sorted(os.listdir(vehicle_dir)):
+        stem, ext = os.path.splitext(filename)
+        if ext.lower() != ".stl":
+            continue
+        entry = {"name": stem, "file": os.path.join(vehicle_dir, filename), "description": "", "image": None}
+        sidecar = os.path.join(vehicle_dir, stem + ".json")
+        if os.path.isfile(sidecar):
+            try:
+                with open(sidecar) as f:
+                    meta = json.load(f)
+                entry.update({k: meta[k] for k in ("name", "description", "image") if k in meta})
+            except (OSError, ValueError) as e:
+                logger.warning(f"CATALOGUE: ignoring unreadable {sidecar}: {e}")
+        entries.append(entry)
+    return entries
+
+def ingest_vehicle(path):
+    """Preprocess one trunk STL (here or in a pool worker); returns its measurements."""
+    from core.engine import get_trunk, trunk_artifacts, measure_trunk_volume
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    trunk = get_trunk(file_bytes)
+    volume = trunk_artifacts(trunk).get('volume')
+    if volume is None:
+        volume = measure_trunk_volume(trunk)
+    return {"volume_m3": float(volume), "extents_m": [float(e) for e in trunk.extents]}
+
+def _volume_label(entry):
+    return f"{entry['volume_m3'] * 1000:.0f}L" if entry.get("volume_m3") else "Unknown"
+
+def _dimensions_label(entry):
+    if not entry.get("extents_m"):
+        return "Unknown"
+    length, width, height = entry["extents_m"]
+    return f"L: {length:.2f}m × W: {width:.2f}m × H: {height:.2f}m"
+
+class VehicleCatalogue:
+    def __init__(self, vehicles=None):
+        self._lock = threading.Lock()
+        self._index = {}  # normalized name -> entry
+        self._bytes = {}  # normalized name -> STL payload, read on first use
+        for entry in vehicles if vehicles is not None else BUILTIN_VEHICLES + discover_vehicles():
+            self.register(entry)
+
+    def register(self, entry):
+        key = normalize_name(entry["name"])
+        if key == normalize_name(CUSTOM_VEHICLE):
+            raise ValueError(f"'{CUSTOM_VEHICLE}' is reserved for uploaded trunks")
+        with self._lock:
+            if key in self._index:
+                logger.warning(f"CATALOGUE: '{entry['name']}' from {entry['file']} replaces {self._index[key]['file']}")
+            self._index[key] = dict(entry, status="pending", volume_m3=None, extents_m=None, error=None)
+            self._bytes.pop(key, None)
+
+    def resolve(self, name):
+        """Catalogue entry for a car model name, or None."""
+        return self._index.get(normalize_name(name))
+
+    def read_bytes(self, name):
+        """STL payload of a catalogue vehicle (cached); None for unknown names."""
+        key = normalize_name(name)
+        file_bytes = self._bytes.get(key)
+        if file_bytes is None:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            with open(entry["file"], "rb") as f:
+                file_bytes = f.read()
+            self._bytes[key] = file_bytes
+        return file_bytes
+
+    def entries(self):
+        with self._lock:
+            return list(self._index.values())
+
+    def ingest(self, executor=None, load=None):
+        """Preprocess every pending vehicle, then `load(bytes)` each one here.
+
+        Vehicles are preprocessed one after another in this thread, or in
+        parallel in `executor` (a process pool); `load` (e.g. get_trunk) then
+        maps the stored artifacts into this process so the first request for
+        any vehicle hits the trunk cache. Returns the number of vehicles ready.
+        """
+        started = time.time()
+        pending = [entry for entry in self.entries() if entry["status"] == "pending"]
+        if executor is not None:
+            jobs = [(entry, executor.submit(ingest_vehicle, entry["file"]).result) for entry in pending]
+        else:
+            jobs = [(entry, functools.partial(ingest_vehicle, entry["file"])) for entry in pending]
+        ready = 0
+        for entry, run in jobs:
+            try:
+                entry.update(run(), status="ready")
+                if load is not None:
+                    load(self.read_bytes(entry["name"]))
+                ready += 1
+            except Exception as e:
+                logger.error(f"CATALOGUE: could not ingest '{entry['name']}' ({entry['file']}): {e}")
+                entry.update(status="error", error=str(e))
+        logger.info(f"CATALOGUE: {ready}/{len(pending)} vehicle(s) ingested in {time.time() - started:.2f}s")
+        return ready
+
+    def cars(self):
+        """The /cars listing: every catalogue vehicle, then the custom upload option."""
+        listing = [{
+            "name": entry["name"],
+            "description": entry.get("description") or "",
+            "volume": _volume_label(entry),
+            "dimensions": _dimensions_label(entry),
+            "image": entry.get("image"),
+            "volume_liters": round(entry["volume_m3"] * 1000, 1) if entry.get("volume_m3") else None,
+            "dimensions_m": [round(e, 3) for e in entry["extents_m"]] if entry.get("extents_m") else None,
+            "status": entry["status"],
+        } for entry in self.entries() if entry["status"] != "error"]
+        listing.append({
+            "name": "Custom Vehicle",
+            "description": "Upload your own vehicle's STL model",
+            "volume": "Variable",
+            "dimensions": "Custom",
+            "image": "custom.png",
+            "volume_liters": None,
+            "dimensions_m": None,
+            "status": "ready",
+        })
+        return listing
@@ -0,0 +1,84 @@
+import numpy as np
+
+# --------------------------------------------------------------------------
+# COLLISION WORLD
+# --------------------------------------------------------------------------
+# Placed bags of one packing run, kept as axis-aligned boxes in flat arrays.
+# Every bag is an axis-aligned box, so its bounds are its exact shape. Each
+# bag is registered once and owns a row; moving it rewrites the row and
+# removing it frees the row for reuse, both O(1). A query tests all rows in
+# one vectorized step and can leave one bag out (the bag being moved). The
+# overlap test is strict, so boxes that only touch do not collide.
+
+class CollisionWorld:
+    def __init__(self, capacity=16):
+        self._lo = np.zeros((capacity, 3))
+        self._hi = np.zeros((capacity, 3))
+        self._active = np.zeros(capacity, dtype=bool)
+        self._rows = {}  # name -> row
+        self._free = []  # rows released by remove()
+        self._used = 0  # rows ever handed out
+
+    @classmethod
+    def from_bags(cls, placed_bags_info):
+        """World holding the placed bags of an engine result, keyed by original_idx."""
+        world = cls(max(16, len(placed_bags_info)))
+        for info in placed_bags_info:
+            world.add(info['original_idx'], info['bag_mesh'].bounds)
+        return world
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    def _grow(self):
+        capacity = 2 * len(self._active)
+        for attr in ('_lo', '_hi', '_active'):
+            old = getattr(self, attr)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, attr, new)
+
+    def add(self, name, bounds):
+        if name in self._rows:
+            raise KeyError(f"{name!r} is already in the collision world")
+        if self._free:
+            row = self._free.pop()
+        else:
+            if self._used == len(self._active):
+                self._grow()
+            row, self._used = self._used, self._used + 1
+        self._rows[name] = row
+        self._active[row] = True
+        self.move(name, bounds)
+
+    def move(self, name, bounds):
+        row = self._rows[name]
+        self._lo[row], self._hi[row] = bounds[0], bounds[1]
+
+    def remove(self, name):
+        row = self._rows.pop(name)
+        self._active[row] = False
+        self._free.append(row)
+
+    def bounds(self, name):
+        row = self._rows[name]
+        return np.array([self._lo[row], self._hi[row]])
+
+    def all_bounds(self, exclude=None):
+        """(n, 2, 3) bounds of every bag except `exclude`."""
+        rows = [row for name, row in self._rows.items() if name != exclude]
+        return np.stack([self._lo[rows], self._hi[rows]], axis=1) if rows else np.zeros((0, 2, 3))
+
+    def collides(self, bounds, exclude=None):
+        """True if a box with `bounds` overlaps any bag other than `exclude`."""
+        n = self._used
+        if not self._rows:
+            return False
+        hit = self._active[:n] & np.all(self._lo[:n] < bounds[1], axis=1) & np.all(self._hi[:n] > bounds[0], axis=1)
+        row = self._rows.get(exclude) if exclude is not None else None
+        if row is not None:
+            hit[row] = False
+        return bool(hit.any())
@@ -1,8 +1,6 @@
 import os
-import pymongo
 import hashlib
 import logging
-from dotenv import load_dotenv
 
 # Configure logging
 logging.basicConfig(
@@ -14,12 +12,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-
 # DATABASE CONNECTION
 #---------------------------------------------------------------------------
+# pymongo is imported on first use so that importing this module (and
+# starting the API) stays cheap. load_env is cheap too, and api.py calls it
+# before importing anything that reads settings at import time.
+_env_loaded = False
+
+def load_env():
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
 
 def get_db_connection():
+    load_env()
     # Connection string from environment variable
     connection_string = os.getenv("MONGO_URI")
     if not connection_string:
@@ -35,6 +43,7 @@ def get_db_connection():
 
     try:
         # Increase timeout and handle potential DNS/Net errors
+        import pymongo
         clean_connection_string = connection_string.strip().strip('"').strip("'")
         client = pymongo.MongoClient(clean_connection_string, serverSelectionTimeoutMS=2000, tlsAllowInvalidCertificates=True)
         # Verify connection
@@ -171,13 +180,23 @@ def get_history_local(username):
     except Exception:
         return []
 
-def save_history(username, car_model, stats, status="Completed"):
+# Heavy fields of a history entry, returned by get_history_entry only
+HISTORY_DETAIL_FIELDS = ("inputs", "layout")
+
+def _history_summary(item):
+    return {k: v for k, v in item.items() if k not in HISTORY_DETAIL_FIELDS}
+
+def save_history(username, car_model, stats, status="Completed", details=None):
+    """Append a history entry; `details` (inputs, trunk_key, layout...) are stored with it."""
     import datetime
+    import uuid
     item = {
+        "entry_id": uuid.uuid4().hex,
         "timestamp": datetime.datetime.now().isoformat(),
         "car_model": car_model,
         "stats": stats,
-        "status": status
+        "status": status,
+        **(details or {})
     }
     
     try:
@@ -199,10 +218,10 @@ def get_history(username):
     try:
         db = get_db_connection()
         if db is None:
-            return get_history_local(username)
+            return [_history_summary(item) for item in get_history_local(username)]
             
         history_collection = db["history"]
-        cursor = history_collection.find({"username": username}).sort("timestamp", -1)
+        cursor = history_collection.find({"username": username}, {field: 0 for field in HISTORY_DETAIL_FIELDS}).sort("timestamp", -1)
         results = []
         for doc in cursor:
             doc["_id"] = str(doc["_id"])
@@ -210,5 +229,19 @@ def get_history(username):
         return results
     except Exception as e:
         print(f"Database error: {e}")
-        return get_history_local(username)
+        return [_history_summary(item) for item in get_history_local(username)]
+
+def get_history_entry(username, entry_id):
+    """One full history entry (with inputs and layout), or None."""
+    try:
+        db = get_db_connection()
+        if db is None:
+            return next((item for item in get_history_local(username) if item.get("entry_id") == entry_id), None)
 
+        doc = db["history"].find_one({"username": username, "entry_id": entry_id})
+        if doc is not None:
+            doc["_id"] = str(doc["_id"])
+        return doc
+    except Exception as e:
+        print(f"Database error: {e}")
+        return next((item for item in get_history_local(username) if item.get("entry_id") == entry_id), None)
@@ -3,6 +3,12 @@ import numpy as np
 from trimesh.creation import box
 import itertools
 import time
+import base64
+import hashlib
+import threading
+import os
+import heapq
+from collections import OrderedDict
 
 import logging
 
@@ -10,37 +16,11 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-try:
-    import rtree
-    logger.info("Rtree imported successfully")
-except ImportError:
-    logger.error("Failed to import Rtree. Containment checks will fail.")
-
 from io import BytesIO
-
-# Fallback Class for environments without FCL
-class SimpleCollisionManager:
-    def __init__(self):
-        self.objects = {}
-    def add_object(self, name, mesh):
-        self.objects[name] = mesh
-    def in_collision_single(self, mesh):
-        # Simple AABB collision check
-        for other_mesh in self.objects.values():
-            if np.all(mesh.bounds[0] < other_mesh.bounds[1]) and \
-               np.all(mesh.bounds[1] > other_mesh.bounds[0]):
-                return True
-        return False
-
-# Try to import AND INSTANTIATE CollisionManager
-# Trimesh only raises ValueError on init if FCL is missing
-try:
-    from trimesh.collision import CollisionManager
-    # Test instantiation to catch missing FCL early
-    _test_mgr = CollisionManager()
-except (ValueError, ImportError):
-    print("FCL not available, using SimpleCollisionManager fallback")
-    CollisionManager = SimpleCollisionManager
+from core.stl_io import read_stl, read_stl_triangles
+from core.artifacts import save_artifacts, load_artifacts, artifact_path, ARTIFACT_DIR
+from core.mesh_codec import QMESH_FORMAT, encode_mesh
+from core.collision import CollisionWorld
 
 # --------------------------------------------------------------------------
 # CLOUD DEPLOYMENT CONFIGURATION
@@ -61,15 +41,28 @@ def export_scene_to_stl(trunk, placed_bags_info):
     combined = trimesh.util.concatenate(meshes)
     return combined
 
-_trunk_voxel_cache = {}
+# The module-level LRU caches are shared by threadpool requests, so each has
+# a lock; values are built outside it (two threads may both build one, the
+# last store wins)
+_trunk_voxel_cache = OrderedDict()
+_trunk_voxel_lock = threading.Lock()
 def _get_trunk_voxels(trunk_mesh, pitch):
+    stored = trunk_artifacts(trunk_mesh).get('voxels', {}).get(float(pitch))
+    if stored is not None:
+        return stored
     key = (id(trunk_mesh), float(pitch))
-    vox = _trunk_voxel_cache.get(key)
-    if vox is None:
-        logger.debug(f"Voxelizing trunk pitch={pitch}...")
-        vox = trunk_mesh.voxelized(pitch=pitch)
+    with _trunk_voxel_lock:
+        vox = _trunk_voxel_cache.get(key)
+        if vox is not None:
+            _trunk_voxel_cache.move_to_end(key)
+            return vox
+    logger.debug(f"Voxelizing trunk pitch={pitch}...")
+    vox = trunk_mesh.voxelized(pitch=pitch)
+    with _trunk_voxel_lock:
         _trunk_voxel_cache[key] = vox
-        logger.debug("Voxelization complete.")
+        while len(_trunk_voxel_cache) > TRUNK_CACHE_LIMIT:
+            _trunk_voxel_cache.popitem(last=False)
+    logger.debug("Voxelization complete.")
     return vox
 
 def strict_containment_or_voxel(trunk_mesh, bag_mesh, voxel_pitch=0.01):
@@ -87,8 +80,10 @@ def strict_containment_or_voxel(trunk_mesh, bag_mesh, voxel_pitch=0.01):
         vox = _get_trunk_voxels(trunk_mesh, voxel_pitch)
         filled = vox.is_filled(bag_mesh.vertices)
         return bool(np.all(filled))
-    except Exception:
-        return True
+    except Exception as e:
+        # A position that could not be checked is not contained
+        logger.warning(f"Voxel containment check failed: {e}")
+        return False
 
 def enhanced_containment_check(trunk_mesh, bag_mesh):
     return strict_containment_or_voxel(trunk_mesh, bag_mesh)
@@ -157,6 +152,37 @@ def create_custom_bag(length_cm, breadth_cm, thickness_cm):
     thickness = thickness_cm / 100
     return box(extents=[length, breadth, thickness])
 
+# Irregular items (strollers, golf bags...) arrive as STL uploads and travel
+# in bags_info as ("Mesh", name, stl_bytes); only the "voxel" engine packs them.
+MESH_BAG = "Mesh"
+_mesh_bag_cache = OrderedDict()
+_mesh_bag_lock = threading.Lock()
+MESH_BAG_CACHE_LIMIT = 64
+
+def create_mesh_bag(stl_bytes):
+    """Bag mesh from an STL payload, centred on its bounds like the box bags (same unit rule as the trunk)."""
+    key = hashlib.sha256(stl_bytes).hexdigest()
+    with _mesh_bag_lock:
+        mesh = _mesh_bag_cache.get(key)
+        if mesh is not None:
+            _mesh_bag_cache.move_to_end(key)
+    if mesh is None:
+        mesh = read_stl(stl_bytes)
+        if mesh.extents.max() > 10:
+            mesh.apply_scale(0.001)
+        mesh.apply_translation(-mesh.bounds.mean(axis=0))
+        with _mesh_bag_lock:
+            _mesh_bag_cache[key] = mesh
+            while len(_mesh_bag_cache) > MESH_BAG_CACHE_LIMIT:
+                _mesh_bag_cache.popitem(last=False)
+    return mesh.copy()
+
+def bag_mesh_for(bag_info):
+    """Unplaced mesh of a bags_info entry: (type, size), ("Custom", L, B, T) or ("Mesh", name, stl)."""
+    if bag_info[0] == MESH_BAG:
+        return create_mesh_bag(bag_info[2])
+    return create_bag(*bag_info) if len(bag_info) == 2 else create_custom_bag(*bag_info[1:])
+
 def unique_rotations(bag_mesh, tol=1e-6):
     extents = bag_mesh.extents
     if abs(extents[0] - extents[1]) < tol and abs(extents[1] - extents[2]) < tol:
@@ -166,13 +192,47 @@ def unique_rotations(bag_mesh, tol=1e-6):
         unique_extents.add(tuple(np.round(perm, 6)))
     return [box(extents=ext) for ext in unique_extents]
 
-import logging
-logger = logging.getLogger(__name__)
+# Lattice search shared by fittest_placement and fill_remaining_gaps. Both
+# want the lowest (z, y, x) feasible point, and for that objective a
+# coarse-to-fine pass cannot skip anything: every finer point before a coarse
+# hit still has to be checked before the hit can be trusted. So there are no
+# coarse levels or per-level top-k. Work is saved by the incumbent bound
+# across rotations, by _SearchState across identical bags and by the
+# precomputed feasibility maps.
+def ordered_search(axes, evaluate, bound=None, max_evals=None, start=None):
+    """Find the lexicographically smallest feasible point of a regular lattice.
 
-def load_trunk(file_content):
-    logger.info("Loading trunk mesh from bytes...")
-    trunk = trimesh.load_mesh(BytesIO(file_content), file_type='stl')
-    logger.info(f"Trunk loaded. Vertices: {len(trunk.vertices)}, Faces: {len(trunk.faces)}")
+    `axes` holds the coordinate arrays, most significant first, and
+    `evaluate(point)` tells whether a point is feasible. Points are scanned in
+    lexicographic order, so the first feasible one is the answer; no point
+    before it can be skipped, which is why a coarse pass would only add work.
+    Only points strictly smaller than `bound` are considered (the best corner
+    of an earlier rotation), and points before `start` are known to fail
+    without calling `evaluate`.
+    Returns (point, evaluations); point is None if nothing beats `bound`
+    within `max_evals` evaluations.
+    """
+    bound = tuple(bound) if bound is not None else None
+    start = tuple(start) if start is not None else None
+    evals = 0
+    for point in itertools.product(*(a.tolist() for a in axes)):
+        if bound is not None and point >= bound:
+            break
+        if start is not None and point < start:
+            continue
+        if max_evals is not None and evals >= max_evals:
+            break
+        evals += 1
+        if evaluate(point):
+            return point, evals
+    return None, evals
+
+def _box_at(bag_rotation, corner):
+    trial = bag_rotation.copy()
+    trial.apply_translation(np.asarray(corner, dtype=float) - trial.bounds[0])
+    return trial
+
+def normalize_trunk(trunk):
     if trunk.extents.max() > 10:
         logger.info("Scaling trunk down...")
         trunk.apply_scale(0.001)
@@ -180,25 +240,622 @@ def load_trunk(file_content):
     trunk.apply_translation([0, 0, -trunk.bounds[0][2]])
     R = trimesh.transformations.rotation_matrix(np.pi / 2, [1, 0, 0])
     trunk.apply_transform(R)
+    return trunk
+
+def estimate_trunk_shape(file_content):
+    """(extents in metres, face count) of an STL payload without building the mesh (None if unreadable).
+
+    Same unit rule as normalize_trunk; its rotation only permutes the axes.
+    """
+    try:
+        triangles = read_stl_triangles(file_content)
+    except Exception:
+        return None
+    corners = triangles.reshape(-1, 3)
+    extents = corners.max(axis=0).astype(float) - corners.min(axis=0)
+    return (extents * 0.001 if extents.max() > 10 else extents), len(triangles)
+
+def repair_trunk(trunk):
     if not trunk.is_watertight:
         logger.info("Trunk is not watertight. Filling holes...")
         trunk.fill_holes()
         logger.info("Holes filled.")
     return trunk
 
-def fittest_placement(trunk, bags_info, progress_callback=None):
+def load_trunk(file_content):
+    logger.info("Loading trunk mesh from bytes...")
+    trunk = read_stl(file_content)
+    logger.info(f"Trunk loaded. Vertices: {len(trunk.vertices)}, Faces: {len(trunk.faces)}")
+    return repair_trunk(normalize_trunk(trunk))
+
+# --------------------------------------------------------------------------
+# TRUNK LEVEL OF DETAIL
+# --------------------------------------------------------------------------
+# Dense scans are reduced once at load time: a collision proxy (containment,
+# feasibility maps, heightmaps) whose vertices move by at most
+# COLLISION_PROXY_ERROR, and a display mesh within DISPLAY_FACE_BUDGET for the
+# client. The full-resolution mesh is only used for the packed-scene export.
+# Face budgets are soft targets: the error doubles until the budget is met
+# but never past its cap (COLLISION_MAX_ERROR, DISPLAY_MAX_ERROR), since the
+# cap is what keeps containment checks on the proxy trustworthy. Meshes that
+# stay over budget at the cap are kept as they are and logged.
+LOD_FACE_THRESHOLD = 20000
+COLLISION_PROXY_ERROR = 0.005  # metres, same as the placement tolerance
+COLLISION_FACE_BUDGET = 20000
+COLLISION_MAX_ERROR = 0.02
+DISPLAY_FACE_BUDGET = 20000
+DISPLAY_MAX_ERROR = 0.04
+
+def cluster_decimate(mesh, max_error):
+    """Vertex-clustering decimation; every vertex moves by at most `max_error`.
+
+    Vertices are merged per grid cell of side max_error / sqrt(3) into their
+    mean, collapsed faces are dropped, and coincident faces cancel in pairs
+    so ray-parity containment stays consistent.
+    """
+    cell = max_error / np.sqrt(3)
+    keys = np.floor((mesh.vertices - mesh.bounds[0]) / cell).astype(np.int64)
+    _, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    counts = np.bincount(inverse).astype(float)
+    vertices = np.column_stack([np.bincount(inverse, weights=mesh.vertices[:, k]) / counts for k in range(3)])
+    faces = inverse[mesh.faces]
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    if len(faces):
+        _, first, occurrences = np.unique(np.sort(faces, axis=1), axis=0, return_index=True, return_counts=True)
+        faces = faces[np.sort(first[occurrences % 2 == 1])]
+    return trimesh.Trimesh(vertices=vertices, faces=faces, process=True)
+
+def load_trunk_lods(file_content):
+    """Load a trunk as {'collision', 'display', 'export'} meshes (the same object when small)."""
+    logger.info("Loading trunk mesh from bytes...")
+    original = normalize_trunk(read_stl(file_content))
+    logger.info(f"Trunk loaded. Vertices: {len(original.vertices)}, Faces: {len(original.faces)}")
+    if len(original.faces) <= LOD_FACE_THRESHOLD:
+        trunk = repair_trunk(original)
+        return {'collision': trunk, 'display': trunk, 'export': trunk}
+
+    start_time = time.time()
+
+    def reduce(budget, error, max_error, level):
+        mesh = cluster_decimate(original, error)
+        while len(mesh.faces) > budget and error * 2 <= max_error:
+            error *= 2
+            mesh = cluster_decimate(original, error)
+        if len(mesh.faces) > budget:
+            logger.warning(f"Trunk LOD: {level} mesh has {len(mesh.faces)} faces at the {error * 1000:.0f} mm "
+                           f"error cap, over its {budget} face budget")
+        return mesh, error
+
+    collision, collision_error = reduce(COLLISION_FACE_BUDGET, COLLISION_PROXY_ERROR, COLLISION_MAX_ERROR, 'collision')
+    collision = repair_trunk(collision)
+    display, display_error = reduce(DISPLAY_FACE_BUDGET, collision_error, DISPLAY_MAX_ERROR, 'display')
+    logger.info(f"Trunk LOD: {len(original.faces)} -> collision {len(collision.faces)} (<= {collision_error * 1000:.0f} mm), "
+                f"display {len(display.faces)} (<= {display_error * 1000:.0f} mm) faces in {time.time() - start_time:.2f}s")
+    return {'collision': collision, 'display': display, 'export': original}
+
+def trunk_lod(trunk, level):
+    """The 'display' or 'export' mesh for a cached trunk (the trunk itself if it has no LODs)."""
+    return trunk_artifacts(trunk).get(level, trunk)
+
+# --------------------------------------------------------------------------
+# FEASIBILITY MAPS (EMPTY-TRUNK CONTAINMENT PER BOX ROTATION)
+# --------------------------------------------------------------------------
+# For a given trunk, whether a box fits at a lattice position in the *empty*
+# trunk never changes. Maps are boolean (z, y, x) grids over the placement
+# lattice, equivalent to strict_containment_or_voxel at every lattice point.
+# Corner containment is answered with one vertical ray per corner column
+# (hit-count parity) instead of one mesh query per corner.
+
+PLACEMENT_TOLERANCE = 0.005
+
+def placement_lattice(trunk, extents, step):
+    """Lattice of min-corner positions fittest_placement scans for a rotation, as (z, y, x) axes."""
+    return _lattice_axes(get_usable_trunk_bounds(trunk), extents, step)
+
+def _lattice_axes(trunk_bounds, extents, step):
+    minx, miny, minz = trunk_bounds[0]
+    maxx, maxy, maxz = trunk_bounds[1]
+    TOLERANCE = PLACEMENT_TOLERANCE
+    x_range = np.arange(minx + TOLERANCE, min(maxx - extents[0] - TOLERANCE, maxx - 0.01), step)
+    y_range = np.arange(miny + TOLERANCE, min(maxy - extents[1] - TOLERANCE, maxy - 0.01), step)
+    z_range = np.arange(minz + TOLERANCE, min(maxz - extents[2] - TOLERANCE, maxz - 0.01), step)
+    return z_range, y_range, x_range
+
+def catalogue_extents():
+    """Every distinct rotated box extent reachable from bags_data."""
+    extents = set()
+    for btype, sizes in bags_data.items():
+        for sz in sizes:
+            for rot in unique_rotations(create_bag(btype, sz)):
+                extents.add(tuple(np.round(rot.extents, 6)))
+    return sorted(extents)
+
+def _column_hits(trunk, xs, ys):
+    """Sorted z of every surface crossing along vertical lines at (xs x ys), padded with inf.
+
+    Vertical rays only need a 2D point-in-triangle test on the xy projection
+    plus barycentric interpolation of z. Each triangle is only paired with the
+    columns inside its xy bounding box, so the cost scales with faces plus
+    actual candidate pairs rather than faces x columns.
+    """
+    xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+    nx, ny = len(xs), len(ys)
+    tri = trunk.triangles
+    a, b, c = tri[:, 0], tri[:, 1], tri[:, 2]
+    det = (b[:, 1] - c[:, 1]) * (a[:, 0] - c[:, 0]) + (c[:, 0] - b[:, 0]) * (a[:, 1] - c[:, 1])
+    valid = np.abs(det) > 1e-15  # skip triangles seen edge-on from above
+    a, b, c, det = a[valid], b[valid], c[valid], det[valid]
+    lo, hi = np.minimum(np.minimum(a, b), c), np.maximum(np.maximum(a, b), c)
+
+    ix0, ix1 = np.searchsorted(xs, lo[:, 0], 'left'), np.searchsorted(xs, hi[:, 0], 'right')
+    iy0, iy1 = np.searchsorted(ys, lo[:, 1], 'left'), np.searchsorted(ys, hi[:, 1], 'right')
+    spans_x, spans_y = np.maximum(ix1 - ix0, 0), np.maximum(iy1 - iy0, 0)
+    pairs = spans_x * spans_y
+    t = np.repeat(np.arange(len(pairs)), pairs)
+    offset = np.arange(len(t)) - np.repeat(np.cumsum(pairs) - pairs, pairs)
+    ix = ix0[t] + offset % np.maximum(spans_x[t], 1)
+    iy = iy0[t] + offset // np.maximum(spans_x[t], 1)
+
+    qx, qy = xs[ix], ys[iy]
+    l1 = ((b[t, 1] - c[t, 1]) * (qx - c[t, 0]) + (c[t, 0] - b[t, 0]) * (qy - c[t, 1])) / det[t]
+    l2 = ((c[t, 1] - a[t, 1]) * (qx - c[t, 0]) + (a[t, 0] - c[t, 0]) * (qy - c[t, 1])) / det[t]
+    l3 = 1.0 - l1 - l2
+    hit = (l1 >= -1e-12) & (l2 >= -1e-12) & (l3 >= -1e-12)
+    t, l1, l2, l3 = t[hit], l1[hit], l2[hit], l3[hit]
+    ray_idx = ix[hit] * ny + iy[hit]
+    hit_z = l1 * a[t, 2] + l2 * b[t, 2] + l3 * c[t, 2]
+
+    order = np.lexsort((hit_z, ray_idx))
+    ray_idx, hit_z = ray_idx[order], hit_z[order]
+    # Lines through shared edges/vertices report the same crossing more than once
+    keep = np.ones(len(ray_idx), dtype=bool)
+    keep[1:] = (ray_idx[1:] != ray_idx[:-1]) | (np.diff(hit_z) > 1e-9)
+    ray_idx, hit_z = ray_idx[keep], hit_z[keep]
+    rank = np.arange(len(ray_idx)) - np.searchsorted(ray_idx, ray_idx)
+    hits = np.full((nx * ny, int(rank.max()) + 1 if len(rank) else 1), np.inf)
+    hits[ray_idx, rank] = hit_z
+    return hits.reshape(nx, ny, -1)
+
+def compute_feasibility_map(trunk, extents, step, column_cache=None):
+    z_range, y_range, x_range = placement_lattice(trunk, extents, step)
+    shape = (len(z_range), len(y_range), len(x_range))
+    if min(shape) == 0:
+        return np.zeros(shape, dtype=bool)
+    if column_cache is None:
+        column_cache = {}
+    # Full-trunk lattice; each rotation's x/y axes are prefixes of it
+    full_z, full_y, full_x = placement_lattice(trunk, (0.0, 0.0, 0.0), step)
+    fits = np.ones(shape, dtype=bool)
+    for dx in (0.0, extents[0]):
+        for dy in (0.0, extents[1]):
+            key = (round(float(dx), 6), round(float(dy), 6))
+            if key not in column_cache:
+                column_cache[key] = _column_hits(trunk, full_x + dx, full_y + dy)
+            hits = column_cache[key][:shape[2], :shape[1]]
+            for dz in (0.0, extents[2]):
+                crossings = (hits[:, :, None, :] < (z_range + dz)[None, None, :, None]).sum(axis=-1)
+                fits &= (crossings % 2 == 1).transpose(2, 1, 0)
+
+    # Same voxel fallback as strict_containment_or_voxel for positions the rays reject
+    rejected = np.argwhere(~fits)
+    if len(rejected):
+        corners = np.array(list(itertools.product((0.0, extents[0]), (0.0, extents[1]), (0.0, extents[2]))))
+        base = np.column_stack([x_range[rejected[:, 2]], y_range[rejected[:, 1]], z_range[rejected[:, 0]]])
+        points = (base[:, None, :] + corners[None, :, :]).reshape(-1, 3)
+        try:
+            vox = _get_trunk_voxels(trunk, 0.01)
+            filled = np.asarray(vox.is_filled(points)).reshape(len(rejected), 8).all(axis=1)
+            fits[tuple(rejected[filled].T)] = True
+        except Exception as e:
+            logger.warning(f"Voxel containment fallback failed: {e}")
+    return fits
+
+def build_feasibility_maps(trunk, steps):
+    """{step: {box extents: map}} for every catalogue box at each of `steps`."""
+    feasibility = {}
+    for step in steps:
+        start_time = time.time()
+        column_cache = {}
+        maps = {ext: compute_feasibility_map(trunk, ext, step, column_cache) for ext in catalogue_extents()}
+        logger.info(f"Feasibility maps at {step * 100:g} cm: {len(maps)} boxes, {len(column_cache)} column sets "
+                    f"in {time.time() - start_time:.2f}s")
+        feasibility[round(float(step), 6)] = maps
+    return feasibility
+
+# Maps for other steps or custom boxes are computed on first use and kept
+# per trunk in this worker, oldest dropped first
+LAZY_MAP_LIMIT = 256
+LAZY_COLUMN_LIMIT = 32
+
+def get_feasibility_map(trunk, extents, step):
+    """Feasibility map of a box at `step` for a cached trunk, or None for uncached trunks.
+
+    Catalogue boxes at every STEP_LADDER step come from the trunk artifacts;
+    any other box or step is computed once (a few ms) and kept.
+    """
+    artifacts = trunk_artifacts(trunk)
+    feasibility = artifacts.get('feasibility')
+    if not feasibility:
+        return None
+    key = tuple(np.round(extents, 6))
+    stored = feasibility.get(round(float(step), 6), {})
+    if key in stored:
+        return stored[key]
+    lazy_key = (round(float(step), 6), key)
+    with _trunk_locks_guard:
+        lazy = artifacts.setdefault('lazy_maps', OrderedDict())
+        columns = artifacts.setdefault('lazy_columns', {}).setdefault(lazy_key[0], {})
+        fmap = lazy.get(lazy_key)
+        local_columns = dict(columns)
+    if fmap is None:
+        fmap = compute_feasibility_map(trunk, extents, step, local_columns)
+        with _trunk_locks_guard:
+            columns.update(local_columns)
+            lazy[lazy_key] = fmap
+            while len(lazy) > LAZY_MAP_LIMIT:
+                lazy.popitem(last=False)
+            while len(columns) > LAZY_COLUMN_LIMIT:
+                columns.pop(next(iter(columns)))
+    return fmap
+
+def _blocked_positions(axes, extents, obstacles):
+    """Lattice positions (z, y, x axes) where a box of `extents` overlaps any obstacle AABB."""
+    z_range, y_range, x_range = axes
+    blocked = np.zeros((len(z_range), len(y_range), len(x_range)), dtype=bool)
+    for lo, hi in obstacles:
+        # Same strict AABB overlap test as CollisionWorld
+        xs = (x_range < hi[0]) & (x_range + extents[0] > lo[0])
+        ys = (y_range < hi[1]) & (y_range + extents[1] > lo[1])
+        zs = (z_range < hi[2]) & (z_range + extents[2] > lo[2])
+        blocked |= zs[:, None, None] & ys[None, :, None] & xs[None, None, :]
+    return blocked
+
+def first_free_position(fmap, axes, extents, obstacles, bound=None, verify=None, start=None):
+    """Lexicographically smallest (z, y, x) lattice point that is feasible and collision-free.
+
+    `verify(point)` is an optional exact check run on the winner before it is
+    accepted (e.g. the mesh collision manager); rejected points are skipped.
+    Points before `start` are known to be taken and are not examined.
+    """
+    z0 = 0 if start is None else int(np.searchsorted(axes[0], start[0] - 1e-9))
+    layers = (axes[0][z0:], axes[1], axes[2])
+    free = fmap[z0:] & ~_blocked_positions(layers, extents, obstacles)
+    for flat in np.flatnonzero(free):
+        iz, iy, ix = np.unravel_index(flat, free.shape)
+        point = (float(layers[0][iz]), float(layers[1][iy]), float(layers[2][ix]))
+        if start is not None and point < tuple(start):
+            continue
+        if bound is not None and not point < tuple(bound):
+            return None
+        if verify is None or verify(point):
+            return point
+    return None
+
+# Identical bags (and equal rotations of different bags) share their search
+# state within one placement pass. Bags are only ever added during a pass, so
+# a position that failed for one copy fails for every later one: the search
+# resumes at the `frontier` (every point before it is taken; _EXHAUSTED when
+# nothing is free at all). Containment never changes, so the on-the-fly
+# checks of custom boxes are kept in `contained` and never repeated.
+_EXHAUSTED = (np.inf,)
+
+class _SearchState:
+    __slots__ = ('frontier', 'contained')
+
+    def __init__(self):
+        self.frontier, self.contained = None, {}
+
+    def contains(self, point, check):
+        if point not in self.contained:
+            self.contained[point] = bool(check())
+        return self.contained[point]
+
+    def exhausted(self):
+        return self.frontier == _EXHAUSTED
+
+    def advance(self, corner, bound):
+        """Record a search result: the winner `corner`, or nothing before `bound`."""
+        reached = corner if corner is not None else bound if bound is not None else _EXHAUSTED
+        if self.frontier is None or tuple(reached) > self.frontier:
+            self.frontier = tuple(reached)
+
+# --------------------------------------------------------------------------
+# SEARCH RESOLUTION
+# --------------------------------------------------------------------------
+# The lattice step is chosen per request: the finest step of STEP_LADDER whose
+# predicted run time meets PACKING_LATENCY_TARGET (and whose maps stay within
+# MAX_MAP_POSITIONS), else the step predicted fastest. Coarse steps still end
+# in the 5 mm compaction passes, which refine the final positions. Set
+# PACKING_LATENCY_TARGET=0 to always use the load-time step.
+#
+# Catalogue boxes read maps stored at load time for every ladder step, so
+# their run time hardly depends on the step; it is dominated by the per-bag
+# and per-pair gravity, compaction and micro-adjust passes, which run mesh
+# queries and so grow with the collision mesh's face count. Custom boxes pay
+# for building their maps (per rotation per lattice position), and a coarse
+# lattice leaves them to the slower gap search. Fitted on benchmark runs
+# (Kiger trunk at 236 and 15k faces, 1-10 catalogue or custom bags, every
+# ladder step, cold and warm maps): ~13% mean error. Scale with
+# PACKING_MODEL_SCALE on hosts slower or faster than the benchmark machine.
+STEP_LADDER = (0.015, 0.02, 0.03, 0.05, 0.08)
+PACKING_LATENCY_TARGET = float(os.getenv("PACKING_LATENCY_TARGET", "2.0"))
+PACKING_MODEL_SCALE = float(os.getenv("PACKING_MODEL_SCALE", "1.0"))
+MAX_MAP_POSITIONS = 400000
+MODEL_SECONDS_PER_BAG = 0.081
+MODEL_SECONDS_PER_BAG_FACE = 8.9e-6
+MODEL_SECONDS_PER_PAIR = 0.0024  # per bag squared
+MODEL_SECONDS_PER_PAIR_FACE = 9.6e-7
+MODEL_CUSTOM_PAIR_SECONDS = 0.40  # per custom bag squared per metre of step
+MODEL_CUSTOM_PAIR_FACE_SECONDS = 9.3e-5
+MODEL_MAP_SECONDS = 6.0e-7  # building a map that is not cached yet, per rotation per lattice position
+
+def _rotation_extents(bags_info):
+    """[(rotated box extents, custom or not)] per lattice-packed bag of `bags_info`."""
+    extents = []
+    for bag_info in bags_info:
+        if bag_info[0] == MESH_BAG:
+            continue  # packed by the voxel engine, not on the lattice
+        try:
+            mesh = create_bag(*bag_info) if len(bag_info) == 2 else create_custom_bag(*bag_info[1:])
+        except KeyError:
+            continue  # unknown bag type; fittest_placement reports it
+        extents.append(([tuple(np.round(rot.extents, 6)) for rot in unique_rotations(mesh)], len(bag_info) != 2))
+    return extents
+
+def _predict_seconds(trunk_bounds, faces, rotation_extents, step, is_cached):
+    positions = int(np.prod([len(axis) for axis in _lattice_axes(trunk_bounds, (0.0, 0.0, 0.0), step)]))
+    bags = len(rotation_extents)
+    custom = sum(1 for _, is_custom in rotation_extents if is_custom)
+    seconds = (bags * (MODEL_SECONDS_PER_BAG + MODEL_SECONDS_PER_BAG_FACE * faces)
+               + bags ** 2 * (MODEL_SECONDS_PER_PAIR + MODEL_SECONDS_PER_PAIR_FACE * faces)
+               + custom ** 2 * step * (MODEL_CUSTOM_PAIR_SECONDS + MODEL_CUSTOM_PAIR_FACE_SECONDS * faces))
+    for rotations, _ in rotation_extents:
+        seconds += positions * MODEL_MAP_SECONDS * sum(1 for key in rotations if not is_cached(key))
+    return float(seconds) * PACKING_MODEL_SCALE, positions
+
+def predict_packing_seconds(trunk, rotation_extents, step):
+    artifacts = trunk_artifacts(trunk)
+    stored = (artifacts.get('feasibility') or {}).get(round(float(step), 6), {})
+    lazy = artifacts.get('lazy_maps', {})
+    return _predict_seconds(get_usable_trunk_bounds(trunk), len(trunk.faces), rotation_extents, step,
+                            lambda key: key in stored or (round(float(step), 6), key) in lazy)
+
+def _plan(predict, target):
+    target = PACKING_LATENCY_TARGET if target is None else target
+    base_step = GRID_STEP_CLOUD if IS_CLOUD else 0.05
+    if target <= 0:
+        step = base_step
+        predicted, _ = predict(step)
+    else:
+        plans = [(step, *predict(step)) for step in STEP_LADDER]
+        allowed = [plan for plan in plans if plan[2] <= MAX_MAP_POSITIONS] or plans[-1:]
+        step, predicted, _ = next((plan for plan in allowed if plan[1] <= target), min(allowed, key=lambda plan: plan[1]))
+    max_cands = MAX_CANDIDATES_CLOUD if IS_CLOUD else 400
+    return {
+        'step': float(step),
+        # fill_remaining_gaps scans a floor plane, so its budget scales with 1 / step^2
+        'max_candidates': int(max_cands * max(1.0, (base_step / step) ** 2)),
+        'predicted_seconds': round(predicted, 3),
+        'target_seconds': target,
+    }
+
+def plan_search(trunk, bags_info, target=None):
+    """Search parameters for one request: step, candidate cap and predicted run time."""
+    rotation_extents = _rotation_extents(bags_info)
+    return _plan(lambda step: predict_packing_seconds(trunk, rotation_extents, step), target)
+
+def plan_search_for_shape(extents, faces, bags_info, target=None):
+    """plan_search for a trunk that is not loaded, from its STL extents and face count.
+
+    Loading stores maps for every catalogue box, so only custom boxes count
+    as uncached; large meshes are searched on their collision LOD.
+    """
+    trunk_bounds = np.array([[0.01] * 3, np.asarray(extents, dtype=float) - 0.01])
+    if faces > LOD_FACE_THRESHOLD:
+        faces = min(faces, COLLISION_FACE_BUDGET)
+    rotation_extents = _rotation_extents(bags_info)
+    catalogue = set(catalogue_extents())
+    return _plan(lambda step: _predict_seconds(trunk_bounds, faces, rotation_extents, step, catalogue.__contains__), target)
+
+# Preprocessed per-trunk data lives next to the mesh cache (not in
+# trunk.metadata, which trimesh deep-copies on every mesh.copy()). The cache
+# holds the TRUNK_CACHE_LIMIT most recently used trunks; evicting one drops
+# its artifacts, loader lock and encoded display meshes with it (a request
+# still holding the trunk keeps working, without the precomputed maps).
+TRUNK_CACHE_LIMIT = int(os.getenv("TRUNK_CACHE_LIMIT", "16"))
+
+_trunk_cache = OrderedDict()
+_trunk_artifacts = {}
+_trunk_locks = {}
+_trunk_locks_guard = threading.Lock()
+
+def _cached_trunk(key):
+    with _trunk_locks_guard:
+        trunk = _trunk_cache.get(key)
+        if trunk is not None:
+            _trunk_cache.move_to_end(key)
+        return trunk
+
+def _cache_trunk(key, trunk, artifacts):
+    trunk.metadata['trunk_key'] = key
+    with _trunk_locks_guard:
+        _trunk_artifacts[key] = artifacts
+        _trunk_cache[key] = trunk
+        while len(_trunk_cache) > TRUNK_CACHE_LIMIT:
+            old_key, old_trunk = _trunk_cache.popitem(last=False)
+            logger.info(f"Trunk {old_key[:12]} evicted from the trunk cache")
+            _trunk_artifacts.pop(old_key, None)
+            _trunk_locks.pop(old_key, None)
+            for mesh_format in MESH_FORMATS:
+                _trunk_mesh_payloads.pop((old_key, mesh_format), None)
+            with _trunk_voxel_lock:
+                _trunk_voxel_cache.pop((id(old_trunk), CONTAINMENT_VOXEL_PITCH), None)
+
+def trunk_key(file_content):
+    return hashlib.sha256(file_content).hexdigest()
+
+def trunk_artifacts(trunk):
+    return _trunk_artifacts.get(trunk.metadata.get('trunk_key'), {})
+
+CONTAINMENT_VOXEL_PITCH = 0.01
+# Bump whenever trunk preprocessing or the stored layout changes, so entries
+# written by an older build are rebuilt instead of reused
+TRUNK_ARTIFACT_VERSION = 3
+
+def build_trunk_artifacts(file_content):
+    """Preprocess an STL payload into (collision trunk, artifacts dict)."""
+    lods = load_trunk_lods(file_content)
+    trunk = lods['collision']
+    artifacts = {
+        'display': lods['display'],
+        'export': lods['export'],
+        # Every step plan_search can choose, so catalogue boxes never build maps per request
+        'feasibility': build_feasibility_maps(trunk, STEP_LADDER),
+        'voxels': {CONTAINMENT_VOXEL_PITCH: _get_trunk_voxels(trunk, CONTAINMENT_VOXEL_PITCH)},
+        'volume': measure_trunk_volume(trunk),
+        'convex_hull': trunk.convex_hull,
+    }
+    return trunk, artifacts
+
+def _pack_trunk_artifacts(trunk, artifacts):
+    """Flatten a trunk and its artifacts into ({name: array}, JSON manifest) for the artifact store."""
+    arrays, meshes = {}, {}
+    lods = {'collision': trunk, 'display': artifacts['display'], 'export': artifacts['export'], 'convex_hull': artifacts['convex_hull']}
+    for level, mesh in lods.items():
+        # Small trunks use one mesh for every LOD; store it once
+        meshes[level] = next((name for name in meshes if lods[name] is mesh), level)
+        if meshes[level] == level:
+            arrays[f'{level}_vertices'], arrays[f'{level}_faces'] = mesh.vertices, mesh.faces
+    # All feasibility maps share one flat boolean array
+    maps, flat, offset = [], [], 0
+    for step, step_maps in artifacts['feasibility'].items():
+        for extents, fmap in step_maps.items():
+            maps.append({'step': step, 'extents': list(extents), 'shape': list(fmap.shape), 'offset': offset})
+            flat.append(fmap.ravel())
+            offset += fmap.size
+    arrays['feasibility'] = np.concatenate(flat) if flat else np.zeros(0, dtype=bool)
+    voxels = []
+    for pitch, vox in artifacts['voxels'].items():
+        name = f'voxels_{len(voxels)}'
+        arrays[name] = vox.encoding.dense
+        voxels.append({'pitch': pitch, 'array': name, 'transform': vox.transform.tolist()})
+    manifest = {'meshes': meshes, 'feasibility': maps,
+                'voxels': voxels, 'volume': float(artifacts['volume'])}
+    return arrays, manifest
+
+def _unpack_trunk_artifacts(manifest, arrays):
+    """Inverse of _pack_trunk_artifacts; meshes and maps are views into the (memory-mapped) arrays."""
+    meshes = {}
+    for level, source in manifest['meshes'].items():
+        if source not in meshes:
+            meshes[source] = trimesh.Trimesh(vertices=arrays[f'{source}_vertices'], faces=arrays[f'{source}_faces'], process=False)
+        meshes[level] = meshes[source]
+    flat = arrays['feasibility']
+    feasibility = {}
+    for entry in manifest['feasibility']:
+        size = int(np.prod(entry['shape']))
+        maps = feasibility.setdefault(float(entry['step']), {})
+        maps[tuple(entry['extents'])] = flat[entry['offset']:entry['offset'] + size].reshape(entry['shape'])
+    voxels = {}
+    for entry in manifest['voxels']:
+        encoding = trimesh.voxel.encoding.DenseEncoding(arrays[entry['array']])
+        voxels[float(entry['pitch'])] = trimesh.voxel.VoxelGrid(encoding, transform=np.array(entry['transform']))
+    artifacts = {
+        'display': meshes['display'],
+        'export': meshes['export'],
+        'feasibility': feasibility,
+        'voxels': voxels,
+        'volume': manifest['volume'],
+        'convex_hull': meshes['convex_hull'],
+    }
+    return meshes['collision'], artifacts
+
+def trunk_is_stored(key):
+    """True when the artifact store holds this trunk hash, so any process on the host can map it."""
+    return bool(ARTIFACT_DIR) and os.path.isdir(artifact_path(f"{key}-v{TRUNK_ARTIFACT_VERSION}"))
+
+def trunk_is_preprocessed(file_content):
+    """True when get_trunk will not have to preprocess this payload (cached in memory or on disk)."""
+    key = trunk_key(file_content)
+    return key in _trunk_cache or trunk_is_stored(key)
+
+def get_trunk(file_content):
+    """Load a trunk once per distinct STL payload and reuse the preprocessed mesh.
+
+    The returned mesh is the collision proxy; its display and export LODs, the
+    feasibility maps for every catalogue box at every STEP_LADDER step and the
+    containment voxel grid are built once per trunk, written to the shared
+    artifact store and memory-mapped from there (see core.artifacts), so all
+    workers on a host share one copy and restarts skip preprocessing. Kept in
+    the trunk cache, see trunk_artifacts.
+    """
+    key = trunk_key(file_content)
+    store_key = f"{key}-v{TRUNK_ARTIFACT_VERSION}"
+    trunk = _cached_trunk(key)
+    if trunk is not None:
+        return trunk
+    # One loader per trunk: a request arriving during warm-up waits for it
+    with _trunk_locks_guard:
+        lock = _trunk_locks.setdefault(key, threading.Lock())
+    with lock:
+        trunk = _cached_trunk(key)
+        if trunk is None:
+            stored = load_artifacts(store_key)
+            if stored is None:
+                trunk, artifacts = build_trunk_artifacts(file_content)
+                if save_artifacts(store_key, *_pack_trunk_artifacts(trunk, artifacts)):
+                    # Serve from the mapped files too, dropping this worker's private copy
+                    with _trunk_voxel_lock:
+                        _trunk_voxel_cache.pop((id(trunk), CONTAINMENT_VOXEL_PITCH), None)
+                    stored = load_artifacts(store_key)
+            else:
+                logger.info(f"Trunk {key[:12]} mapped from the artifact store")
+            if stored is not None:
+                trunk, artifacts = _unpack_trunk_artifacts(*stored)
+            _cache_trunk(key, trunk, artifacts)
+    return trunk
+
+def find_trunk(key):
+    """Preprocessed trunk for a trunk hash from the cache or the artifact store; None if neither has it.
+
+    Never builds anything, so stored layouts can be shown without the STL.
+    """
+    trunk = _cached_trunk(key)
+    if trunk is not None:
+        return trunk
+    with _trunk_locks_guard:
+        lock = _trunk_locks.setdefault(key, threading.Lock())
+    with lock:
+        trunk = _cached_trunk(key)
+        if trunk is None:
+            stored = load_artifacts(f"{key}-v{TRUNK_ARTIFACT_VERSION}")
+            if stored is None:
+                with _trunk_locks_guard:
+                    if key not in _trunk_cache and _trunk_locks.get(key) is lock:
+                        del _trunk_locks[key]
+                return None
+            trunk, artifacts = _unpack_trunk_artifacts(*stored)
+            _cache_trunk(key, trunk, artifacts)
+    return trunk
+
+def fittest_placement(trunk, bags_info, progress_callback=None, search=None, world=None, pending=None):
+    """Place bags largest first at the lowest free lattice point; placed bags are added to `world`.
+
+    `pending` restricts the pass to those indices of `bags_info` (default: all).
+    """
     placed_info, unplaced_info = [], []
-    collision_manager = CollisionManager()
+    if world is None:
+        world = CollisionWorld()
     trunk_bounds = get_usable_trunk_bounds(trunk)
     
-    # CLOUD SAFEGUARD: Coarser resolution
-    step = GRID_STEP_CLOUD if IS_CLOUD else 0.05
-    
-    minx, miny, minz = trunk_bounds[0]
-    maxx, maxy, maxz = trunk_bounds[1]
+    # CLOUD SAFEGUARD: Coarser resolution (unless a search plan picked the step)
+    step = search['step'] if search else GRID_STEP_CLOUD if IS_CLOUD else 0.05
 
     all_bags_data = []
     for i, bag_info in enumerate(bags_info):
+        if pending is not None and i not in pending:
+            continue
         if len(bag_info) == 2:
             btype, sz = bag_info
             mesh = create_bag(btype, sz)
@@ -213,49 +870,44 @@ def fittest_placement(trunk, bags_info, progress_callback=None):
             })
     sorted_bags = sorted(all_bags_data, key=lambda item: item['mesh'].volume, reverse=True)
 
-    # CLOUD SAFEGUARD: Iteration limit per bag
-    max_checks = MAX_CANDIDATES_CLOUD if IS_CLOUD else float('inf')
-
     total_bags = len(sorted_bags)
+    states = {}  # rotation extents -> _SearchState
     for i, bag_data in enumerate(sorted_bags):
         if progress_callback:
             progress_callback(i / total_bags, f"Placing bag {i+1}/{total_bags} ({bag_data['btype']})...")
             
         bag_base = bag_data['mesh']
         best_placement_for_bag = None
-        best_score = (float('inf'), float('inf'), float('inf'))
-        
-        checks = 0
-        stop_bag_search = False
+        best_corner = None  # (z, y, x) of the best placement so far
 
         for bag_rotation in unique_rotations(bag_base):
-            if stop_bag_search: break
             extents = bag_rotation.extents
             if np.any(extents > (trunk_bounds[1] - trunk_bounds[0])):
                 continue
-            TOLERANCE = 0.005
-            x_range = np.arange(minx + TOLERANCE, min(maxx - extents[0] - TOLERANCE, maxx - 0.01), step)
-            y_range = np.arange(miny + TOLERANCE, min(maxy - extents[1] - TOLERANCE, maxy - 0.01), step)
-            z_range = np.arange(minz + TOLERANCE, min(maxz - extents[2] - TOLERANCE, maxz - 0.01), step)
-            for z in z_range:
-                if z > best_score[0]: break
-                if stop_bag_search: break
-                for y in y_range:
-                    if stop_bag_search: break
-                    for x in x_range:
-                        checks += 1
-                        # CLOUD SAFEGUARD: Relaxed limit for HF Spaces
-                        # if checks > max_checks:
-                        #     stop_bag_search = True
-                        #     break
-
-                        trial = bag_rotation.copy()
-                        trial.apply_translation([x - trial.bounds[0][0], y - trial.bounds[0][1], z - trial.bounds[0][2]])
-                        if enhanced_containment_check(trunk, trial) and not collision_manager.in_collision_single(trial):
-                            current_score = (trial.bounds[0][2], trial.bounds[0][1], trial.bounds[0][0])
-                            if current_score < best_score:
-                                best_score = current_score
-                                best_placement_for_bag = trial
+            state = states.setdefault(tuple(np.round(extents, 6)), _SearchState())
+            if state.exhausted() or (best_corner is not None and state.frontier is not None
+                                     and state.frontier >= tuple(best_corner)):
+                continue
+            axes = placement_lattice(trunk, extents, step)
+
+            def collides(p, rot=bag_rotation):
+                return world.collides(_box_at(rot, (p[2], p[1], p[0])).bounds)
+
+            def fits(p, rot=bag_rotation, state=state):
+                return not collides(p) and state.contains(
+                    p, lambda: enhanced_containment_check(trunk, _box_at(rot, (p[2], p[1], p[0]))))
+
+            fmap = get_feasibility_map(trunk, extents, step)
+            if fmap is not None:
+                corner = first_free_position(fmap, axes, extents, world.all_bounds(), bound=best_corner,
+                                             verify=lambda p: not collides(p), start=state.frontier)
+            else:
+                # Custom boxes: containment checked on the fly
+                corner, _ = ordered_search(list(axes), fits, bound=best_corner, start=state.frontier)
+            state.advance(corner, best_corner)
+            if corner is not None:
+                best_corner = corner
+                best_placement_for_bag = _box_at(bag_rotation, (corner[2], corner[1], corner[0]))
         
         if best_placement_for_bag is not None:
             clamped_bag = clamp_bag_within_trunk(best_placement_for_bag, trunk_bounds)
@@ -263,7 +915,7 @@ def fittest_placement(trunk, bags_info, progress_callback=None):
                 'bag_mesh': clamped_bag, 'btype': bag_data['btype'],
                 'size': bag_data['size'], 'original_idx': bag_data['original_idx']
             })
-            collision_manager.add_object(f"bag_{bag_data['original_idx']}", clamped_bag)
+            world.add(bag_data['original_idx'], clamped_bag.bounds)
         else:
             dims = bag_base.extents * 100
             unplaced_info.append({
@@ -273,72 +925,76 @@ def fittest_placement(trunk, bags_info, progress_callback=None):
             })
     return {"placed_bags_info": placed_info, "unplaced_bags_info": unplaced_info, "processing_time": 0.0}
 
-def fast_apply_gravity(trunk, placed_bags_info, step_size=0.02):
+def fast_apply_gravity(trunk, placed_bags_info, step_size=0.02, world=None):
     if not placed_bags_info: return placed_bags_info
+    if world is None:
+        world = CollisionWorld.from_bags(placed_bags_info)
     settled_bags_info = []
-    collision_manager = CollisionManager()
+    # Lowest first: a falling bag can only meet bags that have already settled
     sorted_bags_info = sorted(placed_bags_info, key=lambda b: b['bag_mesh'].bounds[0][2])
     for info in sorted_bags_info:
         bag = info['bag_mesh'].copy()
         while True:
             bag.apply_translation([0, 0, -step_size])
-            if not enhanced_containment_check(trunk, bag) or collision_manager.in_collision_single(bag):
+            if not enhanced_containment_check(trunk, bag) or world.collides(bag.bounds, exclude=info['original_idx']):
                 bag.apply_translation([0, 0, step_size])
                 break
         clamped_bag = clamp_bag_within_trunk(bag, trunk.bounds)
         info['bag_mesh'] = clamped_bag
         settled_bags_info.append(info)
-        collision_manager.add_object(f"bag_{info['original_idx']}", clamped_bag)
+        world.move(info['original_idx'], clamped_bag.bounds)
     return settled_bags_info
 
-def compact_bags(trunk, placed_bags_info, step_size=0.005, passes=5):
+def compact_bags(trunk, placed_bags_info, step_size=0.005, passes=5, movable=None, world=None):
+    """Slide bags towards the trunk origin; `movable` restricts this to a set of original_idx."""
     if not placed_bags_info: return placed_bags_info
+    if world is None:
+        world = CollisionWorld.from_bags(placed_bags_info)
     for _ in range(passes):
         moved_any = False
         sorted_infos = sorted(placed_bags_info, key=lambda b: float(np.linalg.norm(b['bag_mesh'].bounds[0])))
         for info in sorted_infos:
-            others = CollisionManager()
-            for other in placed_bags_info:
-                if other['original_idx'] != info['original_idx']:
-                    others.add_object(f"bag_{other['original_idx']}", other['bag_mesh'])
+            if movable is not None and info['original_idx'] not in movable: continue
+            idx = info['original_idx']
             bag = info['bag_mesh'].copy()
             directions = [[0, -1, 0], [-1, 0, 0], [-1, -1, 0], [0, 0, -1], [-1, 0, -1], [0, -1, -1], [-1, -1, -1]]
             for direction in directions:
                 dir_vec = np.array(direction, dtype=float)
                 while True:
                     bag.apply_translation(dir_vec * step_size)
-                    if not enhanced_containment_check(trunk, bag) or others.in_collision_single(bag):
+                    if not enhanced_containment_check(trunk, bag) or world.collides(bag.bounds, exclude=idx):
                         bag.apply_translation(-dir_vec * step_size)
                         break
                     moved_any = True
             info['bag_mesh'] = clamp_bag_within_trunk(bag, trunk.bounds)
+            world.move(idx, info['bag_mesh'].bounds)
         if not moved_any: break
     return placed_bags_info
 
-def micro_adjust_bags(trunk, placed_bags_info, step_size=0.001, passes=3):
+def micro_adjust_bags(trunk, placed_bags_info, step_size=0.001, passes=3, world=None):
     if not placed_bags_info: return placed_bags_info
+    if world is None:
+        world = CollisionWorld.from_bags(placed_bags_info)
     for _ in range(passes):
         moved_any = False
         sorted_infos = sorted(placed_bags_info, key=lambda b: float(np.linalg.norm(b['bag_mesh'].bounds[0])))
         for info in sorted_infos:
-            others = CollisionManager()
-            for other in placed_bags_info:
-                if other['original_idx'] != info['original_idx']:
-                    others.add_object(f"bag_{other['original_idx']}", other['bag_mesh'])
+            idx = info['original_idx']
             bag = info['bag_mesh'].copy()
             directions = [[0, -1, 0], [-1, 0, 0], [0, 0, -1], [-1, -1, 0], [-1, 0, -1], [0, -1, -1], [-1, -1, -1]]
             for direction in directions:
                 dir_vec = np.array(direction, dtype=float)
                 bag.apply_translation(dir_vec * step_size)
-                if enhanced_containment_check(trunk, bag) and not others.in_collision_single(bag):
+                if enhanced_containment_check(trunk, bag) and not world.collides(bag.bounds, exclude=idx):
                     moved_any = True
                 else:
                     bag.apply_translation(-dir_vec * step_size)
             info['bag_mesh'] = clamp_bag_within_trunk(bag, trunk.bounds)
+            world.move(idx, info['bag_mesh'].bounds)
         if not moved_any: break
     return placed_bags_info
 
-def fill_remaining_gaps(trunk, placed_bags_info, bags_info, step_size=0.02):
+def fill_remaining_gaps(trunk, placed_bags_info, bags_info, step_size=0.02, search=None, world=None):
     if not placed_bags_info or not bags_info: return placed_bags_info
     placed_indices = {info['original_idx'] for info in placed_bags_info}
     unplaced_bags = []
@@ -354,9 +1010,8 @@ def fill_remaining_gaps(trunk, placed_bags_info, bags_info, step_size=0.02):
             unplaced_bags.append({'original_idx': i, 'btype': 'Custom', 'size': f'{length:.0f}×{breadth:.0f}×{thickness:.0f}cm', 'mesh': mesh})
     if not unplaced_bags: return placed_bags_info
     unplaced_bags.sort(key=lambda b: b['mesh'].volume, reverse=True)
-    collision_manager = CollisionManager()
-    for info in placed_bags_info:
-        collision_manager.add_object(f"bag_{info['original_idx']}", info['bag_mesh'])
+    if world is None:
+        world = CollisionWorld.from_bags(placed_bags_info)
     trunk_bounds = get_usable_trunk_bounds(trunk)
     minx, miny, minz = trunk_bounds[0]
     maxx, maxy, maxz = trunk_bounds[1]
@@ -365,45 +1020,50 @@ def fill_remaining_gaps(trunk, placed_bags_info, bags_info, step_size=0.02):
     actual_step = GRID_STEP_CLOUD if IS_CLOUD else step_size
     max_cands = MAX_CANDIDATES_CLOUD if IS_CLOUD else 400
     
-    coarse, fine, MAX_CANDIDATES = max(0.10, actual_step * 5.0), max(0.03, actual_step), max_cands
+    fine, MAX_CANDIDATES = max(0.03, actual_step), max_cands
+    if search:
+        fine, MAX_CANDIDATES = search['step'], search['max_candidates']
+    z = minz + TOL
+    states = {}  # rotation extents -> _SearchState over (y, x) floor positions
     for bag_data in unplaced_bags:
         bag_base = bag_data['mesh']
-        best_placement_for_bag, best_score, candidates_checked = None, (float('inf'), float('inf')), 0
+        best_placement_for_bag, best_corner, candidates_checked = None, None, 0
         for bag_rotation in unique_rotations(bag_base):
             extents = bag_rotation.extents
             if np.any(extents > (trunk_bounds[1] - trunk_bounds[0])): continue
-            x_range = np.arange(minx + TOL, min(maxx - extents[0] - TOL, maxx - 0.01), coarse)
-            y_range = np.arange(miny + TOL, min(maxy - extents[1] - TOL, maxy - 0.01), coarse)
-            z = minz + TOL
-            top_hits = []
-            for y in y_range:
-                for x in x_range:
-                    trial = bag_rotation.copy()
-                    trial.apply_translation([x - trial.bounds[0][0], y - trial.bounds[0][1], z - trial.bounds[0][2]])
-                    if strict_containment_or_voxel(trunk, trial) and not collision_manager.in_collision_single(trial):
-                        score = (trial.bounds[0][1], trial.bounds[0][0])
-                        top_hits.append((score, trial))
-                        if len(top_hits) > 12:
-                            top_hits.sort(key=lambda t: t[0])
-                            top_hits = top_hits[:12]
-            for _, coarse_trial in top_hits:
-                cx0, cy0, _ = coarse_trial.bounds[0]
-                x_center, y_center = cx0, cy0
-                x_fine = np.arange(max(minx + TOL, x_center - coarse), min(maxx - extents[0] - TOL, x_center + coarse), fine)
-                y_fine = np.arange(max(miny + TOL, y_center - coarse), min(maxy - extents[1] - TOL, y_center + coarse), fine)
-                for y in y_fine:
-                    for x in x_fine:
-                        trial = bag_rotation.copy()
-                        trial.apply_translation([x - trial.bounds[0][0], y - trial.bounds[0][1], z - trial.bounds[0][2]])
-                        candidates_checked += 1
-                        if strict_containment_or_voxel(trunk, trial) and not collision_manager.in_collision_single(trial):
-                            score = (trial.bounds[0][1], trial.bounds[0][0])
-                            if score < best_score:
-                                best_score = score
-                                best_placement_for_bag = trial
-                        if candidates_checked >= MAX_CANDIDATES: break
-                    if candidates_checked >= MAX_CANDIDATES: break
-                if candidates_checked >= MAX_CANDIDATES: break
+            state = states.setdefault(tuple(np.round(extents, 6)), _SearchState())
+            if state.exhausted() or (best_corner is not None and state.frontier is not None
+                                     and state.frontier >= tuple(best_corner)):
+                continue
+            x_range = np.arange(minx + TOL, min(maxx - extents[0] - TOL, maxx - 0.01), fine)
+            y_range = np.arange(miny + TOL, min(maxy - extents[1] - TOL, maxy - 0.01), fine)
+
+            def collides(p, rot=bag_rotation):
+                return world.collides(_box_at(rot, (p[1], p[0], z)).bounds)
+
+            def fits(p, rot=bag_rotation, state=state):
+                return not collides(p) and state.contains(
+                    p, lambda: strict_containment_or_voxel(trunk, _box_at(rot, (p[1], p[0], z))))
+
+            fmap = get_feasibility_map(trunk, extents, fine)
+            if fmap is not None and len(fmap):
+                # Floor layer of the precomputed map (z == minz + TOL is its first row)
+                point = first_free_position(fmap[:1], (np.array([z]), y_range, x_range), extents, world.all_bounds(),
+                                            bound=None if best_corner is None else (z,) + tuple(best_corner),
+                                            verify=lambda p: not collides(p[1:]),
+                                            start=None if state.frontier is None else (z,) + state.frontier)
+                corner = None if point is None else point[1:]
+                state.advance(corner, best_corner)
+            else:
+                budget = MAX_CANDIDATES - candidates_checked
+                corner, evals = ordered_search([y_range, x_range], fits, bound=best_corner,
+                                               max_evals=budget, start=state.frontier)
+                candidates_checked += evals
+                if evals < budget:  # the search ran to completion, so its frontier holds
+                    state.advance(corner, best_corner)
+            if corner is not None:
+                best_corner = corner
+                best_placement_for_bag = _box_at(bag_rotation, (corner[1], corner[0], z))
             if candidates_checked >= MAX_CANDIDATES: break
         if best_placement_for_bag is not None:
             clamped_bag = clamp_bag_within_trunk(best_placement_for_bag, trunk_bounds)
@@ -411,52 +1071,366 @@ def fill_remaining_gaps(trunk, placed_bags_info, bags_info, step_size=0.02):
                 'bag_mesh': clamped_bag, 'btype': bag_data['btype'],
                 'size': bag_data['size'], 'original_idx': bag_data['original_idx']
             })
-            collision_manager.add_object(f"bag_{bag_data['original_idx']}", clamped_bag)
+            world.add(bag_data['original_idx'], clamped_bag.bounds)
     return placed_bags_info
 
-def optimized_packing(trunk, bags_info, progress_callback=None):
+def optimized_packing(trunk, bags_info, progress_callback=None, search=None):
     logger.info("Starting optimized_packing...")
     start_time = time.time()
+    if search is None:
+        search = plan_search(trunk, bags_info)
+    logger.info(f"Search plan: step {search['step'] * 100:.1f} cm, predicted {search['predicted_seconds']:.2f}s")
     if progress_callback: progress_callback(0.0, "🔎 Finding initial placements (0/0)...")
+    # One collision world for every stage; bags move in it as they settle
+    world = CollisionWorld()
     logger.info("Calling fittest_placement...")
-    results = fittest_placement(trunk, bags_info, progress_callback)
+    results = fittest_placement(trunk, bags_info, progress_callback, search, world=world)
     logger.info("fittest_placement finished.")
     placed_bags_info = results["placed_bags_info"]
     if not placed_bags_info:
-        results_dict = {"placed_bags_info": [], "unplaced_bags_info": results["unplaced_bags_info"], "processing_time": float(time.time() - start_time)}
+        processing_time = float(time.time() - start_time)
+        results_dict = {"placed_bags_info": [], "unplaced_bags_info": results["unplaced_bags_info"], "processing_time": processing_time,
+                        "search": dict(search, actual_seconds=processing_time)}
         return results_dict
     
     if progress_callback: progress_callback(0.33, "🔄 Applying gravity...")
-    settled_bags_info = fast_apply_gravity(trunk, placed_bags_info)
+    settled_bags_info = fast_apply_gravity(trunk, placed_bags_info, world=world)
     
     if progress_callback: progress_callback(0.55, "📦 Compacting bags...")
-    compacted_bags_info = compact_bags(trunk, settled_bags_info)
+    compacted_bags_info = compact_bags(trunk, settled_bags_info, world=world)
     
     if progress_callback: progress_callback(0.75, "🔍 Filling gaps...")
-    gap_filled_bags_info = fill_remaining_gaps(trunk, compacted_bags_info, bags_info)
+    gap_filled_bags_info = fill_remaining_gaps(trunk, compacted_bags_info, bags_info, search=search, world=world)
     
     if progress_callback: progress_callback(0.90, "🔧 Micro-adjustments...")
-    micro_adjusted_bags_info = micro_adjust_bags(trunk, gap_filled_bags_info)
+    micro_adjusted_bags_info = micro_adjust_bags(trunk, gap_filled_bags_info, world=world)
     
     if progress_callback: progress_callback(0.98, "🔄 Final gravity settling...")
-    final_bags_info = fast_apply_gravity(trunk, micro_adjusted_bags_info)
+    final_bags_info = fast_apply_gravity(trunk, micro_adjusted_bags_info, world=world)
     
-    results_dict = {"placed_bags_info": final_bags_info, "unplaced_bags_info": results["unplaced_bags_info"], "processing_time": float(time.time() - start_time)}
+    processing_time = float(time.time() - start_time)
+    results_dict = {"placed_bags_info": final_bags_info, "unplaced_bags_info": results["unplaced_bags_info"], "processing_time": processing_time,
+                    "search": dict(search, actual_seconds=processing_time)}
     
     if progress_callback: progress_callback(1.0, "✅ Packing completed!")
     return results_dict
 
-def calculate_space_utilization(trunk, placed_bags_info):
-    # Calculate Trunk Volume
-    trunk_volume = 0
-    if trunk.is_watertight and trunk.volume > 0:
-        trunk_volume = trunk.volume
+# --------------------------------------------------------------------------
+# CAPACITY (HOMOGENEOUS PACKING)
+# --------------------------------------------------------------------------
+# "How many of bag X fit?" Copies of one box go greedily to the
+# lexicographically first free (z, y, x) lattice point, as in
+# fittest_placement. Because every item is the same box, the feasibility map
+# of each rotation is fetched once and turned into a free mask; a new box
+# clears one slab per axis in every mask instead of being re-tested against
+# all placed boxes, and since masks only lose points each scan resumes where
+# the previous one stopped. Mixed orientations and each single orientation
+# are tried, and the layout holding the most boxes wins.
+CAPACITY_MAX_COUNT = 200
+
+def _fill_homogeneous(axes_list, masks, extents_list, max_count):
+    """Greedy fill of free masks (one per rotation); returns [(rotation index, (x, y, z) min corner)]."""
+    masks = [np.array(mask, dtype=bool, copy=True) for mask in masks]
+    cursors = [0] * len(masks)
+    placed = []
+    while len(placed) < max_count:
+        best = None
+        for r, mask in enumerate(masks):
+            flat = mask.reshape(-1)
+            if cursors[r] >= flat.size:
+                continue
+            i = cursors[r] + int(np.argmax(flat[cursors[r]:]))
+            if not flat[i]:
+                cursors[r] = flat.size
+                continue
+            cursors[r] = i
+            iz, iy, ix = np.unravel_index(i, mask.shape)
+            point = (float(axes_list[r][0][iz]), float(axes_list[r][1][iy]), float(axes_list[r][2][ix]))
+            if best is None or point < best[0]:
+                best = (point, r)
+        if best is None:
+            break
+        point, r = best
+        lo = np.array(point[::-1])
+        hi = lo + extents_list[r]
+        placed.append((r, tuple(lo)))
+        # Same strict AABB overlap test as _blocked_positions, one axis at a time
+        for mask, axes, extents in zip(masks, axes_list, extents_list):
+            slab = []
+            for axis, e, l, h in zip(axes, extents[::-1], lo[::-1], hi[::-1]):
+                hits = np.flatnonzero((axis < h) & (axis + e > l))
+                if not len(hits):
+                    break
+                slab.append(slice(hits[0], hits[-1] + 1))
+            else:
+                mask[tuple(slab)] = False
+    return placed
+
+def homogeneous_packing(trunk, bag_info, max_count=CAPACITY_MAX_COUNT, progress_callback=None, search=None):
+    """Pack as many copies of one bag (catalogue or custom) as fit; result dict as optimized_packing.
+
+    The extra "capacity" entry holds the count, the orientation policy that
+    reached it, a volume bound (trunk volume // bag volume) and whether
+    `max_count` cut the search short.
+    """
+    start_time = time.time()
+    if search is None:
+        search = plan_search(trunk, [bag_info])
+    step = search['step']
+    if len(bag_info) == 2:
+        btype, size = bag_info
+        mesh = create_bag(btype, size)
     else:
-        # Fallback: Convex Hull is usually a better approximation of the "void" than AABB
-        try:
-            trunk_volume = trunk.convex_hull.volume
-        except Exception:
-            trunk_volume = trunk.extents.prod()
+        btype, size = 'Custom', f'{bag_info[1]:.0f}×{bag_info[2]:.0f}×{bag_info[3]:.0f}cm'
+        mesh = create_custom_bag(*bag_info[1:])
+    trunk_bounds = get_usable_trunk_bounds(trunk)
+    rotations, axes_list, masks = [], [], []
+    for rotation in unique_rotations(mesh):
+        extents = rotation.extents
+        if np.any(extents > (trunk_bounds[1] - trunk_bounds[0])):
+            continue
+        fmap = get_feasibility_map(trunk, extents, step)
+        if fmap is None:
+            fmap = compute_feasibility_map(trunk, extents, step)
+        rotations.append(rotation)
+        axes_list.append(placement_lattice(trunk, extents, step))
+        masks.append(fmap)
+
+    policies = [("mixed", list(range(len(rotations))))]
+    if len(rotations) > 1:
+        policies += [("fixed " + "x".join(f"{e * 100:.0f}" for e in rotations[r].extents), [r]) for r in range(len(rotations))]
+    best_policy, best_layout = "mixed", []
+    for n, (policy, chosen) in enumerate(policies):
+        if progress_callback:
+            progress_callback(n / len(policies), f"Trying {policy} orientation...")
+        layout = _fill_homogeneous([axes_list[r] for r in chosen], [masks[r] for r in chosen],
+                                   [rotations[r].extents for r in chosen], max_count)
+        if len(layout) > len(best_layout):
+            best_policy, best_layout = policy, [(chosen[r], corner) for r, corner in layout]
+
+    placed_bags_info = [{'bag_mesh': _box_at(rotations[r], corner), 'btype': btype, 'size': size, 'original_idx': k}
+                        for k, (r, corner) in enumerate(best_layout)]
+    trunk_volume = trunk_artifacts(trunk).get('volume')
+    if trunk_volume is None:
+        trunk_volume = measure_trunk_volume(trunk)
+    if progress_callback: progress_callback(1.0, "✅ Packing completed!")
+    processing_time = float(time.time() - start_time)
+    return {"placed_bags_info": placed_bags_info, "unplaced_bags_info": [], "processing_time": processing_time,
+            "search": dict(search, actual_seconds=processing_time),
+            "capacity": {"count": len(placed_bags_info), "orientation": best_policy,
+                         "volume_bound": int(trunk_volume // mesh.volume), "truncated": len(placed_bags_info) >= max_count}}
+
+# --------------------------------------------------------------------------
+# INCREMENTAL RE-OPTIMIZATION
+# --------------------------------------------------------------------------
+# When a loadout changes by a few bags, the surviving placements are kept as
+# they are: departed bags drop out of the collision state and the bags that
+# stood in or above them settle, new (and still unplaced) bags go through
+# fittest_placement, and only the bags around them are compacted again.
+
+AFFECTED_MARGIN = 0.10
+
+def _in_affected_region(bounds, regions, margin=AFFECTED_MARGIN):
+    # A region covers its footprint (plus margin) from its base upwards, so
+    # bags resting on a removed bag are re-settled as well
+    for region in regions:
+        if (np.all(bounds[1][:2] >= region[0][:2] - margin) and np.all(bounds[0][:2] <= region[1][:2] + margin)
+                and bounds[1][2] >= region[0][2] - margin):
+            return True
+    return False
+
+def unplaced_bags_report(bags_info, placed_indices):
+    """unplaced_bags_info entries for every bag of `bags_info` whose index is not in `placed_indices`."""
+    unplaced_info = []
+    for i, bag_info in enumerate(bags_info):
+        if i in placed_indices: continue
+        if bag_info[0] == MESH_BAG:
+            label, mesh = f"{MESH_BAG} ({bag_info[1]})", create_mesh_bag(bag_info[2])
+        elif len(bag_info) == 2:
+            label, mesh = f"{bag_info[0]} ({bag_info[1]})", create_bag(*bag_info)
+        else:
+            _, length, breadth, thickness = bag_info
+            label, mesh = f"Custom ({length:.0f}×{breadth:.0f}×{thickness:.0f}cm)", create_custom_bag(length, breadth, thickness)
+        dims = mesh.extents * 100
+        unplaced_info.append({
+            "Bag": label,
+            "Dimensions (cm)": f"{dims[0]:.1f}x{dims[1]:.1f}x{dims[2]:.1f}",
+            "Reason": "No suitable position found"
+        })
+    return unplaced_info
+
+def pack_around(trunk, placed_bags_info, bags_info, regions, world, progress_callback=None):
+    """Place the bags of `bags_info` missing from `placed_bags_info` around the kept placements.
+
+    `regions` are the bounds of placements that went away. Bags in or above
+    them are settled first, so the new bags see the load as it will stand;
+    the new bags then go through fittest_placement (every layer, not only
+    the floor), the bags around them are compacted and fill_remaining_gaps
+    gets whatever is still out. Returns (placed_bags_info, search plan).
+    """
+    movable = {info['original_idx'] for info in placed_bags_info if _in_affected_region(info['bag_mesh'].bounds, regions)}
+    if movable:
+        if progress_callback: progress_callback(0.0, f"📦 Settling {len(movable)} bag(s) near the change...")
+        placed_bags_info = compact_bags(trunk, placed_bags_info, movable=movable, world=world)
+    kept = {info['original_idx'] for info in placed_bags_info}
+    pending = {i for i in range(len(bags_info)) if i not in kept}
+    search = plan_search(trunk, [bags_info[i] for i in sorted(pending)])
+    if not pending:
+        return placed_bags_info, search
+    if progress_callback: progress_callback(0.3, f"🔍 Placing {len(pending)} new bag(s)...")
+    results = fittest_placement(trunk, bags_info, None, search, world=world, pending=pending)
+    placed_bags_info = placed_bags_info + results["placed_bags_info"]
+    added = [info['bag_mesh'].bounds.copy() for info in results["placed_bags_info"]]
+    movable = {info['original_idx'] for info in placed_bags_info if _in_affected_region(info['bag_mesh'].bounds, added)}
+    if movable:
+        if progress_callback: progress_callback(0.6, f"📦 Compacting {len(movable)} bag(s) near the change...")
+        placed_bags_info = compact_bags(trunk, placed_bags_info, movable=movable, world=world)
+    if len(placed_bags_info) < len(bags_info):
+        if progress_callback: progress_callback(0.8, "🔍 Filling gaps...")
+        placed_bags_info = fill_remaining_gaps(trunk, placed_bags_info, bags_info, search=search, world=world)
+    return placed_bags_info, search
+
+def incremental_packing(trunk, previous_placed, bags_info, index_map, progress_callback=None):
+    """Re-pack after a bag diff, keeping every surviving placement in place.
+
+    `index_map` maps the original_idx of each kept bag in the previous result
+    to its index in `bags_info`; previous placements missing from it are the
+    removed bags. Bags that find no room are listed in unplaced_bags_info;
+    a full re-optimization only happens when the client asks for one.
+    """
+    logger.info("Starting incremental_packing...")
+    start_time = time.time()
+    placed_bags_info, regions = [], []
+    for info in previous_placed:
+        if info['original_idx'] in index_map:
+            placed_bags_info.append(dict(info, bag_mesh=info['bag_mesh'].copy(), original_idx=index_map[info['original_idx']]))
+        else:
+            regions.append(info['bag_mesh'].bounds.copy())
+
+    world = CollisionWorld.from_bags(placed_bags_info)
+    placed_bags_info, search = pack_around(trunk, placed_bags_info, bags_info, regions, world, progress_callback)
+    unplaced_info = unplaced_bags_report(bags_info, {info['original_idx'] for info in placed_bags_info})
+    if progress_callback: progress_callback(1.0, "✅ Packing completed!")
+    processing_time = float(time.time() - start_time)
+    return {"placed_bags_info": placed_bags_info, "unplaced_bags_info": unplaced_info, "processing_time": processing_time,
+            "search": dict(search, actual_seconds=processing_time)}
+
+# --------------------------------------------------------------------------
+# WARM START
+# --------------------------------------------------------------------------
+# A loadout close to an earlier one on the same trunk starts from that
+# layout. Its placements ("seeds", relabelled to the new bag list) are
+# verified again, then only the bags without a seed are placed, as in
+# incremental_packing (see pack_around). Callers pick the seeds, see
+# service.find_seed_layout.
+
+def seeded_packing(trunk, bags_info, seeds, vacated=(), progress_callback=None):
+    """Pack `bags_info` around the still-feasible `seeds`; None when no seed survives.
+
+    `seeds` are placement infos whose original_idx already indexes `bags_info`;
+    `vacated` are the bounds of stored placements left without a bag. Seeds
+    that leave the trunk or overlap an earlier seed are dropped and their
+    bags searched for like the others.
+    """
+    logger.info("Starting seeded_packing...")
+    start_time = time.time()
+    world = CollisionWorld()
+    placed_bags_info, regions = [], [np.asarray(bounds) for bounds in vacated]
+    for info in seeds:
+        mesh = info['bag_mesh']
+        if world.collides(mesh.bounds) or not enhanced_containment_check(trunk, mesh):
+            regions.append(mesh.bounds.copy())
+            continue
+        placed_bags_info.append(dict(info, bag_mesh=mesh.copy()))
+        world.add(info['original_idx'], mesh.bounds)
+    if not placed_bags_info:
+        return None
+
+    seeded = len(placed_bags_info)
+    placed_bags_info, search = pack_around(trunk, placed_bags_info, bags_info, regions, world, progress_callback)
+    unplaced_info = unplaced_bags_report(bags_info, {info['original_idx'] for info in placed_bags_info})
+    if progress_callback: progress_callback(1.0, "✅ Packing completed!")
+    processing_time = float(time.time() - start_time)
+    logger.info(f"seeded_packing: {seeded} seed(s) kept, {len(bags_info) - seeded} bag(s) searched in {processing_time:.2f}s")
+    return {"placed_bags_info": placed_bags_info, "unplaced_bags_info": unplaced_info, "processing_time": processing_time,
+            "search": dict(search, actual_seconds=processing_time), "seeded": seeded}
+
+def mesh_to_stl_base64(mesh):
+    stl_io = BytesIO()
+    mesh.export(stl_io, file_type='stl')
+    return base64.b64encode(stl_io.getvalue()).decode('utf-8')
+
+# Wire formats for the trunk mesh in responses; "stl" is base64 binary STL
+MESH_FORMATS = ("stl", QMESH_FORMAT)
+
+_trunk_mesh_payloads = OrderedDict()
+def trunk_mesh_payload(trunk, mesh_format="stl"):
+    """The trunk's display mesh encoded for the client, cached per trunk hash and format."""
+    key = (trunk.metadata.get('trunk_key', id(trunk)), mesh_format)
+    with _trunk_locks_guard:
+        payload = _trunk_mesh_payloads.get(key)
+        if payload is not None:
+            _trunk_mesh_payloads.move_to_end(key)
+    if payload is None:
+        display = trunk_lod(trunk, 'display')
+        payload = encode_mesh(display) if mesh_format == QMESH_FORMAT else mesh_to_stl_base64(display)
+        with _trunk_locks_guard:
+            _trunk_mesh_payloads[key] = payload
+            while len(_trunk_mesh_payloads) > TRUNK_CACHE_LIMIT * len(MESH_FORMATS):
+                _trunk_mesh_payloads.popitem(last=False)
+    return payload
+
+def serialize_placed_bags(placed_bags_info):
+    placed_items = []
+    for info in placed_bags_info:
+        placed_items.append({
+            "id": info.get("original_idx"),
+            "type": info["btype"],
+            "size": info["size"],
+            "mesh_stl": mesh_to_stl_base64(info["bag_mesh"]), # Frontend will load this
+            "color": "#ff0000" # Frontend should assign colors
+        })
+    return placed_items
+
+def serialize_packing_results(trunk, results, mesh_format="stl"):
+    """Turn engine output into the JSON payload sent to the app (bag meshes as base64 STL).
+
+    The trunk goes in `trunk_mesh` as base64 STL, or in `trunk_mesh_compact`
+    when the client asked for the qmesh1 encoding (see core.mesh_codec).
+    """
+    placed_items = serialize_placed_bags(results["placed_bags_info"])
+    stats = calculate_space_utilization(trunk, results["placed_bags_info"])
+    packed_stl = None
+    if results["placed_bags_info"]:
+        packed_stl = mesh_to_stl_base64(export_scene_to_stl(trunk_lod(trunk, 'export'), results["placed_bags_info"]))
+    return {
+        "success": True,
+        "placed_bags": placed_items,
+        "unplaced_bags": results["unplaced_bags_info"],
+        "stats": {k: float(v) for k, v in stats.items()},
+        "trunk_mesh": trunk_mesh_payload(trunk) if mesh_format == "stl" else None,
+        "trunk_mesh_compact": trunk_mesh_payload(trunk, mesh_format) if mesh_format == QMESH_FORMAT else None,
+        "trunk_mesh_format": mesh_format,
+        "packed_stl": packed_stl,
+        "processing_time": results.get("processing_time", 0.0),
+        "search": results.get("search"),
+        "free_space": free_space_analysis(trunk, results["placed_bags_info"])
+    }
+
+def measure_trunk_volume(trunk):
+    if trunk.is_watertight and trunk.volume > 0:
+        return float(trunk.volume)
+    # Fallback: Convex Hull is usually a better approximation of the "void" than AABB
+    try:
+        return float(trunk.convex_hull.volume)
+    except Exception:
+        return float(trunk.extents.prod())
+
+def calculate_space_utilization(trunk, placed_bags_info):
+    # Calculate Trunk Volume (measured once at load time for cached trunks)
+    trunk_volume = trunk_artifacts(trunk).get('volume')
+    if trunk_volume is None:
+        trunk_volume = measure_trunk_volume(trunk)
 
     placed_volume = sum(info['bag_mesh'].volume for info in placed_bags_info)
     if not placed_bags_info:
@@ -475,3 +1449,131 @@ def calculate_space_utilization(trunk, placed_bags_info):
         'space_utilization_bbox': np.clip(space_utilization_bbox, 0, 100),
         'packing_efficiency_bbox': np.clip(packing_efficiency_bbox, 0, 100),
     }
+
+# --------------------------------------------------------------------------
+# FREE SPACE ANALYSIS
+# --------------------------------------------------------------------------
+# "What else fits?" after a run. The trunk interior is rasterized into cubes
+# of FREE_SPACE_PITCH: a cell is interior when a cube of that size is feasible
+# there, which is the feasibility map of that cube at step = pitch (built
+# once per trunk like any other lazy map). Cells overlapping a placed bag are
+# removed, and the largest empty axis-aligned boxes are peeled off greedily.
+FREE_SPACE_PITCH = 0.02
+FREE_SPACE_BOXES = 5
+FREE_SPACE_MIN_SIDE = 0.06  # ignore slivers no bag could use (smallest catalogue side is 9 cm)
+
+def interior_grid(trunk, pitch=FREE_SPACE_PITCH):
+    """((z, y, x) cell axes, boolean interior grid) of the trunk at `pitch`."""
+    cell = (pitch, pitch, pitch)
+    fmap = get_feasibility_map(trunk, cell, pitch)
+    if fmap is None:
+        fmap = compute_feasibility_map(trunk, cell, pitch)
+    return placement_lattice(trunk, cell, pitch), fmap
+
+def _layer_bound(free, z0):
+    """Upper bound on the cells of any all-True box whose bottom layer is z0."""
+    counts = np.logical_and.accumulate(free[z0:], axis=0).sum(axis=(1, 2))
+    return int((counts * np.arange(1, len(counts) + 1)).max())
+
+def _largest_box_on_layer(free, z0, min_cells=1, floor=0):
+    """(cells, (z0, y0, x0), (depth, height, width)) of the largest all-True box with bottom layer z0.
+
+    The layers above z0 are AND-ed into running footprints; runs along y give
+    histogram heights, and widening the rectangle one column at a time
+    (running min of the heights) covers every rectangle of every footprint
+    at once. Returns None unless the box beats `floor` cells.
+    """
+    stack = np.logical_and.accumulate(free[z0:], axis=0)[min_cells - 1:]
+    if not len(stack):
+        return None
+    filled = np.cumsum(stack, axis=1, dtype=np.int32)
+    heights = filled - np.maximum.accumulate(np.where(stack, 0, filled), axis=1)
+    heights[heights < min_cells] = 0  # a rectangle is min_cells tall only if all its columns are
+    depth = np.arange(min_cells, min_cells + len(stack), dtype=np.int32)[:, None, None]
+    nx = free.shape[2]
+    best, runs = None, heights
+    for w in range(nx):
+        if w:
+            runs = np.minimum(runs[..., :-1], heights[..., w:])
+        cells = runs * depth
+        flat = int(cells.argmax())
+        top = int(cells.flat[flat])
+        if top * nx <= floor:
+            break  # runs only shrink as the rectangle widens
+        if w + 1 >= min_cells and top * (w + 1) > floor:
+            floor = top * (w + 1)
+            k, y, x0 = (int(i) for i in np.unravel_index(flat, cells.shape))
+            h = int(runs[k, y, x0])
+            best = (floor, (z0, y - h + 1, x0), (k + min_cells, h, w + 1))
+    return best
+
+def _boxes_overlap(a, b):
+    (ca, sa), (cb, sb) = a[1:], b[1:]
+    return all(ca[i] < cb[i] + sb[i] and cb[i] < ca[i] + sa[i] for i in range(3))
+
+def largest_empty_boxes(free, count, min_cells=1):
+    """Up to `count` disjoint all-True boxes of a (z, y, x) grid, peeled off largest first.
+
+    Boxes are (cells, corner, size) as in _largest_box_on_layer, every side
+    at least `min_cells`; their cells are cleared in `free`. Layers are
+    solved best-first from upper bounds, and a layer's solution is reused
+    until a peeled box overlaps it.
+    """
+    heap = [(-_layer_bound(free, z0), z0, False) for z0 in range(free.shape[0])]
+    heapq.heapify(heap)
+    solved, boxes = {}, []
+    while heap and len(boxes) < count:
+        bound, z0, exact = heapq.heappop(heap)
+        if bound == 0:
+            break
+        if not exact:
+            box = _largest_box_on_layer(free, z0, min_cells)
+            if box is not None:
+                solved[z0] = box
+                heapq.heappush(heap, (-box[0], z0, True))
+            continue
+        box = solved.pop(z0)
+        boxes.append(box)
+        (bz, by, bx), (d, h, w) = box[1], box[2]
+        free[bz:bz + d, by:by + h, bx:bx + w] = False
+        # Solutions overlapping the peeled box (and its own layer's) drop back to bounds
+        stale = {z for z, other in solved.items() if _boxes_overlap(other, box)}
+        for z in stale:
+            del solved[z]
+        heap = [(b, z, e and z not in stale) for b, z, e in heap] + [(bound, z0, False)]
+        heapq.heapify(heap)
+    return boxes
+
+def free_space_analysis(trunk, placed_bags_info, max_boxes=FREE_SPACE_BOXES, pitch=FREE_SPACE_PITCH):
+    """Remaining usable volume and the largest empty boxes left in the trunk.
+
+    Boxes are in trunk coordinates (metres): `position` is the min corner.
+    Volumes count whole interior cells, so they slightly undercount.
+    """
+    start_time = time.time()
+    cell = (pitch, pitch, pitch)
+    axes, interior = interior_grid(trunk, pitch)
+    obstacles = [info['bag_mesh'].bounds for info in placed_bags_info]
+    free = interior & ~_blocked_positions(axes, cell, obstacles)
+    cell_volume = pitch ** 3
+    interior_volume = float(interior.sum()) * cell_volume
+    remaining_volume = float(free.sum()) * cell_volume
+
+    boxes = []
+    min_cells = max(1, int(np.ceil(FREE_SPACE_MIN_SIDE / pitch - 1e-9)))
+    for cells, (z0, y0, x0), (d, h, w) in largest_empty_boxes(free, max_boxes, min_cells):
+        extents = np.array([w, h, d]) * pitch
+        boxes.append({
+            "position": [round(float(axes[2][x0]), 6), round(float(axes[1][y0]), 6), round(float(axes[0][z0]), 6)],
+            "extents": extents.round(6).tolist(),
+            "dimensions_cm": (extents * 100).round(1).tolist(),
+            "volume_m3": round(float(cells) * cell_volume, 6),
+        })
+    return {
+        "pitch": pitch,
+        "interior_volume_m3": round(interior_volume, 6),
+        "remaining_volume_m3": round(remaining_volume, 6),
+        "remaining_percent": round(100.0 * remaining_volume / interior_volume, 2) if interior_volume > 0 else 0.0,
+        "largest_boxes": boxes,
+        "processing_time": round(time.time() - start_time, 4),
+    }
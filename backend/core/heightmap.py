@@ -0,0 +1,158 @@
+import numpy as np
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from core.engine import (
+    create_bag,
+    create_custom_bag,
+    unique_rotations,
+    get_usable_trunk_bounds,
+    _box_at,
+)
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# HEIGHTMAP / SKYLINE ENGINE
+# --------------------------------------------------------------------------
+# The trunk is described by two 2D maps over a regular (x, y) cell grid: the
+# floor and ceiling of the interior column above each cell. Stacked bags are
+# tracked by a skyline heightfield, so a candidate placement costs a window
+# max/min over the cells it covers instead of mesh containment queries.
+
+HEIGHTMAP_PITCH = 0.02
+TOLERANCE = 0.005
+
+HEIGHTMAP_CACHE_LIMIT = 16
+
+# Keyed by trunk hash (set by get_trunk); trunks without one are not cached
+_trunk_heightmap_cache = OrderedDict()
+_trunk_heightmap_lock = threading.Lock()
+def get_trunk_heightmap(trunk, pitch=HEIGHTMAP_PITCH):
+    trunk_key = trunk.metadata.get('trunk_key')
+    if trunk_key is None:
+        return build_trunk_heightmap(trunk, pitch)
+    key = (trunk_key, float(pitch))
+    with _trunk_heightmap_lock:
+        hm = _trunk_heightmap_cache.get(key)
+        if hm is not None:
+            _trunk_heightmap_cache.move_to_end(key)
+            return hm
+    hm = build_trunk_heightmap(trunk, pitch)
+    with _trunk_heightmap_lock:
+        _trunk_heightmap_cache[key] = hm
+        while len(_trunk_heightmap_cache) > HEIGHTMAP_CACHE_LIMIT:
+            _trunk_heightmap_cache.popitem(last=False)
+    return hm
+
+def _window(grid, w, d, reduce):
+    view = np.lib.stride_tricks.sliding_window_view(grid, (w, d))
+    return reduce(view, axis=(2, 3))
+
+def build_trunk_heightmap(trunk, pitch=HEIGHTMAP_PITCH):
+    """Cast one vertical ray per cell corner and keep the lowest interior interval.
+
+    A cell's floor/ceiling is the highest floor/lowest ceiling of its four
+    corners, so a box resting on the skyline stays inside the trunk even where
+    the floor or roof slopes within the cell.
+    """
+    trunk_bounds = get_usable_trunk_bounds(trunk)
+    origin = trunk_bounds[0] + TOLERANCE
+    span = trunk_bounds[1] - TOLERANCE - origin
+    nx, ny = int(span[0] // pitch), int(span[1] // pitch)
+    if nx <= 0 or ny <= 0:
+        return {'origin': origin, 'pitch': pitch, 'floor': np.full((0, 0), np.inf), 'ceiling': np.full((0, 0), -np.inf)}
+
+    node_floor = np.full((nx + 1) * (ny + 1), np.inf)
+    node_ceiling = np.full((nx + 1) * (ny + 1), -np.inf)
+    X, Y = np.meshgrid(origin[0] + np.arange(nx + 1) * pitch, origin[1] + np.arange(ny + 1) * pitch, indexing='ij')
+    start_z = trunk.bounds[0][2] - 1.0
+    ray_origins = np.column_stack([X.ravel(), Y.ravel(), np.full(X.size, start_z)])
+    ray_dirs = np.tile([0.0, 0.0, 1.0], (X.size, 1))
+    locations, ray_idx, _ = trunk.ray.intersects_location(ray_origins, ray_dirs, multiple_hits=True)
+
+    order = np.lexsort((locations[:, 2], ray_idx))
+    ray_idx, hit_z = ray_idx[order], locations[order, 2]
+    for r in np.unique(ray_idx):
+        zs = hit_z[ray_idx == r]
+        # Rays through shared edges report the same hit twice
+        zs = zs[np.concatenate([[True], np.diff(zs) > 1e-6])]
+        if len(zs) >= 2:
+            node_floor[r], node_ceiling[r] = zs[0], zs[1]
+
+    node_floor = node_floor.reshape(nx + 1, ny + 1)
+    node_ceiling = node_ceiling.reshape(nx + 1, ny + 1)
+    floor = _window(node_floor, 2, 2, np.max)
+    ceiling = _window(node_ceiling, 2, 2, np.min)
+    return {'origin': origin, 'pitch': pitch, 'floor': floor, 'ceiling': ceiling}
+
+def heightmap_packing(trunk, bags_info, progress_callback=None, pitch=HEIGHTMAP_PITCH):
+    logger.info("Starting heightmap_packing...")
+    start_time = time.time()
+    if progress_callback: progress_callback(0.0, "🗺️ Building trunk heightmap...")
+    hm = get_trunk_heightmap(trunk, pitch)
+    origin, floor, ceiling = hm['origin'], hm['floor'], hm['ceiling']
+    skyline = floor + TOLERANCE
+    top_limit = get_usable_trunk_bounds(trunk)[1][2] - TOLERANCE
+
+    all_bags_data = []
+    for i, bag_info in enumerate(bags_info):
+        if len(bag_info) == 2:
+            btype, sz = bag_info
+            all_bags_data.append({'original_idx': i, 'btype': btype, 'size': sz, 'mesh': create_bag(btype, sz)})
+        elif len(bag_info) == 4:
+            btype, length, breadth, thickness = bag_info
+            all_bags_data.append({
+                'original_idx': i, 'btype': 'Custom',
+                'size': f'{length:.0f}×{breadth:.0f}×{thickness:.0f}cm',
+                'mesh': create_custom_bag(length, breadth, thickness)
+            })
+    sorted_bags = sorted(all_bags_data, key=lambda item: item['mesh'].volume, reverse=True)
+
+    placed_info, unplaced_info = [], []
+    total_bags = len(sorted_bags)
+    for n, bag_data in enumerate(sorted_bags):
+        if progress_callback:
+            progress_callback(n / max(total_bags, 1), f"Placing bag {n+1}/{total_bags} ({bag_data['btype']})...")
+        best = None  # (layer, row, column, rotation, i, j, w, d)
+        for bag_rotation in unique_rotations(bag_data['mesh']):
+            extents = bag_rotation.extents
+            w, d = int(np.ceil(extents[0] / pitch)), int(np.ceil(extents[1] / pitch))
+            if w > skyline.shape[0] or d > skyline.shape[1]:
+                continue
+            base = _window(skyline, w, d, np.max)
+            roof = np.minimum(_window(ceiling, w, d, np.min), top_limit)
+            ok = np.isfinite(base) & (base + extents[2] <= roof)
+            if not np.any(ok):
+                continue
+            ii, jj = np.nonzero(ok)
+            # Lowest layer first (bases bucketed by pitch, like the grid engine's
+            # z steps), then front-most row, then left-most column
+            layer = np.floor((base[ii, jj] - origin[2]) / pitch)
+            k = np.lexsort((ii, jj, layer))[0]
+            cand = (float(layer[k]), int(jj[k]), int(ii[k]))
+            if best is None or cand < best[:3]:
+                best = cand + (bag_rotation, int(ii[k]), int(jj[k]), w, d)
+
+        if best is None:
+            dims = bag_data['mesh'].extents * 100
+            unplaced_info.append({
+                "Bag": f"{bag_data['btype']} ({bag_data['size']})",
+                "Dimensions (cm)": f"{dims[0]:.1f}x{dims[1]:.1f}x{dims[2]:.1f}",
+                "Reason": "No suitable position found"
+            })
+            continue
+        _, _, _, bag_rotation, i, j, w, d = best
+        base_z = float(skyline[i:i + w, j:j + d].max())
+        corner = (origin[0] + i * pitch, origin[1] + j * pitch, base_z)
+        placed_mesh = _box_at(bag_rotation, corner)
+        skyline[i:i + w, j:j + d] = base_z + bag_rotation.extents[2]
+        placed_info.append({
+            'bag_mesh': placed_mesh, 'btype': bag_data['btype'],
+            'size': bag_data['size'], 'original_idx': bag_data['original_idx']
+        })
+
+    if progress_callback: progress_callback(1.0, "✅ Packing completed!")
+    return {"placed_bags_info": placed_info, "unplaced_bags_info": unplaced_info, "processing_time": float(time.time() - start_time)}
@@ -0,0 +1,85 @@
+import base64
+import numpy as np
+
+# --------------------------------------------------------------------------
+# COMPACT MESH ENCODING ("qmesh1")
+# --------------------------------------------------------------------------
+# Indexed mesh for the client instead of a binary STL triangle soup:
+#   positions  uint16 little-endian (x, y, z) per vertex, quantized to the
+#              mesh bounds (step = extent / 65535 per axis)
+#   indices    triangle corner indices, delta-coded against the previous
+#              index, zigzag-mapped and written as LEB128 varints
+# Vertices that quantize to the same position are merged, and vertices are
+# renumbered in order of first use so consecutive deltas stay small.
+
+QMESH_FORMAT = "qmesh1"
+QUANT_LEVELS = 65535
+
+def _varint_encode(values):
+    """LEB128 bytes for non-negative integers, vectorized over 7-bit groups."""
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return b""
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    remaining = values >> np.uint64(7)
+    while np.any(remaining):
+        n_bytes += remaining > 0
+        remaining >>= np.uint64(7)
+    out = np.zeros(int(n_bytes.sum()), dtype=np.uint8)
+    start = np.cumsum(n_bytes) - n_bytes
+    for k in range(int(n_bytes.max())):
+        rows = n_bytes > k
+        group = (values[rows] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (n_bytes[rows] > k + 1).astype(np.uint8) << 7
+        out[start[rows] + k] = group.astype(np.uint8) | more
+    return out.tobytes()
+
+def _varint_decode(data, count):
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)[:count]
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    values = np.zeros(count, dtype=np.int64)
+    for k in range(int((ends - starts).max()) + 1 if count else 0):
+        pos = starts + k
+        rows = pos <= ends
+        values[rows] |= (raw[pos[rows]].astype(np.int64) & 0x7F) << (7 * k)
+    return values
+
+def encode_mesh(mesh):
+    """JSON-ready qmesh1 dict for a trimesh mesh."""
+    lo, hi = mesh.bounds
+    extent = np.where(hi - lo > 0, hi - lo, 1.0)
+    quantized = np.round((mesh.vertices - lo) / extent * QUANT_LEVELS).astype(np.uint16)
+    # Merge vertices that share a quantized position and drop collapsed faces
+    unique, remap = np.unique(quantized, axis=0, return_inverse=True)
+    faces = remap.ravel()[mesh.faces]
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    # Renumber vertices by first use
+    flat = faces.ravel()
+    _, first = np.unique(flat, return_index=True)
+    order = np.unique(flat)[np.argsort(first)]
+    renumber = np.empty(len(unique), dtype=np.int64)
+    renumber[order] = np.arange(len(order))
+    flat = renumber[flat]
+    deltas = np.diff(flat, prepend=0)
+    zigzag = np.where(deltas >= 0, deltas * 2, -deltas * 2 - 1)
+    return {
+        "format": QMESH_FORMAT,
+        "bounds": [lo.tolist(), hi.tolist()],
+        "vertex_count": int(len(order)),
+        "face_count": int(len(faces)),
+        "positions": base64.b64encode(unique[order].astype('<u2').tobytes()).decode('ascii'),
+        "indices": base64.b64encode(_varint_encode(zigzag)).decode('ascii'),
+    }
+
+def decode_mesh(payload):
+    """(vertices float64 (n, 3), faces int64 (m, 3)) from a qmesh1 dict."""
+    if payload.get("format") != QMESH_FORMAT:
+        raise ValueError(f"Unsupported mesh format: {payload.get('format')}")
+    lo, hi = (np.asarray(b, dtype=float) for b in payload["bounds"])
+    extent = np.where(hi - lo > 0, hi - lo, 1.0)
+    positions = np.frombuffer(base64.b64decode(payload["positions"]), dtype='<u2').reshape(-1, 3)
+    vertices = lo + positions.astype(float) / QUANT_LEVELS * extent
+    zigzag = _varint_decode(base64.b64decode(payload["indices"]), 3 * payload["face_count"])
+    deltas = np.where(zigzag % 2 == 0, zigzag // 2, -(zigzag + 1) // 2)
+    return vertices, np.cumsum(deltas).reshape(-1, 3)
@@ -0,0 +1,203 @@
+import itertools
+import numpy as np
+import time
+import logging
+from trimesh.creation import box
+
+from core.engine import (
+    create_bag,
+    create_custom_bag,
+    unique_rotations,
+    placement_lattice,
+    interior_grid,
+    strict_containment_or_voxel,
+    optimized_packing,
+    unplaced_bags_report,
+    CONTAINMENT_VOXEL_PITCH,
+    GRID_STEP_CLOUD,
+    IS_CLOUD,
+    MESH_BAG,
+)
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# ORIENTED (TILTED) PLACEMENT
+# --------------------------------------------------------------------------
+# Sloped seat backs and wheel-arch bulges can leave room for a tilted bag
+# where no axis-aligned one fits. The "oriented" engine runs the regular
+# pipeline, then retries every bag it left out at each axis permutation
+# tilted by TILT_ANGLES about either horizontal axis, both ways. Candidates
+# are scanned a whole lattice of positions at a time:
+#   containment  the 8 box corners must lie in interior cells of the trunk
+#                (interior_grid at CONTAINMENT_VOXEL_PITCH)
+#   collision    separating-axis test against every placed bag as an
+#                oriented box (15 axes per pair), vectorized over candidates
+# The lowest (z, y, x) candidate wins, as in fittest_placement, after an
+# exact mesh containment check. Tilted bags carry their 'rotation' and
+# 'half_extents' in the placement info.
+
+TILT_ANGLES = (10.0, 20.0, 30.0)  # degrees
+SAT_TOLERANCE = 1e-9  # boxes that only touch do not collide
+CANDIDATE_CHUNK = 2048
+
+def tilt_rotations(angles=TILT_ANGLES):
+    """Rotation matrices tilting by each angle about the x and y axes, both ways."""
+    rotations = []
+    for axis, angle, sign in itertools.product((0, 1), angles, (1, -1)):
+        theta = np.radians(angle) * sign
+        c, s = np.cos(theta), np.sin(theta)
+        if axis == 0:
+            rotations.append(np.array([[1, 0, 0], [0, c, -s], [0, s, c]]))
+        else:
+            rotations.append(np.array([[c, 0, s], [0, 1, 0], [-s, 0, c]]))
+    return rotations
+
+def bag_obb(info):
+    """(rotation, half extents, center) of a placed bag; untilted bags are their bounds."""
+    lo, hi = info['bag_mesh'].bounds
+    rotation = np.asarray(info.get('rotation', np.eye(3)), dtype=float)
+    half_extents = np.asarray(info['half_extents'], dtype=float) if 'half_extents' in info else (hi - lo) / 2
+    return rotation, half_extents, (lo + hi) / 2
+
+_CORNER_SIGNS = np.array(list(itertools.product((-1.0, 1.0), repeat=3)))
+
+def box_corners(rotation, half_extents, centers):
+    """(M, 8, 3) corners of M boxes sharing one rotation and size."""
+    offsets = (_CORNER_SIGNS * half_extents) @ rotation.T
+    return centers[:, None, :] + offsets[None, :, :]
+
+def sat_collisions(rotation, half_extents, centers, obbs):
+    """(M,) True where a box (rotation, half_extents) at each center overlaps any of `obbs`.
+
+    Separating-axis test over the 3 + 3 face normals and 9 edge cross
+    products of every pair, evaluated for all candidates at once (only for
+    pairs whose bounding boxes overlap); cross products of parallel edges
+    are not axes and are skipped. Callers bound M (see CANDIDATE_CHUNK).
+    """
+    hits = np.zeros(len(centers), dtype=bool)
+    if not obbs or not len(centers):
+        return hits
+    rot_b = np.stack([o[0] for o in obbs])  # (N, 3, 3), columns are box axes
+    half_b = np.stack([o[1] for o in obbs])  # (N, 3)
+    center_b = np.stack([o[2] for o in obbs])  # (N, 3)
+    n = len(obbs)
+    axes_a = np.broadcast_to(rotation.T, (n, 3, 3))
+    axes_b = np.transpose(rot_b, (0, 2, 1))
+    cross = np.cross(axes_a[:, :, None, :], axes_b[:, None, :, :]).reshape(n, 9, 3)
+    axes = np.concatenate([axes_a, axes_b, cross], axis=1)  # (N, 15, 3)
+    norms = np.linalg.norm(axes, axis=2)
+    valid = norms > 1e-9
+    axes = axes / np.where(valid, norms, 1.0)[..., None]
+    radius = (np.abs(axes @ rotation) @ half_extents) + np.einsum('nak,nk->na', np.abs(axes @ rot_b), half_b)
+    offset = np.einsum('nk,nak->na', center_b, axes)
+    # Only pairs whose bounding boxes overlap can collide
+    reach_a = np.abs(rotation) @ half_extents
+    reach_b = np.einsum('njk,nk->nj', np.abs(rot_b), half_b)
+    near = np.all(np.abs(centers[:, None, :] - center_b[None, :, :]) < reach_a + reach_b[None, :, :], axis=2)
+    rows, cols = np.nonzero(near)
+    if len(rows):
+        distance = np.abs(np.einsum('pk,pak->pa', centers[rows], axes[cols]) - offset[cols])
+        separated = valid[cols] & (distance >= radius[cols] - SAT_TOLERANCE)
+        hits[rows[~separated.any(axis=1)]] = True
+    return hits
+
+def points_inside(points, grid_axes, interior, pitch):
+    """Bool per point (any shape (..., 3)): the point lies in an interior cell of the trunk."""
+    z_axis, y_axis, x_axis = grid_axes
+    inside = np.ones(points.shape[:-1], dtype=bool)
+    index = []
+    for dim, axis in zip((2, 1, 0), (z_axis, y_axis, x_axis)):
+        if not len(axis):
+            return np.zeros(points.shape[:-1], dtype=bool)
+        i = np.floor((points[..., dim] - axis[0]) / pitch).astype(np.int64)
+        inside &= (i >= 0) & (i < len(axis))
+        index.append(np.clip(i, 0, len(axis) - 1))
+    return inside & interior[tuple(index)]
+
+def place_tilted(trunk, bag_mesh, placed_bags_info, step, tilts=None):
+    """Lowest tilted placement of a box among the placed bags: (mesh, rotation, half extents) or None."""
+    tilts = tilt_rotations() if tilts is None else tilts
+    grid_axes, interior = interior_grid(trunk, CONTAINMENT_VOXEL_PITCH)
+    obbs = [bag_obb(info) for info in placed_bags_info]
+    best, best_corner = None, None
+    for base in unique_rotations(bag_mesh):
+        half_extents = base.extents / 2
+        for rotation in tilts:
+            reach = np.abs(rotation) @ half_extents
+            z_range, y_range, x_range = placement_lattice(trunk, 2 * reach, step)
+            if not (len(z_range) and len(y_range) and len(x_range)):
+                continue
+            zz, yy, xx = np.meshgrid(z_range, y_range, x_range, indexing='ij')
+            corners_min = np.column_stack([xx.ravel(), yy.ravel(), zz.ravel()])
+            if best_corner is not None:
+                # Only candidates below the incumbent in (z, y, x) order can win
+                keys = corners_min[:, ::-1]
+                earlier = (keys[:, 0] < best_corner[0]) | ((keys[:, 0] == best_corner[0]) & (
+                    (keys[:, 1] < best_corner[1]) | ((keys[:, 1] == best_corner[1]) & (keys[:, 2] < best_corner[2]))))
+                corners_min = corners_min[earlier]
+            centers = corners_min + reach
+            ok = points_inside(box_corners(rotation, half_extents, centers), grid_axes, interior, CONTAINMENT_VOXEL_PITCH).all(axis=1)
+            candidates = np.flatnonzero(ok)
+            # Candidates are in (z, y, x) order: stop at the first chunk holding a winner
+            for start in range(0, len(candidates), CANDIDATE_CHUNK):
+                chunk = candidates[start:start + CANDIDATE_CHUNK]
+                placement = None
+                for k in chunk[~sat_collisions(rotation, half_extents, centers[chunk], obbs)]:
+                    mesh = box(extents=2 * half_extents)
+                    transform = np.eye(4)
+                    transform[:3, :3], transform[:3, 3] = rotation, centers[k]
+                    mesh.apply_transform(transform)
+                    if strict_containment_or_voxel(trunk, mesh):
+                        placement = k, mesh
+                        break
+                if placement is not None:
+                    k, mesh = placement
+                    best = (mesh, rotation, half_extents)
+                    best_corner = tuple(corners_min[k][::-1])
+                    break
+    return best
+
+def oriented_packing(trunk, bags_info, progress_callback=None, search=None, tilt_angles=TILT_ANGLES):
+    """optimized_packing, then tilted placements for the bags it could not place."""
+    logger.info("Starting oriented_packing...")
+    start_time = time.time()
+    report = None
+    if progress_callback:
+        report = lambda fraction, text: progress_callback(0.8 * fraction, text)
+    results = optimized_packing(trunk, bags_info, report, search)
+    placed_bags_info = list(results["placed_bags_info"])
+    placed_indices = {info['original_idx'] for info in placed_bags_info}
+    leftover = [i for i in range(len(bags_info)) if i not in placed_indices]
+    step = results["search"]["step"] if results.get("search") else GRID_STEP_CLOUD if IS_CLOUD else 0.05
+    tilts = tilt_rotations(tilt_angles)
+    # Largest first, as in fittest_placement
+    meshes = {}
+    for i in leftover:
+        bag_info = bags_info[i]
+        if bag_info[0] == MESH_BAG:
+            continue  # only the voxel engine packs mesh bags
+        try:
+            meshes[i] = create_bag(*bag_info) if len(bag_info) == 2 else create_custom_bag(*bag_info[1:])
+        except KeyError:
+            continue
+    for n, i in enumerate(sorted(meshes, key=lambda i: meshes[i].volume, reverse=True)):
+        if progress_callback:
+            progress_callback(0.8 + 0.2 * n / len(meshes), f"📐 Trying tilted placements ({n + 1}/{len(meshes)})...")
+        placement = place_tilted(trunk, meshes[i], placed_bags_info, step, tilts)
+        if placement is None:
+            continue
+        mesh, rotation, half_extents = placement
+        bag_info = bags_info[i]
+        btype, size = (bag_info[0], bag_info[1]) if len(bag_info) == 2 else \
+            ('Custom', f'{bag_info[1]:.0f}×{bag_info[2]:.0f}×{bag_info[3]:.0f}cm')
+        placed_bags_info.append({'bag_mesh': mesh, 'btype': btype, 'size': size, 'original_idx': i,
+                                 'rotation': rotation, 'half_extents': half_extents})
+        placed_indices.add(i)
+    tilted = sum(1 for info in placed_bags_info if 'rotation' in info)
+    logger.info(f"oriented_packing: {tilted} tilted placement(s)")
+    if progress_callback: progress_callback(1.0, "✅ Packing completed!")
+    processing_time = float(time.time() - start_time)
+    return {"placed_bags_info": placed_bags_info, "unplaced_bags_info": unplaced_bags_report(bags_info, placed_indices),
+            "processing_time": processing_time,
+            "search": dict(results["search"], actual_seconds=processing_time) if results.get("search") else None}
@@ -0,0 +1,166 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# ON-DEMAND REQUEST PROFILING
+# --------------------------------------------------------------------------
+# A profiled request runs its packing job under a stack sampler and
+# tracemalloc. Samples are written as folded stacks ("frame;frame;frame N",
+# the input format of flamegraph.pl, speedscope and inferno) next to a JSON
+# summary with the top allocation sites, under a random id. Profiles go to
+# disk so any worker can serve them. Only the call stacks and sizes are
+# kept; request payloads (customer STLs) never are.
+#
+# Profiling is requested with the X-Profile header carrying
+# PROFILE_ADMIN_TOKEN, or happens for a PROFILE_SAMPLE_RATE fraction of
+# requests. One job is profiled at a time (tracemalloc is process-wide).
+# Stored profiles are served to the admin token only; without one they
+# cannot be read at all.
+#
+# Memory figures are approximate: tracemalloc traces the whole process, so
+# allocations made by requests running concurrently in other threads are
+# counted too. The stack samples cover the profiled thread only.
+
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "profiles"))
+MAX_STORED_PROFILES = int(os.getenv("MAX_STORED_PROFILES", "50"))
+SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+TOP_ALLOCATIONS = 25
+TRACEMALLOC_FRAMES = 8
+
+_PROFILE_ID = re.compile(r"[0-9a-f]{32}")
+_profile_lock = threading.Lock()
+
+def is_admin(token):
+    return bool(PROFILE_ADMIN_TOKEN) and token == PROFILE_ADMIN_TOKEN
+
+def should_profile(token=None):
+    return is_admin(token) or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class StackSampler(threading.Thread):
+    """Periodically records the call stack of one thread as folded stacks."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id, self.interval = thread_id, interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            if labels:
+                self.stacks[";".join(reversed(labels))] += 1
+                self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def _store(profile_id, folded, summary):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    for suffix, content in ((".folded", folded), (".json", json.dumps(summary, indent=1))):
+        staging = os.path.join(PROFILE_DIR, f".{profile_id}{suffix}")
+        with open(staging, "w") as f:
+            f.write(content)
+        os.replace(staging, os.path.join(PROFILE_DIR, profile_id + suffix))
+    # Keep the newest MAX_STORED_PROFILES
+    summaries = sorted((entry.stat().st_mtime, entry.name[:-5]) for entry in os.scandir(PROFILE_DIR)
+                       if entry.name.endswith(".json") and not entry.name.startswith("."))
+    for _, old_id in summaries[:-MAX_STORED_PROFILES]:
+        for suffix in (".folded", ".json"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, old_id + suffix))
+            except OSError:
+                pass
+
+def run_profiled(label, fn, *args, **kwargs):
+    """Call fn(*args, **kwargs) under the profiler: returns (result, profile_id).
+
+    profile_id is None when another profile is already being captured; the
+    call then runs unprofiled.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        logger.info(f"PROFILE: skipped for {label} (another profile is running)")
+        return fn(*args, **kwargs), None
+    try:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        sampler = StackSampler(threading.get_ident())
+        started = time.time()
+        sampler.start()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            sampler.stop()
+            elapsed = time.time() - started
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    finally:
+        _profile_lock.release()
+
+    profile_id = uuid.uuid4().hex
+    top = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]).statistics("traceback")[:TOP_ALLOCATIONS]
+    summary = {
+        "id": profile_id,
+        "label": label,
+        "created": started,
+        "wall_seconds": round(elapsed, 4),
+        "samples": sampler.samples,
+        "sample_interval_seconds": SAMPLE_INTERVAL,
+        "peak_traced_bytes": peak,
+        "retained_traced_bytes": current,
+        # Process-wide: includes allocations of concurrent requests
+        "memory_scope": "process",
+        "top_allocations": [
+            {"size_bytes": stat.size, "count": stat.count,
+             "traceback": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]}
+            for stat in top
+        ],
+    }
+    folded = "".join(f"{stack} {count}\n" for stack, count in sampler.stacks.most_common())
+    try:
+        _store(profile_id, folded, summary)
+    except OSError as e:
+        logger.error(f"PROFILE: could not store {profile_id}: {e}")
+        return result, None
+    logger.info(f"PROFILE: {label} captured as {profile_id} ({sampler.samples} samples, peak {peak / 1e6:.1f} MB)")
+    return result, profile_id
+
+def maybe_profiled(enabled, label, fn, *args, **kwargs):
+    """run_profiled when `enabled`, else a plain call; returns (result, profile_id or None)."""
+    if enabled:
+        return run_profiled(label, fn, *args, **kwargs)
+    return fn(*args, **kwargs), None
+
+def load_profile(profile_id, fmt="folded"):
+    """Stored profile as folded-stack text or summary dict; None if unknown."""
+    if not _PROFILE_ID.fullmatch(profile_id or ""):
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id + (".folded" if fmt == "folded" else ".json"))
+    try:
+        with open(path) as f:
+            return f.read() if fmt == "folded" else json.load(f)
+    except OSError:
+        return None
@@ -0,0 +1,377 @@
+import os
+import base64
+import hashlib
+import numpy as np
+import trimesh
+import uuid
+import logging
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from trimesh.creation import box
+
+from core.engine import bags_data, get_trunk, trunk_key, optimized_packing, incremental_packing, seeded_packing, serialize_packing_results, MESH_FORMATS
+from core.engine import create_bag, create_custom_bag, unique_rotations, estimate_trunk_shape, trunk_is_preprocessed
+from core.engine import free_space_analysis, homogeneous_packing, CAPACITY_MAX_COUNT, STEP_LADDER, calculate_space_utilization, MESH_BAG
+from core.engine import plan_search, plan_search_for_shape
+from core.engine import find_trunk, trunk_is_stored, serialize_placed_bags, trunk_mesh_payload, mesh_to_stl_base64, export_scene_to_stl, trunk_lod, QMESH_FORMAT
+from core.admission import estimate_cost
+from core.artifacts import save_artifacts, load_artifacts
+from core.heightmap import heightmap_packing
+from core.oriented import oriented_packing
+from core.voxel import voxel_packing
+
+logger = logging.getLogger(__name__)
+
+# Packing engines selectable per request via OptimizationRequest.engine
+PACKING_ENGINES = {
+    "grid": optimized_packing,
+    "heightmap": heightmap_packing,
+    "oriented": oriented_packing,
+    "voxel": voxel_packing,
+}
+# Engines that can pack mesh (STL) bags
+MESH_ENGINES = ("voxel",)
+
+# --------------------------------------------------------------------------
+# JOB COST (admission control, see core.admission)
+# --------------------------------------------------------------------------
+# Trunk shape used when an upload cannot even be parsed; loading it will fail
+DEFAULT_TRUNK_EXTENTS = (1.3, 0.8, 0.7)
+DEFAULT_TRUNK_FACES = 1000
+
+def estimate_job_cost(bags_info, trunk_bytes=None, trunk=None, include_load=True, step=None):
+    """Predicted JobCost of packing `bags_info` into a loaded `trunk` or the STL in `trunk_bytes`.
+
+    Priced at the step and run time the search planner picks for this
+    request, unless `step` fixes the step.
+    """
+    if trunk is not None:
+        extents, load_bytes = trunk.extents, 0
+        plan = plan_search(trunk, bags_info) if step is None else None
+    else:
+        extents, faces = estimate_trunk_shape(trunk_bytes) or (DEFAULT_TRUNK_EXTENTS, DEFAULT_TRUNK_FACES)
+        load_bytes = len(trunk_bytes) if include_load and not trunk_is_preprocessed(trunk_bytes) else 0
+        plan = plan_search_for_shape(extents, faces, bags_info) if step is None else None
+    rotations, custom = [], []
+    for bag_info in bags_info:
+        if bag_info[0] == MESH_BAG:
+            rotations.append(24)  # every axis rotation of an irregular shape
+            custom.append(True)
+            continue
+        try:
+            mesh = create_bag(*bag_info) if len(bag_info) == 2 else create_custom_bag(*bag_info[1:])
+            rotations.append(len(unique_rotations(mesh)))
+        except KeyError:
+            rotations.append(6)  # unknown bag; the engine reports it
+        custom.append(len(bag_info) != 2)
+    if plan is None:
+        return estimate_cost(rotations, custom, extents, step, load_bytes)
+    return estimate_cost(rotations, custom, extents, plan["step"], load_bytes, predicted_seconds=plan["predicted_seconds"])
+
+# --------------------------------------------------------------------------
+# CAPACITY QUERIES
+# --------------------------------------------------------------------------
+def bag_item(bag_info):
+    """Request-style bag dict (see api.BagItem) of a bags_info entry."""
+    if bag_info[0] == MESH_BAG:
+        return {"type": MESH_BAG, "size": bag_info[1], "mesh_stl": base64.b64encode(bag_info[2]).decode("utf-8")}
+    if len(bag_info) == 2:
+        return {"type": bag_info[0], "size": bag_info[1]}
+    return {"type": "Custom", "dimensions": list(bag_info[1:])}
+
+def estimate_capacity_cost(bags_info, trunk_bytes=None, trunk=None):
+    # Capacity searches usually run at the finest step of the ladder
+    return estimate_job_cost(bags_info, trunk_bytes=trunk_bytes, trunk=trunk, step=STEP_LADDER[0])
+
+def run_capacity(trunk, bags_info, mesh_format="stl", max_count=CAPACITY_MAX_COUNT):
+    """Capacity of the trunk for each bag, as (response payload, [engine results per bag]).
+
+    The trunk mesh is sent once at the top level; each entry carries the
+    count and its layout in the /optimize payload format.
+    """
+    payload = {"success": True, "capacities": []}
+    all_results = []
+    for bag_info in bags_info:
+        results = homogeneous_packing(trunk, bag_info, max_count)
+        layout = serialize_packing_results(trunk, results, mesh_format)
+        for key in ("trunk_mesh", "trunk_mesh_compact", "trunk_mesh_format"):
+            payload[key] = layout.pop(key)
+        del layout["success"], layout["unplaced_bags"]
+        payload["capacities"].append(dict(bag=bag_item(bag_info), **results["capacity"], **layout))
+        all_results.append(results)
+    return payload, all_results
+
+# --------------------------------------------------------------------------
+# PARALLEL SCENARIO EVALUATION
+# --------------------------------------------------------------------------
+MAX_BATCH_SCENARIOS = 50
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "0")) or max(1, (os.cpu_count() or 2) - 1)
+
+_executor = None
+def get_executor():
+    global _executor
+    if _executor is None:
+        logger.info(f"Starting scenario worker pool ({BATCH_WORKERS} workers)")
+        _executor = ProcessPoolExecutor(max_workers=BATCH_WORKERS)
+    return _executor
+
+def run_scenario(key, bags_info, engine_name="grid", mesh_format="stl", trunk_bytes=None):
+    """Pack one scenario: (response payload, compact layout for its history entry).
+
+    Runs inside a worker process. The trunk is mapped from the artifact store
+    by its hash `key`, so the STL does not travel with every scenario;
+    `trunk_bytes` is only needed when the store cannot serve it.
+    """
+    trunk = find_trunk(key)
+    if trunk is None:
+        if trunk_bytes is None:
+            raise RuntimeError(f"Trunk {key[:12]} is not in the artifact store")
+        trunk = get_trunk(trunk_bytes)
+    results = PACKING_ENGINES[engine_name](trunk, bags_info, progress_callback=None)
+    payload = serialize_packing_results(trunk, results, mesh_format)
+    payload["engine"] = engine_name
+    return payload, compact_layout(results)
+
+# --------------------------------------------------------------------------
+# COMPACT LAYOUTS (comparison workers, stored history)
+# --------------------------------------------------------------------------
+# Placements without meshes: every bag is its id, position (bounds min
+# corner) and extents in metres. Tilted bags add their rotation and half
+# extents, mesh bags their vertices and faces (a mesh_ref in stored history).
+# restore_bag rebuilds the engine's placement info from an item.
+def layout_item(info):
+    lo, hi = info["bag_mesh"].bounds
+    item = {"id": info["original_idx"], "type": info["btype"], "size": info["size"],
+            "position": lo.tolist(), "extents": (hi - lo).tolist()}
+    if info["btype"] == MESH_BAG:  # irregular bag from the voxel engine
+        mesh = info["bag_mesh"]
+        item.update(vertices=mesh.vertices.tolist(), faces=mesh.faces.tolist())
+    elif "rotation" in info:  # tilted bag from the oriented engine
+        item.update(rotation=np.asarray(info["rotation"]).tolist(), half_extents=np.asarray(info["half_extents"]).tolist())
+    return item
+
+def restore_bag(item):
+    info = {"btype": item["type"], "size": item["size"], "original_idx": item["id"]}
+    lo = np.array(item["position"])
+    hi = lo + np.array(item["extents"])
+    if "vertices" in item:
+        return dict(info, bag_mesh=trimesh.Trimesh(item["vertices"], item["faces"], process=False))
+    if "mesh_ref" in item:
+        stored = load_artifacts(item["mesh_ref"])
+        if stored is not None:
+            arrays = stored[1]
+            return dict(info, bag_mesh=trimesh.Trimesh(np.array(arrays["vertices"]), np.array(arrays["faces"]), process=False))
+        return dict(info, bag_mesh=box(bounds=[lo, hi]), mesh_missing=True)
+    if "rotation" not in item:
+        return dict(info, bag_mesh=box(bounds=[lo, hi]))
+    rotation, half_extents = np.array(item["rotation"]), np.array(item["half_extents"])
+    transform = np.eye(4)
+    transform[:3, :3], transform[:3, 3] = rotation, (lo + hi) / 2
+    return dict(info, bag_mesh=box(extents=2 * half_extents, transform=transform),
+                rotation=rotation, half_extents=half_extents)
+
+def compact_layout(results):
+    return {"placed": [layout_item(info) for info in results["placed_bags_info"]],
+            "unplaced": results["unplaced_bags_info"]}
+
+def restore_layout(layout, processing_time=0.0, search=None):
+    """Engine results dict rebuilt from a compact_layout."""
+    return {"placed_bags_info": [restore_bag(item) for item in layout["placed"]],
+            "unplaced_bags_info": layout["unplaced"], "processing_time": processing_time, "search": search}
+
+# --------------------------------------------------------------------------
+# CROSS-VEHICLE COMPARISON
+# --------------------------------------------------------------------------
+def compare_scenario(trunk_bytes, bags_info, engine_name="grid"):
+    """Pack one car for /compare (in a worker process): summary plus a compact layout."""
+    trunk = get_trunk(trunk_bytes)
+    results = PACKING_ENGINES[engine_name](trunk, bags_info, progress_callback=None)
+    stats = calculate_space_utilization(trunk, results["placed_bags_info"])
+    return {
+        "placed_count": len(results["placed_bags_info"]),
+        "unplaced_count": len(results["unplaced_bags_info"]),
+        "volume_utilization": float(stats["volume_utilization"]),
+        "processing_time": results.get("processing_time", 0.0),
+        "layout": compact_layout(results),
+        "search": results.get("search"),
+    }
+
+# --------------------------------------------------------------------------
+# HISTORY REPLAY
+# --------------------------------------------------------------------------
+# History entries keep the full inputs, the trunk hash and a compact layout,
+# so a past result is shown again straight from storage: the trunk comes from
+# the trunk cache or the artifact store, and no engine runs. Mesh bags are
+# kept by reference so entries stay far below MongoDB's 16 MB document limit:
+# inputs record the STL's sha256, and placed meshes go to the artifact store
+# under a content hash (mesh_ref). A replay whose mesh has been evicted, or
+# was stored on another host, shows that bag as its bounding box.
+MESH_ARTIFACT_PREFIX = "meshbag-"
+
+def _history_bag_item(bag_info):
+    if bag_info[0] == MESH_BAG:
+        return {"type": MESH_BAG, "size": bag_info[1], "mesh_sha256": hashlib.sha256(bag_info[2]).hexdigest()}
+    return bag_item(bag_info)
+
+def _history_layout_item(item):
+    if "vertices" not in item:
+        return item
+    vertices = np.ascontiguousarray(item["vertices"], dtype=np.float64)
+    faces = np.ascontiguousarray(item["faces"], dtype=np.int64)
+    key = MESH_ARTIFACT_PREFIX + hashlib.sha256(vertices.tobytes() + faces.tobytes()).hexdigest()
+    save_artifacts(key, {"vertices": vertices, "faces": faces}, {})
+    item = {k: v for k, v in item.items() if k not in ("vertices", "faces")}
+    return dict(item, mesh_ref=key)
+
+def history_details(car_model, engine_name, bags_info, trunk_key, layout):
+    """Fields stored with a history entry besides car_model and stats (mesh bags by reference)."""
+    return {
+        "engine": engine_name,
+        "trunk_key": trunk_key,
+        "inputs": {"car_model": car_model, "engine": engine_name, "bags": [_history_bag_item(b) for b in bags_info]},
+        "layout": dict(layout, placed=[_history_layout_item(item) for item in layout["placed"]]),
+    }
+
+def replay_history_entry(entry, mesh_format="stl"):
+    """/optimize-style payload of a stored history entry.
+
+    When the trunk is in neither the cache nor the artifact store, the
+    payload carries the bags without a trunk mesh (trunk_available false);
+    mesh bags whose stored mesh is gone come back as boxes (bag_meshes_available false).
+    """
+    placed = restore_layout(entry["layout"])["placed_bags_info"]
+    trunk = find_trunk(entry["trunk_key"])
+    payload = {
+        "success": True,
+        "entry_id": entry["entry_id"],
+        "car_model": entry.get("car_model"),
+        "engine": entry.get("engine"),
+        "placed_bags": serialize_placed_bags(placed),
+        "unplaced_bags": entry["layout"]["unplaced"],
+        "stats": entry["stats"],
+        "trunk_key": entry["trunk_key"],
+        "trunk_available": trunk is not None,
+        "bag_meshes_available": not any(info.get("mesh_missing") for info in placed),
+        "trunk_mesh": None,
+        "trunk_mesh_compact": None,
+        "trunk_mesh_format": mesh_format,
+        "packed_stl": None,
+        "processing_time": 0.0,
+    }
+    if trunk is not None:
+        if mesh_format == QMESH_FORMAT:
+            payload["trunk_mesh_compact"] = trunk_mesh_payload(trunk, mesh_format)
+        else:
+            payload["trunk_mesh"] = trunk_mesh_payload(trunk)
+        if placed:
+            payload["packed_stl"] = mesh_to_stl_base64(export_scene_to_stl(trunk_lod(trunk, 'export'), placed))
+    return payload
+
+# --------------------------------------------------------------------------
+# RESULT STORE (incremental re-optimization)
+# --------------------------------------------------------------------------
+# The most recent /optimize results are kept in memory with their trunk, bag
+# list and engine, so a follow-up request can send only the bags added or
+# removed. Incremental edits run the grid stages (incremental_packing), so
+# they only apply to layouts the grid engine (or a capacity search) produced.
+INCREMENTAL_ENGINES = ("grid",)
+MAX_STORED_RESULTS = int(os.getenv("MAX_STORED_RESULTS", "100"))
+
+_results = OrderedDict()
+_results_lock = threading.Lock()
+# trunk hash -> {result_id: bag signature} of the stored results (warm starts)
+_layout_index = {}
+
+def store_result(trunk, bags_info, results, engine_name="grid"):
+    result_id = uuid.uuid4().hex
+    key = trunk.metadata.get("trunk_key")
+    with _results_lock:
+        _results[result_id] = {"trunk": trunk, "bags_info": list(bags_info), "results": results, "engine": engine_name}
+        if key is not None:
+            _layout_index.setdefault(key, OrderedDict())[result_id] = bag_signature(bags_info)
+        while len(_results) > MAX_STORED_RESULTS:
+            old_id, old = _results.popitem(last=False)
+            entries = _layout_index.get(old["trunk"].metadata.get("trunk_key"), {})
+            entries.pop(old_id, None)
+            if not entries:
+                _layout_index.pop(old["trunk"].metadata.get("trunk_key"), None)
+    return result_id
+
+def get_result(result_id):
+    with _results_lock:
+        record = _results.get(result_id)
+        if record is not None:
+            _results.move_to_end(result_id)
+        return record
+
+# --------------------------------------------------------------------------
+# WARM START (see engine.seeded_packing)
+# --------------------------------------------------------------------------
+# Repeat traffic mostly packs the same car with nearly the same bags. The
+# stored result on the same trunk whose bag multiset is nearest (bags added
+# plus bags removed, at most WARM_START_MAX_DISTANCE) seeds the new run: each
+# of its placements goes to a new bag of the same kind. Mesh bags and tilted
+# placements are never seeds.
+WARM_START_MAX_DISTANCE = int(os.getenv("WARM_START_MAX_DISTANCE", "4"))
+
+def bag_signature(bags_info):
+    """Multiset of the box bags in a loadout."""
+    return Counter(bag_info for bag_info in bags_info if bag_info[0] != MESH_BAG)
+
+def find_seed_layout(trunk, bags_info, max_distance=WARM_START_MAX_DISTANCE):
+    """(result_id, distance, seeds, vacated) from the nearest stored layout on `trunk`, or None.
+
+    Ties go to the most recent result. Seeds are relabelled placement infos
+    whose original_idx indexes `bags_info`; vacated are the bounds of the
+    stored placements no new bag took over.
+    """
+    wanted = bag_signature(bags_info)
+    with _results_lock:
+        entries = list(_layout_index.get(trunk.metadata.get("trunk_key"), {}).items())
+    best = None
+    for result_id, signature in reversed(entries):
+        if not (wanted & signature):
+            continue
+        distance = sum((wanted - signature).values()) + sum((signature - wanted).values())
+        if distance <= max_distance and (best is None or distance < best[1]):
+            best = (result_id, distance)
+    if best is None:
+        return None
+    record = get_result(best[0])
+    if record is None:  # evicted meanwhile
+        return None
+    free = {}
+    for i, bag_info in enumerate(bags_info):
+        free.setdefault(bag_info, []).append(i)
+    seeds, vacated = [], []
+    for info in record["results"]["placed_bags_info"]:
+        targets = free.get(record["bags_info"][info["original_idx"]])
+        if targets and info["btype"] != MESH_BAG and "rotation" not in info:
+            seeds.append(dict(info, original_idx=targets.pop(0)))
+        else:
+            vacated.append(info["bag_mesh"].bounds.copy())
+    return best[0], best[1], seeds, vacated
+
+def warm_start_packing(trunk, bags_info, progress_callback=None):
+    """optimized_packing started from the nearest stored layout: (results, warm start info or None).
+
+    Runs cold when no stored layout is near, when none of its placements is
+    still feasible, or when the warm run leaves more bags out than the
+    stored layout did; the cold result is then kept if it places more.
+    """
+    match = find_seed_layout(trunk, bags_info)
+    if match is None:
+        return optimized_packing(trunk, bags_info, progress_callback), None
+    result_id, distance, seeds, vacated = match
+    results = seeded_packing(trunk, bags_info, seeds, vacated, progress_callback)
+    source = get_result(result_id)
+    source_unplaced = len(source["results"]["unplaced_bags_info"]) if source else 0
+    if results is not None and len(results["unplaced_bags_info"]) <= source_unplaced:
+        return results, {"seed_result_id": result_id, "distance": distance, "seeded": results["seeded"]}
+    logger.info(f"Warm start from {result_id[:8]} fell short; packing from scratch")
+    cold = optimized_packing(trunk, bags_info, progress_callback)
+    if results is None or len(cold["placed_bags_info"]) > len(results["placed_bags_info"]):
+        return cold, None
+    return results, {"seed_result_id": result_id, "distance": distance, "seeded": results["seeded"]}
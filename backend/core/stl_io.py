@@ -0,0 +1,93 @@
+import os
+import re
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# STL INGESTION
+# --------------------------------------------------------------------------
+# Binary STL is read straight out of the upload buffer with np.frombuffer (no
+# copy of the triangle records) after checking that the buffer holds the
+# header's triangle count, so malformed or oversized uploads are rejected
+# before any parsing work. Vertices are deduplicated in one vectorized pass.
+
+MAX_STL_BYTES = int(os.getenv("MAX_STL_BYTES", str(64 * 1024 * 1024)))
+MAX_STL_TRIANGLES = int(os.getenv("MAX_STL_TRIANGLES", "2000000"))
+
+STL_HEADER_BYTES = 84
+STL_RECORD = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attributes', '<u2')])
+
+class STLFormatError(ValueError):
+    """The payload is not a readable STL file."""
+
+class STLTooLargeError(STLFormatError):
+    """The payload exceeds MAX_STL_BYTES / MAX_STL_TRIANGLES."""
+
+def check_stl_size(num_bytes, max_bytes=MAX_STL_BYTES):
+    if num_bytes > max_bytes:
+        raise STLTooLargeError(f"STL file is {num_bytes / 1e6:.1f} MB; the limit is {max_bytes / 1e6:.1f} MB")
+
+def _binary_triangle_count(data):
+    # Bytes after the last record are ignored (several exporters pad or
+    # append to the file). ASCII text cannot pass: its bytes at 80..84 read
+    # as a count of over 10^8 triangles.
+    if len(data) < STL_HEADER_BYTES:
+        return None
+    count = int(np.frombuffer(data, dtype='<u4', count=1, offset=80)[0])
+    if STL_HEADER_BYTES + count * STL_RECORD.itemsize > len(data):
+        return None
+    return count
+
+def _read_binary(data, count):
+    records = np.frombuffer(data, dtype=STL_RECORD, count=count, offset=STL_HEADER_BYTES)
+    return records['vertices']
+
+_ASCII_VERTEX = re.compile(rb'vertex\s+(\S+)\s+(\S+)\s+(\S+)', re.IGNORECASE)
+
+def _read_ascii(data):
+    try:
+        coords = np.array(_ASCII_VERTEX.findall(data), dtype=np.float64)
+    except ValueError:
+        raise STLFormatError("ASCII STL contains a malformed vertex")
+    if len(coords) == 0 or len(coords) % 3:
+        raise STLFormatError("ASCII STL has no complete facets")
+    return coords.reshape(-1, 3, 3)
+
+def read_stl_triangles(data, max_bytes=MAX_STL_BYTES):
+    """(n, 3, 3) triangle array from binary or ASCII STL bytes; binary is a view into `data`."""
+    check_stl_size(len(data), max_bytes)
+    count = _binary_triangle_count(data)
+    if count is not None:
+        if count > MAX_STL_TRIANGLES:
+            raise STLTooLargeError(f"STL has {count} triangles; the limit is {MAX_STL_TRIANGLES}")
+        triangles = _read_binary(data, count)
+    elif bytes(data[:5]).lower() == b'solid':
+        triangles = _read_ascii(bytes(data))
+        if len(triangles) > MAX_STL_TRIANGLES:
+            raise STLTooLargeError(f"STL has {len(triangles)} triangles; the limit is {MAX_STL_TRIANGLES}")
+    else:
+        raise STLFormatError("Binary STL is shorter than its triangle count (truncated or not an STL)")
+    if len(triangles) == 0:
+        raise STLFormatError("STL contains no triangles")
+    if not np.all(np.isfinite(triangles)):
+        raise STLFormatError("STL contains non-finite coordinates")
+    return triangles
+
+def index_triangles(triangles):
+    """Deduplicate exactly-equal corners: returns (vertices float64, faces int64)."""
+    # Adding zero copies into a contiguous array and folds -0.0 into 0.0
+    corners = triangles.reshape(-1, 3) + triangles.dtype.type(0)
+    # Compare whole xyz rows as single opaque keys: one sort, no per-axis lexsort
+    keys = corners.view(np.dtype((np.void, corners.dtype.itemsize * 3))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    vertices = corners[first].astype(np.float64)
+    faces = inverse.reshape(-1, 3).astype(np.int64)
+    return vertices, faces
+
+def read_stl(data, max_bytes=MAX_STL_BYTES):
+    import trimesh  # kept local so the API can import the size checks without the engine
+    triangles = read_stl_triangles(data, max_bytes)
+    vertices, faces = index_triangles(triangles)
+    return trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
@@ -0,0 +1,293 @@
+import itertools
+import numpy as np
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from scipy import ndimage
+
+from core.engine import (
+    bag_mesh_for,
+    unique_rotations,
+    interior_grid,
+    unplaced_bags_report,
+    CONTAINMENT_VOXEL_PITCH,
+    MESH_BAG,
+)
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------------------------------
+# VOXEL BITSET PACKING (MESH BAGS)
+# --------------------------------------------------------------------------
+# Irregular bags are packed on the trunk's containment grid instead of as
+# meshes. The trunk interior and the space taken by placed bags are bitsets
+# with one bit per cell along x (uint64 words, shape (z, y, words)); each
+# bag orientation is a kernel of occupied cells tiled by boxes ("blocks").
+#   free       interior & ~occupied
+#   fits at p  every kernel block, shifted by p, lies in free
+# so one orientation is tested at every position at once: the AND over all
+# blocks of "block-sized box free at p" shifted by the block's offset. Those
+# maps are built by doubling (free & free shifted 1, then 2, ... cells) and
+# shared by every block of that size; a box bag is a single block. The lowest (z, y, x) set bit is the
+# placement, as in fittest_placement; placing a bag ORs its kernel into the
+# occupied grid. Box bags use exact cell-aligned kernels, so the "voxel"
+# engine packs mixed loads. Mesh kernels are conservative: the surface is
+# sampled every 0.2 cell, every cell within 0.3 cell of a sample is marked
+# and enclosed cavities are filled; the 24 axis rotations of a bag are
+# exact rotations of that one kernel.
+
+VOXEL_PITCH = CONTAINMENT_VOXEL_PITCH
+SAMPLE_SPACING = 0.2  # cells between surface samples
+VERTEX_REACH = 0.3  # cells marked around each sample
+ORIENTATION_CACHE_LIMIT = 64
+_WORD = np.uint64(64)
+
+def cube_rotations():
+    """The 24 proper rotations that map the axes onto each other."""
+    rotations = []
+    for perm in itertools.permutations(range(3)):
+        for signs in itertools.product((1, -1), repeat=3):
+            rotation = np.zeros((3, 3))
+            rotation[range(3), perm] = signs
+            if np.linalg.det(rotation) > 0:
+                rotations.append(rotation)
+    return rotations
+
+def pack_cells(cells):
+    """(Z, Y, X) bool grid as (Z, Y, W) uint64 words, bit i of word j = cell x = 64 j + i."""
+    packed = np.packbits(cells, axis=2, bitorder='little')
+    pad = -packed.shape[2] % 8
+    if pad:
+        packed = np.pad(packed, ((0, 0), (0, 0), (0, pad)))
+    return np.ascontiguousarray(packed).view('<u8')
+
+def shift_bits(bits, dz, dy, dx):
+    """Bitset whose bit (z, y, x) is bit (z + dz, y + dy, x + dx) of `bits` (0 past the end)."""
+    out = np.zeros_like(bits)
+    Z, Y, W = bits.shape
+    q, r = divmod(int(dx), 64)
+    if dz >= Z or dy >= Y or q >= W:
+        return out
+    src = bits[dz:, dy:, q:]
+    dst = out[:Z - dz, :Y - dy, :W - q]
+    if r == 0:
+        dst[...] = src
+    else:
+        dst[...] = src >> np.uint64(r)
+        dst[..., :-1] |= src[..., 1:] << (_WORD - np.uint64(r))
+    return out
+
+def _merge_consecutive(values):
+    """[(start, length)] of the runs of consecutive integers in sorted `values`."""
+    runs = []
+    for v in values:
+        if runs and runs[-1][0] + runs[-1][1] == v:
+            runs[-1][1] += 1
+        else:
+            runs.append([v, 1])
+    return runs
+
+def kernel_blocks(kernel):
+    """[(z, y, x, depth, height, length)] boxes of occupied cells that tile a (z, y, x) kernel.
+
+    Runs along x are merged over consecutive y rows, then over consecutive
+    z layers; a solid box is a single block.
+    """
+    padded = np.pad(kernel, ((0, 0), (0, 0), (1, 1))).astype(np.int8)
+    z, y, x = np.nonzero(np.diff(padded, axis=2))
+    # Edges come in (start, stop) pairs, row by row
+    rows = {}
+    for zi, yi, start, stop in zip(z[::2].tolist(), y[::2].tolist(), x[::2].tolist(), x[1::2].tolist()):
+        rows.setdefault((zi, start, stop - start), []).append(yi)
+    slabs = {}
+    for (zi, start, length), ys in rows.items():
+        for y0, height in _merge_consecutive(ys):
+            slabs.setdefault((y0, height, start, length), []).append(zi)
+    return [(z0, y0, start, depth, height, length)
+            for (y0, height, start, length), zs in slabs.items() for z0, depth in _merge_consecutive(sorted(zs))]
+
+def feasible_positions(free, blocks):
+    """Bitset of the positions where a kernel made of `blocks` lies entirely in `free`."""
+    solid = {(1, 1, 1): free}
+
+    def all_free(depth, height, length):
+        # Cells (z..z+depth-1, y..y+height-1, x..x+length-1) all free, by doubling
+        key = (depth, height, length)
+        if key not in solid:
+            for axis, size in enumerate(key):
+                if size > 1:
+                    half = size // 2
+                    lower, upper, offset = list(key), list(key), [0, 0, 0]
+                    lower[axis], upper[axis], offset[axis] = half, size - half, half
+                    solid[key] = all_free(*lower) & shift_bits(all_free(*upper), *offset)
+                    break
+        return solid[key]
+
+    fits = None
+    for n, (z, y, x, depth, height, length) in enumerate(blocks):
+        term = shift_bits(all_free(depth, height, length), z, y, x)
+        fits = term if fits is None else fits & term
+        if n % 64 == 63 and not fits.any():
+            break
+    return fits
+
+def lowest_position(bits):
+    """(z, y, x) of the lowest set bit in (z, y, x) order, or None."""
+    flat = bits.reshape(-1)
+    words = np.flatnonzero(flat)
+    if not len(words):
+        return None
+    word = int(flat[words[0]])
+    z, y, w = np.unravel_index(words[0], bits.shape)
+    return int(z), int(y), 64 * int(w) + (word & -word).bit_length() - 1
+
+def box_kernel(extents, pitch=VOXEL_PITCH):
+    """Cells covered by a box whose min corner sits on a cell corner."""
+    return np.ones(tuple(np.ceil(np.asarray(extents)[::-1] / pitch - 1e-6).astype(int)), dtype=bool)
+
+def surface_samples(vertices, faces, spacing):
+    """Points on every triangle, no surface point farther than `spacing` from one.
+
+    Each triangle v0 + s e1 + t e2 (e1 its longest edge from v0) is sampled
+    on an s, t grid with steps under `spacing` along both edges, t clamped
+    to the triangle, so long thin faces get few samples.
+    """
+    triangles = vertices[faces]
+    edges = np.linalg.norm(triangles - np.roll(triangles, -1, axis=1), axis=2)  # v0v1, v1v2, v2v0
+    # Rotate each triangle so that v0v1 is its longest edge
+    first = np.argmax(edges, axis=1)
+    order = (first[:, None] + np.arange(3)) % 3
+    triangles = np.take_along_axis(triangles, order[:, :, None], axis=1)
+    e1, e2 = triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+    n1 = np.maximum(np.ceil(np.linalg.norm(e1, axis=1) / spacing), 1).astype(np.int64)
+    n2 = np.maximum(np.ceil(np.linalg.norm(e2, axis=1) / spacing), 1).astype(np.int64)
+    counts = (n1 + 1) * (n2 + 1)
+    face = np.repeat(np.arange(len(triangles)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    s = (local // (n2[face] + 1)) / n1[face]
+    t = np.minimum((local % (n2[face] + 1)) / n2[face], 1.0 - s)
+    return triangles[face, 0] + s[:, None] * e1[face] + t[:, None] * e2[face]
+
+def mesh_kernel(mesh, pitch=VOXEL_PITCH):
+    """(kernel, origin): conservative (z, y, x) cells of a mesh, enclosed cavities filled."""
+    reach = VERTEX_REACH * pitch
+    points = surface_samples(mesh.vertices, mesh.faces, SAMPLE_SPACING * pitch)
+    origin = points.min(axis=0) - reach
+    shape = np.floor((points.max(axis=0) + reach - origin) / pitch).astype(np.int64) + 1
+    kernel = np.zeros(shape[::-1], dtype=bool)
+    for offset in itertools.product((-reach, reach), repeat=3):
+        cells = np.floor((points + offset - origin) / pitch).astype(np.int64)
+        kernel[cells[:, 2], cells[:, 1], cells[:, 0]] = True
+    return ndimage.binary_fill_holes(kernel), origin
+
+def rotate_kernel(kernel, origin, rotation, pitch=VOXEL_PITCH):
+    """Kernel and origin of a cell set turned by a cube rotation (exact, no resampling)."""
+    perm = np.argmax(np.abs(rotation), axis=1)  # new axis i is old axis perm[i]
+    signs = rotation[np.arange(3), perm]
+    size = np.array(kernel.shape[::-1]) * pitch  # x, y, z
+    cells = np.transpose(kernel, [2 - perm[2 - a] for a in range(3)])
+    new_origin = np.empty(3)
+    for i in range(3):
+        if signs[i] < 0:
+            cells = np.flip(cells, axis=2 - i)
+            new_origin[i] = -(origin[perm[i]] + size[perm[i]])
+        else:
+            new_origin[i] = origin[perm[i]]
+    return np.ascontiguousarray(cells), new_origin
+
+_orientation_cache = OrderedDict()
+_orientation_lock = threading.Lock()
+
+def bag_orientations(bag_info, pitch=VOXEL_PITCH):
+    """[(oriented mesh, kernel blocks, kernel, origin)] for each distinct voxel shape of a bag.
+
+    `origin` is the corner of the kernel's first cell in the oriented mesh's
+    frame; placing the kernel at a trunk cell moves that corner onto the cell.
+    """
+    key = (hashlib.sha256(bag_info[2]).hexdigest() if bag_info[0] == MESH_BAG else repr(bag_info), float(pitch))
+    with _orientation_lock:
+        orientations = _orientation_cache.get(key)
+        if orientations is not None:
+            _orientation_cache.move_to_end(key)
+            return orientations
+    mesh = bag_mesh_for(bag_info)
+    orientations = []
+    if bag_info[0] == MESH_BAG:
+        base_kernel, base_origin = mesh_kernel(mesh, pitch)
+        seen = set()
+        for rotation in cube_rotations():
+            kernel, origin = rotate_kernel(base_kernel, base_origin, rotation, pitch)
+            shape_key = (kernel.shape, np.packbits(kernel).tobytes())
+            if shape_key in seen:
+                continue
+            seen.add(shape_key)
+            transform = np.eye(4)
+            transform[:3, :3] = rotation
+            orientations.append((mesh.copy().apply_transform(transform), kernel_blocks(kernel), kernel, origin))
+    else:
+        for rotated in unique_rotations(mesh):
+            kernel = box_kernel(rotated.extents, pitch)
+            orientations.append((rotated, kernel_blocks(kernel), kernel, rotated.bounds[0]))
+    with _orientation_lock:
+        _orientation_cache[key] = orientations
+        while len(_orientation_cache) > ORIENTATION_CACHE_LIMIT:
+            _orientation_cache.popitem(last=False)
+    return orientations
+
+def _bag_label(bag_info):
+    if bag_info[0] == MESH_BAG or len(bag_info) == 2:
+        return bag_info[0], bag_info[1]
+    return 'Custom', f'{bag_info[1]:.0f}×{bag_info[2]:.0f}×{bag_info[3]:.0f}cm'
+
+def voxel_packing(trunk, bags_info, progress_callback=None, search=None, pitch=VOXEL_PITCH):
+    """Pack box and mesh bags largest first at the lowest free cell of the trunk grid.
+
+    `search` is accepted for engine compatibility; the grid pitch is fixed.
+    """
+    logger.info("Starting voxel_packing...")
+    start_time = time.time()
+    (z_axis, y_axis, x_axis), interior = interior_grid(trunk, pitch)
+    interior_bits = pack_cells(interior)
+    occupied = np.zeros_like(interior)
+    bags = []
+    for i, bag_info in enumerate(bags_info):
+        try:
+            orientations = bag_orientations(bag_info, pitch)
+        except Exception as e:
+            logger.warning(f"voxel_packing: skipping bag {i} ({bag_info[0]}): {e}")
+            continue
+        bags.append((i, orientations))
+    # Largest first, by occupied cells
+    bags.sort(key=lambda item: int(item[1][0][2].sum()) if item[1] else 0, reverse=True)
+
+    placed_bags_info = []
+    free = interior_bits
+    for n, (i, orientations) in enumerate(bags):
+        if progress_callback:
+            progress_callback(n / len(bags), f"Placing bag {n + 1}/{len(bags)} ({bags_info[i][0]})...")
+        best = None
+        for oriented, blocks, kernel, origin in orientations:
+            if any(k > g for k, g in zip(kernel.shape, interior.shape)):
+                continue
+            position = lowest_position(feasible_positions(free, blocks))
+            if position is not None and (best is None or position < best[0]):
+                best = (position, oriented, kernel, origin)
+        if best is None:
+            continue
+        (z, y, x), oriented, kernel, origin = best
+        kz, ky, kx = kernel.shape
+        occupied[z:z + kz, y:y + ky, x:x + kx] |= kernel
+        free = interior_bits & ~pack_cells(occupied)
+        btype, size = _bag_label(bags_info[i])
+        corner = np.array([x_axis[x], y_axis[y], z_axis[z]])
+        placed_bags_info.append({'bag_mesh': oriented.copy().apply_translation(corner - origin),
+                                 'btype': btype, 'size': size, 'original_idx': i})
+
+    placed_indices = {info['original_idx'] for info in placed_bags_info}
+    if progress_callback: progress_callback(1.0, "✅ Packing completed!")
+    processing_time = float(time.time() - start_time)
+    logger.info(f"voxel_packing: placed {len(placed_bags_info)}/{len(bags_info)} in {processing_time:.2f}s")
+    return {"placed_bags_info": placed_bags_info, "unplaced_bags_info": unplaced_bags_report(bags_info, placed_indices),
+            "processing_time": processing_time, "search": None}
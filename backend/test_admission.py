@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from core.admission import AdmissionController, AdmissionRejected, JobCost
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_fifo_queueing():
+    async def scenario():
+        controller = AdmissionController(cpu_budget=2.0, memory_budget_mb=100.0, max_queue=4, queue_timeout=5.0)
+        order = []
+        release_first = asyncio.Event()
+
+        async def job(name, cost, hold=None):
+            async with controller.admit(cost):
+                order.append(name)
+                if hold is not None:
+                    await hold.wait()
+
+        first = asyncio.create_task(job("first", JobCost(2.0, 10.0), release_first))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(job("second", JobCost(1.0, 10.0)))
+        third = asyncio.create_task(job("third", JobCost(1.0, 10.0)))
+        await asyncio.sleep(0.01)
+        assert order == ["first"]
+        assert len(controller._waiting) == 2 and controller.in_flight == 1
+        release_first.set()
+        await asyncio.gather(first, second, third)
+        assert order == ["first", "second", "third"]
+        assert controller.in_flight == 0 and controller.cpu_in_use == 0.0
+        assert controller.admitted_total == 3
+
+    run(scenario())
+
+def test_too_large_is_413():
+    async def scenario():
+        controller = AdmissionController(cpu_budget=2.0, memory_budget_mb=100.0)
+        with pytest.raises(AdmissionRejected) as info:
+            async with controller.admit(JobCost(1.0, 500.0)):
+                pass
+        assert info.value.status == 413 and info.value.retry_after is None
+        assert controller.rejected_total["too_large"] == 1
+
+    run(scenario())
+
+def test_full_queue_is_429_with_retry_after():
+    async def scenario():
+        controller = AdmissionController(cpu_budget=2.0, memory_budget_mb=100.0, max_queue=1, queue_timeout=5.0)
+        hold = asyncio.Event()
+
+        async def job(cost):
+            async with controller.admit(cost):
+                await hold.wait()
+
+        running = asyncio.create_task(job(JobCost(2.0, 10.0)))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(job(JobCost(1.5, 10.0)))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as info:
+            async with controller.admit(JobCost(1.0, 10.0)):
+                pass
+        assert info.value.status == 429
+        # 2 CPU-s running plus 1.5 queued drain in about 4 s
+        assert info.value.retry_after == 4
+        assert controller.rejected_total["queue_full"] == 1
+        hold.set()
+        await asyncio.gather(running, queued)
+
+    run(scenario())
+
+def test_queue_timeout_is_429():
+    async def scenario():
+        controller = AdmissionController(cpu_budget=1.0, memory_budget_mb=100.0, max_queue=4, queue_timeout=0.05)
+        async with controller.admit(JobCost(1.0, 10.0)):
+            with pytest.raises(AdmissionRejected) as info:
+                async with controller.admit(JobCost(1.0, 10.0)):
+                    pass
+            assert info.value.status == 429 and info.value.retry_after >= 1
+            assert not controller._waiting
+        assert controller.rejected_total["queue_timeout"] == 1
+        assert controller.in_flight == 0
+
+    run(scenario())
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController(cpu_budget=1.0, memory_budget_mb=100.0, max_queue=4, queue_timeout=5.0)
+        async with controller.admit(JobCost(1.0, 10.0)):
+            async def waiter():
+                async with controller.admit(JobCost(1.0, 10.0)):
+                    pass
+            task = asyncio.create_task(waiter())
+            await asyncio.sleep(0.01)
+            assert len(controller._waiting) == 1
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert not controller._waiting
+        assert controller.in_flight == 0 and controller.cpu_in_use == 0.0
+
+    run(scenario())
+
+def test_api_sends_retry_after_header():
+    fastapi_testclient = pytest.importorskip("fastapi.testclient")
+    import api
+    busy = AdmissionController(cpu_budget=1.0, memory_budget_mb=1000.0, max_queue=0)
+    busy.cpu_in_use = 1.0  # budget taken by running work
+    original, api.admission = api.admission, busy
+    try:
+        client = fastapi_testclient.TestClient(api.app)
+        response = client.post("/optimize", json={"car_model": "Renault Kiger", "bags": [{"type": "Backpack Bag", "size": "SMALL"}]})
+    finally:
+        api.admission = original
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-q"])
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from core.collision import CollisionWorld
+
+def cube(corner, size=1.0):
+    lo = np.asarray(corner, dtype=float)
+    return np.array([lo, lo + size])
+
+def test_add_and_collide():
+    world = CollisionWorld()
+    world.add("a", cube([0, 0, 0]))
+    assert "a" in world and len(world) == 1
+    assert world.collides(cube([0.5, 0.5, 0.5]))
+    assert not world.collides(cube([2, 0, 0]))
+
+def test_touching_boxes_do_not_collide():
+    world = CollisionWorld()
+    world.add("a", cube([0, 0, 0]))
+    assert not world.collides(cube([1, 0, 0]))
+    assert not world.collides(cube([0, 0, 1]))
+
+def test_duplicate_add_is_rejected():
+    world = CollisionWorld()
+    world.add("a", cube([0, 0, 0]))
+    with pytest.raises(KeyError):
+        world.add("a", cube([5, 0, 0]))
+
+def test_move():
+    world = CollisionWorld()
+    world.add("a", cube([0, 0, 0]))
+    world.move("a", cube([5, 0, 0]))
+    np.testing.assert_array_equal(world.bounds("a"), cube([5, 0, 0]))
+    assert not world.collides(cube([0, 0, 0]))
+    assert world.collides(cube([5.5, 0, 0]))
+
+def test_remove_frees_the_row():
+    world = CollisionWorld(capacity=2)
+    world.add("a", cube([0, 0, 0]))
+    world.add("b", cube([2, 0, 0]))
+    world.remove("a")
+    assert "a" not in world and len(world) == 1
+    assert not world.collides(cube([0, 0, 0]))
+    world.add("c", cube([4, 0, 0]))  # reuses a's row instead of growing
+    assert len(world._active) == 2
+    assert world.collides(cube([4.5, 0, 0]))
+    with pytest.raises(KeyError):
+        world.remove("a")
+
+def test_exclude():
+    world = CollisionWorld()
+    world.add("a", cube([0, 0, 0]))
+    world.add("b", cube([3, 0, 0]))
+    assert not world.collides(cube([0.5, 0, 0]), exclude="a")
+    assert world.collides(cube([3.5, 0, 0]), exclude="a")
+    assert world.collides(cube([0.5, 0, 0]), exclude="missing")
+    assert world.all_bounds(exclude="a").shape == (1, 2, 3)
+    np.testing.assert_array_equal(world.all_bounds(exclude="a")[0], cube([3, 0, 0]))
+
+def test_grows_past_capacity():
+    world = CollisionWorld(capacity=1)
+    for i in range(5):
+        world.add(i, cube([2 * i, 0, 0]))
+    assert len(world) == 5
+    assert all(world.collides(cube([2 * i + 0.5, 0, 0])) for i in range(5))
+    assert not world.collides(cube([1.0, 0, 0], size=0.5))
+
+def test_empty_world():
+    world = CollisionWorld()
+    assert not world.collides(cube([0, 0, 0]))
+    assert world.all_bounds().shape == (0, 2, 3)
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-q"])
@@ -0,0 +1,70 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from core.engine import largest_empty_boxes, _largest_box_on_layer
+
+def brute_force_largest(free, min_cells=1, z0=None):
+    """Cells of the largest all-True box (sides >= min_cells, bottom layer z0 if given), trying every box."""
+    table = np.zeros(tuple(n + 1 for n in free.shape), dtype=np.int64)
+    table[1:, 1:, 1:] = free.cumsum(0).cumsum(1).cumsum(2)
+    best = 0
+    nz, ny, nx = free.shape
+    bottoms = range(nz) if z0 is None else [z0]
+    for z0, y0, x0 in itertools.product(bottoms, range(ny), range(nx)):
+        for z1, y1, x1 in itertools.product(range(z0 + min_cells, nz + 1), range(y0 + min_cells, ny + 1), range(x0 + min_cells, nx + 1)):
+            cells = (z1 - z0) * (y1 - y0) * (x1 - x0)
+            if cells <= best:
+                continue
+            filled = (table[z1, y1, x1] - table[z0, y1, x1] - table[z1, y0, x1] - table[z1, y1, x0]
+                      + table[z0, y0, x1] + table[z0, y1, x0] + table[z1, y0, x0] - table[z0, y0, x0])
+            if filled == cells:
+                best = cells
+    return best
+
+def random_grids(count, shape=(5, 6, 7), seed=7):
+    rng = np.random.default_rng(seed)
+    for density in np.linspace(0.55, 0.95, count):
+        yield rng.random(shape) < density
+
+def box_slice(box):
+    (z, y, x), (d, h, w) = box[1], box[2]
+    return slice(z, z + d), slice(y, y + h), slice(x, x + w)
+
+@pytest.mark.parametrize("min_cells", [1, 2])
+def test_largest_box_matches_brute_force(min_cells):
+    for free in random_grids(12):
+        boxes = largest_empty_boxes(free.copy(), 1, min_cells)
+        expected = brute_force_largest(free, min_cells)
+        if expected == 0:
+            assert boxes == []
+            continue
+        cells, _, size = boxes[0]
+        assert cells == expected
+        assert min(size) >= min_cells
+        assert free[box_slice(boxes[0])].all()
+
+def test_layer_solver_matches_brute_force():
+    for free in random_grids(6, shape=(4, 5, 6), seed=3):
+        for z0 in range(free.shape[0]):
+            box = _largest_box_on_layer(free, z0)
+            assert (box[0] if box else 0) == brute_force_largest(free, z0=z0)
+
+def test_peeling_is_greedy_and_disjoint():
+    for free in random_grids(6):
+        remaining = free.copy()
+        boxes = largest_empty_boxes(free.copy(), 4)
+        for box in boxes:
+            # Each peeled box is the largest of what the earlier ones left
+            assert box[0] == brute_force_largest(remaining)
+            assert remaining[box_slice(box)].all()
+            remaining[box_slice(box)] = False
+
+def test_full_and_empty_grids():
+    full = np.ones((3, 4, 5), dtype=bool)
+    assert largest_empty_boxes(full.copy(), 2) == [(60, (0, 0, 0), (3, 4, 5))]
+    assert largest_empty_boxes(np.zeros((3, 4, 5), dtype=bool), 2) == []
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-q"])
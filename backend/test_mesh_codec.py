@@ -0,0 +1,53 @@
+import json
+
+import numpy as np
+import pytest
+import trimesh
+
+from core.mesh_codec import encode_mesh, decode_mesh, _varint_encode, _varint_decode, QUANT_LEVELS
+
+def assert_round_trip(mesh):
+    payload = json.loads(json.dumps(encode_mesh(mesh)))
+    vertices, faces = decode_mesh(payload)
+    assert faces.shape == mesh.faces.shape
+    # Faces keep their order and corner order; every corner is within half a
+    # quantization step of the original on each axis
+    step = mesh.extents / QUANT_LEVELS
+    error = np.abs(vertices[faces] - mesh.vertices[mesh.faces])
+    assert np.all(error <= step / 2 + 1e-12)
+    return payload
+
+def test_round_trip_sphere():
+    assert_round_trip(trimesh.creation.icosphere(subdivisions=3, radius=0.4))
+
+def test_round_trip_trunk_scale_box():
+    mesh = trimesh.creation.box(extents=[1.2, 0.8, 0.6])
+    mesh.apply_translation([3.0, -2.0, 0.5])
+    assert_round_trip(mesh)
+
+def test_flat_mesh_round_trip():
+    # Zero extent on one axis must not divide by zero
+    mesh = trimesh.Trimesh(vertices=[[0, 0, 0], [1, 0, 0], [0, 1, 0], [1, 1, 0]], faces=[[0, 1, 2], [1, 3, 2]])
+    assert_round_trip(mesh)
+
+def test_triangle_soup_is_indexed():
+    # STL-style soup: every face has its own three vertices
+    mesh = trimesh.creation.box(extents=[1.0, 1.0, 1.0])
+    soup = trimesh.Trimesh(vertices=mesh.vertices[mesh.faces].reshape(-1, 3),
+                           faces=np.arange(3 * len(mesh.faces)).reshape(-1, 3), process=False)
+    payload = assert_round_trip(soup)
+    assert payload["vertex_count"] == 8
+
+def test_varint_round_trip():
+    values = np.array([0, 1, 127, 128, 300, 16383, 16384, 2 ** 31, 2 ** 40], dtype=np.int64)
+    np.testing.assert_array_equal(_varint_decode(_varint_encode(values), len(values)), values)
+    assert _varint_encode([]) == b""
+
+def test_unknown_format_is_rejected():
+    payload = encode_mesh(trimesh.creation.box())
+    payload["format"] = "qmesh0"
+    with pytest.raises(ValueError):
+        decode_mesh(payload)
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-q"])
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+import trimesh
+
+from core.stl_io import read_stl, read_stl_triangles, STLFormatError
+
+def ascii_cube(upper=False, newline="\n"):
+    """ASCII STL of a unit cube, optionally upper case with other line endings (as CAD exporters write)."""
+    mesh = trimesh.creation.box(extents=[1.0, 1.0, 1.0])
+    text = mesh.export(file_type='stl_ascii')
+    if upper:
+        text = text.upper()
+    return newline.join(text.splitlines()).encode()
+
+def test_ascii_lower_case():
+    assert read_stl_triangles(ascii_cube()).shape == (12, 3, 3)
+
+def test_ascii_upper_case_crlf():
+    data = ascii_cube(upper=True, newline="\r\n")
+    triangles = read_stl_triangles(data)
+    assert triangles.shape == (12, 3, 3)
+    np.testing.assert_allclose(triangles, read_stl_triangles(ascii_cube()))
+    mesh = read_stl(data)
+    assert len(mesh.faces) == 12
+    assert mesh.is_watertight
+
+def test_binary_matches_ascii():
+    mesh = trimesh.creation.box(extents=[1.0, 1.0, 1.0])
+    binary = read_stl_triangles(mesh.export(file_type='stl'))
+    np.testing.assert_allclose(binary, read_stl_triangles(ascii_cube(upper=True)), atol=1e-6)
+
+def test_binary_with_trailing_bytes():
+    data = trimesh.creation.box(extents=[1.0, 1.0, 1.0]).export(file_type='stl')
+    np.testing.assert_array_equal(read_stl_triangles(data + b"\0" * 7), read_stl_triangles(data))
+
+def test_truncated_binary_is_rejected():
+    data = trimesh.creation.box(extents=[1.0, 1.0, 1.0]).export(file_type='stl')
+    with pytest.raises(STLFormatError):
+        read_stl_triangles(data[:-10])
+
+def test_ascii_without_facets_is_rejected():
+    with pytest.raises(STLFormatError):
+        read_stl_triangles(b"solid empty\r\nendsolid empty\r\n")
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-q"])
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from core.voxel import pack_cells, shift_bits, kernel_blocks, feasible_positions, lowest_position, rotate_kernel, cube_rotations
+
+def unpack_cells(bits, nx):
+    """Inverse of pack_cells for a grid `nx` cells wide."""
+    return np.unpackbits(bits.view(np.uint8), axis=2, bitorder='little')[..., :nx].astype(bool)
+
+def naive_shift(cells, dz, dy, dx):
+    out = np.zeros_like(cells)
+    Z, Y, X = cells.shape
+    out[:max(Z - dz, 0), :max(Y - dy, 0), :max(X - dx, 0)] = cells[dz:, dy:, dx:]
+    return out
+
+def naive_fits(free, kernel):
+    """Positions where every kernel cell lands on a free cell, one kernel cell at a time."""
+    fits = np.ones_like(free)
+    for z, y, x in np.argwhere(kernel):
+        fits &= naive_shift(free, z, y, x)
+    return fits
+
+def random_cells(shape, density, seed):
+    return np.random.default_rng(seed).random(shape) < density
+
+def test_pack_round_trip():
+    cells = random_cells((3, 4, 150), 0.5, 1)
+    bits = pack_cells(cells)
+    assert bits.shape == (3, 4, 3) and bits.dtype == np.uint64
+    np.testing.assert_array_equal(unpack_cells(bits, 150), cells)
+
+@pytest.mark.parametrize("dz, dy, dx", [(0, 0, 0), (0, 0, 1), (0, 0, 63), (0, 0, 64), (0, 0, 65), (1, 2, 130), (2, 0, 149), (0, 4, 0), (3, 0, 5)])
+def test_shift_bits_matches_naive(dz, dy, dx):
+    cells = random_cells((3, 4, 150), 0.5, 2)
+    shifted = shift_bits(pack_cells(cells), dz, dy, dx)
+    np.testing.assert_array_equal(unpack_cells(shifted, 150), naive_shift(cells, dz, dy, dx))
+
+def test_kernel_blocks_tile_the_kernel():
+    for seed in range(5):
+        kernel = random_cells((4, 5, 6), 0.6, seed)
+        covered = np.zeros(kernel.shape, dtype=int)
+        for z, y, x, depth, height, length in kernel_blocks(kernel):
+            covered[z:z + depth, y:y + height, x:x + length] += 1
+        np.testing.assert_array_equal(covered, kernel.astype(int))
+
+def test_solid_kernel_is_one_block():
+    assert kernel_blocks(np.ones((2, 3, 4), dtype=bool)) == [(0, 0, 0, 2, 3, 4)]
+
+def test_feasible_positions_match_naive_convolution():
+    nx = 70  # two words, so blocks straddle a word boundary
+    for seed in range(4):
+        free = random_cells((6, 7, nx), 0.85, seed)
+        hollow = random_cells((3, 3, 4), 0.7, seed + 10)
+        hollow[0, 0, 0] = True  # anchor the kernel at its origin
+        for kernel in (np.ones((2, 2, 3), dtype=bool), hollow):
+            fits = feasible_positions(pack_cells(free), kernel_blocks(kernel))
+            expected = naive_fits(free, kernel)
+            np.testing.assert_array_equal(unpack_cells(fits, nx), expected)
+            position = lowest_position(fits)
+            if expected.any():
+                assert position == tuple(int(i) for i in np.argwhere(expected)[0])
+            else:
+                assert position is None
+
+def test_rotated_kernels_keep_their_cells():
+    kernel = random_cells((2, 3, 4), 0.7, 5)
+    shapes = set()
+    for rotation in cube_rotations():
+        rotated, _ = rotate_kernel(kernel, np.zeros(3), rotation)
+        assert rotated.sum() == kernel.sum()
+        assert sorted(rotated.shape) == [2, 3, 4]
+        shapes.add(rotated.shape)
+    assert len(shapes) == 6
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-q"])
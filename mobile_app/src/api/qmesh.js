@@ -0,0 +1,48 @@
+import * as THREE from 'three';
+import { Buffer } from 'buffer';
+
+// Decoder for the backend's compact "qmesh1" trunk encoding (backend/core/mesh_codec.py):
+// uint16 positions quantized to the mesh bounds, and triangle indices that are
+// delta-coded, zigzag-mapped and stored as LEB128 varints.
+const QUANT_LEVELS = 65535;
+
+const toBytes = (base64) => {
+    const buffer = Buffer.from(base64, 'base64');
+    return new Uint8Array(buffer.buffer, buffer.byteOffset, buffer.byteLength);
+};
+
+export function decodeQMesh(payload) {
+    if (!payload || payload.format !== 'qmesh1') return null;
+    const [lo, hi] = payload.bounds;
+    const extent = [0, 1, 2].map(k => (hi[k] - lo[k] > 0 ? hi[k] - lo[k] : 1));
+
+    const positionBytes = toBytes(payload.positions);
+    const view = new DataView(positionBytes.buffer, positionBytes.byteOffset, positionBytes.byteLength);
+    const positions = new Float32Array(payload.vertex_count * 3);
+    for (let i = 0; i < positions.length; i++) {
+        const k = i % 3;
+        positions[i] = lo[k] + (view.getUint16(i * 2, true) / QUANT_LEVELS) * extent[k];
+    }
+
+    const indexBytes = toBytes(payload.indices);
+    const indices = new Uint32Array(payload.face_count * 3);
+    let offset = 0;
+    let previous = 0;
+    for (let i = 0; i < indices.length; i++) {
+        let value = 0;
+        let shift = 0;
+        let byte;
+        do {
+            byte = indexBytes[offset++];
+            value += (byte & 0x7f) * 2 ** shift;
+            shift += 7;
+        } while (byte & 0x80);
+        previous += value % 2 === 0 ? value / 2 : -(value + 1) / 2;
+        indices[i] = previous;
+    }
+
+    const geometry = new THREE.BufferGeometry();
+    geometry.setAttribute('position', new THREE.BufferAttribute(positions, 3));
+    geometry.setIndex(new THREE.BufferAttribute(indices, 1));
+    return geometry;
+}
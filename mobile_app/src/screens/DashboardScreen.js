@@ -112,21 +112,27 @@ import { STLLoader } from 'three-stdlib';
 import * as THREE from 'three';
 import { Buffer } from 'buffer';
 import client from '../api/client';
+import { decodeQMesh } from '../api/qmesh';
 import { COLORS, SPACING, RADIUS, SHADOWS } from '../constants/theme';
 import CarLoading from '../components/CarLoading';
 
 // Polyfill for Buffer
 global.Buffer = Buffer;
 
-// Trunk Viewer for STL
-function TrunkViewer({ stlBase64, color, opacity = 1.0, wireframe = false, transparent = false }) {
+// Trunk Viewer for STL (or the compact qmesh1 encoding)
+function TrunkViewer({ stlBase64, compactMesh, color, opacity = 1.0, wireframe = false, transparent = false }) {
     const geometry = useMemo(() => {
-        if (!stlBase64) return null;
+        if (!stlBase64 && !compactMesh) return null;
         try {
-            const loader = new STLLoader();
-            const buffer = Buffer.from(stlBase64, 'base64');
-            const arrayBuffer = buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength);
-            const geom = loader.parse(arrayBuffer);
+            let geom;
+            if (compactMesh) {
+                geom = decodeQMesh(compactMesh);
+            } else {
+                const loader = new STLLoader();
+                const buffer = Buffer.from(stlBase64, 'base64');
+                const arrayBuffer = buffer.buffer.slice(buffer.byteOffset, buffer.byteOffset + buffer.byteLength);
+                geom = loader.parse(arrayBuffer);
+            }
             if (geom) {
                 geom.computeVertexNormals();
                 geom.center(); // Center the geometry
@@ -137,7 +143,7 @@ function TrunkViewer({ stlBase64, color, opacity = 1.0, wireframe = false, trans
             console.error("TrunkViewer: Failed to parse STL", e);
             return null;
         }
-    }, [stlBase64]);
+    }, [stlBase64, compactMesh]);
 
     if (!geometry) return null;
 
@@ -299,7 +305,8 @@ export default function DashboardScreen() {
                 car_model: car,
                 bags: selectedBags,
                 custom_trunk_file: customTrunkFile,
-                username: user?.username
+                username: user?.username,
+                mesh_format: 'qmesh1'
             };
             const res = await client.post('/optimize', payload);
             if (res.data.success) {
@@ -679,9 +686,10 @@ export default function DashboardScreen() {
                                                 return (
                                                     <group position={adjustedPosition} scale={[scale, scale, scale]}>
                                                         {/* Render Trunk Results */}
-                                                        {optimizationResult.trunk_mesh ? (
+                                                        {optimizationResult.trunk_mesh || optimizationResult.trunk_mesh_compact ? (
                                                             <TrunkViewer
                                                                 stlBase64={optimizationResult.trunk_mesh}
+                                                                compactMesh={optimizationResult.trunk_mesh_compact}
                                                                 color="#9CA3AF"
                                                                 opacity={0.3}
                                                                 transparent={true}